@@ -66,10 +66,13 @@ const Front = () => {
     if (!videoRef.current || !canvas) return;
 
     context.drawImage(videoRef.current, 0, 0, canvas.width, canvas.height);
-    const imageData = canvas.toDataURL("image/jpeg");
+    // Send the frame as a raw JPEG body (no base64/JSON overhead)
+    const imageBlob = await new Promise((resolve) => canvas.toBlob(resolve, "image/jpeg"));
 
     try {
-      const response = await axios.post("http://localhost:5006/recognize", { image: imageData });
+      const response = await axios.post("http://localhost:5006/recognize", imageBlob, {
+        headers: { "Content-Type": "image/jpeg" },
+      });
       const results = response.data;
 
       const now = Date.now();
@@ -0,0 +1,57 @@
+"""Per-face ArcFace latency at different batch sizes on CPU.
+
+Usage (from python-face-api/):
+    python benchmarks/bench_arcface_batch.py [--model w600k_r50.onnx] [--faces 96]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.face_engine import ArcFace
+
+
+def bench(recognizer, crops, batch_size, repeats):
+    # Warmup
+    recognizer.get_embeddings(crops[:batch_size], max_batch_size=batch_size)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        recognizer.get_embeddings(crops, max_batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    return elapsed / (repeats * len(crops))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="w600k_r50_int8.onnx" if os.path.exists("w600k_r50_int8.onnx") else "w600k_r50.onnx")
+    parser.add_argument("--faces", type=int, default=96, help="crops embedded per repeat")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"Model {args.model} not found. Run models/download_models.py first.")
+        sys.exit(1)
+
+    recognizer = ArcFace(args.model)
+    rng = np.random.default_rng(0)
+    crops = list(rng.integers(0, 256, size=(args.faces, 112, 112, 3), dtype=np.uint8))
+
+    print(f"Model: {args.model}  faces: {args.faces}  repeats: {args.repeats}")
+    if recognizer.max_batch_size:
+        print(f"Note: model batch dimension is fixed at {recognizer.max_batch_size}")
+    print(f"{'batch':>6} {'ms/face':>10} {'faces/s':>10} {'speedup':>8}")
+
+    baseline = None
+    for batch_size in args.batch_sizes:
+        per_face = bench(recognizer, crops, batch_size, args.repeats)
+        baseline = baseline or per_face
+        print(f"{batch_size:>6} {per_face * 1000:>10.2f} {1.0 / per_face:>10.1f} {baseline / per_face:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Match cost and top-1 agreement of consolidated galleries against keeping every embedding.
+
+Builds three galleries from the same embeddings: every embedding (the
+default), consolidated in one pass (as load_known_faces does), and
+consolidated incrementally with enrollments of `--per-enroll` images (as
+/enroll does). Each is queried with the same probes. Reported per gallery:
+stored rows, match time per query, top-1 agreement with the full gallery and
+top-1 accuracy.
+
+Synthetic data: `--students` identities with `--photos` embeddings each,
+drawn around `--modes` appearance modes per student (pose, lighting,
+glasses), with student centers clustered around `--groups` shared
+directions. Probes are fresh samples. With `--store embeddings_store` the
+enrolled embeddings from the persistent store are used instead, probed with
+noisy copies of themselves.
+
+Usage (from python-face-api/):
+    python benchmarks/bench_consolidation.py [--students 1000] [--photos 20] [--medoids 2 4 8]
+    python benchmarks/bench_consolidation.py --store embeddings_store
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.consolidation import Consolidator
+from engine.embedding_store import EmbeddingStore
+from engine.gallery import Gallery
+
+
+def normalize(x):
+    return (x / np.linalg.norm(x, axis=-1, keepdims=True)).astype(np.float32)
+
+
+def make_data(students, photos, modes, queries, dim, noise, groups, seed):
+    rng = np.random.default_rng(seed)
+    # Student centers around shared directions, like real face embeddings (see bench_index.py)
+    group_centers = normalize(rng.normal(size=(groups, dim)))
+    centers = normalize(group_centers[rng.integers(0, groups, size=students)]
+                        + rng.normal(scale=0.035, size=(students, dim)))
+    mode_centers = normalize(centers[:, None, :] + rng.normal(scale=0.03, size=(students, modes, dim)))
+
+    def sample(student_idx):
+        mode = rng.integers(0, modes, size=len(student_idx))
+        return normalize(mode_centers[student_idx, mode] + rng.normal(scale=noise, size=(len(student_idx), dim)))
+
+    usns = [f"USN{i:05d}" for i in range(students)]
+    embeddings = sample(np.repeat(np.arange(students), photos)).reshape(students, photos, dim)
+    truth = rng.integers(0, students, size=queries)
+    return {usn: embs for usn, embs in zip(usns, embeddings)}, sample(truth), [usns[i] for i in truth]
+
+
+def load_store(store_dir, queries, noise, seed):
+    with open(os.path.join(store_dir, "manifest.json")) as f:
+        model_key = json.load(f)["model_key"]
+    entries, matrix = EmbeddingStore(None, store_dir, model_key).load()
+    by_usn = {}
+    for entry in entries.values():
+        if entry["row"] is not None:
+            by_usn.setdefault(entry["usn"], []).append(np.asarray(matrix[entry["row"]]))
+    if not by_usn:
+        raise SystemExit(f"No embeddings in {store_dir}")
+    embeddings = {usn: np.stack(embs) for usn, embs in by_usn.items()}
+
+    rng = np.random.default_rng(seed)
+    rows = [(usn, emb) for usn, embs in embeddings.items() for emb in embs]
+    picked = rng.integers(0, len(rows), size=queries)
+    probes = normalize(np.stack([rows[i][1] for i in picked]) + rng.normal(scale=noise, size=(queries, matrix.shape[1])))
+    return embeddings, probes, [rows[i][0] for i in picked]
+
+
+def top1(gallery, probes, batch):
+    start = time.perf_counter()
+    best = []
+    for i in range(0, len(probes), batch):
+        best.extend(m[0][1] if m else None for m in gallery.match(probes[i:i + batch], k=1))
+    return best, (time.perf_counter() - start) / len(probes)
+
+
+def incremental(embeddings, consolidator, per_enroll):
+    gallery = Gallery(consolidator=consolidator)
+    for usn, embs in embeddings.items():
+        for i in range(0, len(embs), per_enroll):
+            gallery.add(usn, embs[i:i + per_enroll])
+    return gallery
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--photos", type=int, default=20, help="embeddings per student (re-enrollments, captures)")
+    parser.add_argument("--modes", type=int, default=3, help="appearance modes per student")
+    parser.add_argument("--medoids", type=int, nargs="+", default=[2, 4, 8], help="max medoids per student")
+    parser.add_argument("--per-enroll", type=int, default=3, help="images per /enroll call in the incremental run")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=30, help="probes per match call (faces per frame)")
+    parser.add_argument("--noise", type=float, default=0.1, help="per-component noise of a sample")
+    parser.add_argument("--groups", type=int, default=256, help="shared directions student centers cluster around")
+    parser.add_argument("--store", default=None, help="use the embeddings of a persistent store instead")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.store:
+        embeddings, probes, truth = load_store(args.store, args.queries, args.noise, args.seed)
+    else:
+        embeddings, probes, truth = make_data(args.students, args.photos, args.modes, args.queries, 512,
+                                              args.noise, args.groups, args.seed)
+
+    full = Gallery()
+    full.replace(embeddings)
+    reference, full_cost = top1(full, probes, args.batch)
+    print(f"Gallery: {full.num_students} students, {full.num_embeddings} embeddings; {len(probes)} probes")
+
+    print(f"\n{'gallery':<22} {'rows':>8} {'us/query':>9} {'speedup':>8} {'agreement':>10} {'top-1 acc':>10}")
+
+    def report(name, gallery, best, cost):
+        agreement = np.mean([a == b for a, b in zip(best, reference)])
+        accuracy = np.mean([a == b for a, b in zip(best, truth)])
+        print(f"{name:<22} {gallery.num_embeddings:>8} {cost * 1e6:>9.1f} {full_cost / cost:>7.2f}x "
+              f"{agreement:>10.4f} {accuracy:>10.4f}")
+
+    report("every embedding", full, reference, full_cost)
+    for medoids in args.medoids:
+        consolidator = Consolidator(max_medoids=medoids)
+        batch = Gallery(consolidator=consolidator)
+        start = time.perf_counter()
+        batch.replace(embeddings)
+        build = time.perf_counter() - start
+        report(f"centroid+{medoids} (load)", batch, *top1(batch, probes, args.batch))
+
+        start = time.perf_counter()
+        grown = incremental(embeddings, consolidator, args.per_enroll)
+        adds = sum(-(-len(e) // args.per_enroll) for e in embeddings.values())
+        per_add = (time.perf_counter() - start) / adds
+        report(f"centroid+{medoids} (enroll)", grown, *top1(grown, probes, args.batch))
+        print(f"{'':<22} consolidate all: {build:.2f}s, per enrollment: {per_add * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Recall@k and queries/sec of the IVF index against brute force.
+
+Synthetic gallery: `--students` identities with `--photos` normalized 512-d
+embeddings each, scattered around a per-student center. Student centers are
+drawn around `--groups` shared directions, mimicking the coarse structure of
+real face embeddings (`--groups 0` gives uniformly random centers, the worst
+case for IVF). Queries are fresh noisy samples of random students, like a
+camera frame of an enrolled face.
+
+Usage (from python-face-api/):
+    python benchmarks/bench_index.py [--students 50000] [--photos 5] [--k 5] [--groups 256]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.index import BruteForceIndex, IVFIndex
+
+
+def normalize(x):
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+
+def make_data(students, photos, queries, dim, noise, groups, seed):
+    rng = np.random.default_rng(seed)
+    if groups:
+        group_centers = normalize(rng.normal(size=(groups, dim)))
+        centers = normalize(group_centers[rng.integers(0, groups, size=students)]
+                            + rng.normal(scale=0.035, size=(students, dim)))
+    else:
+        centers = normalize(rng.normal(size=(students, dim)))
+    gallery = normalize(np.repeat(centers, photos, axis=0) + rng.normal(scale=noise, size=(students * photos, dim)))
+    picked = rng.integers(0, students, size=queries)
+    probes = normalize(centers[picked] + rng.normal(scale=noise, size=(queries, dim)))
+    return gallery, probes
+
+
+def timed_search(index, probes, k, batch, **kwargs):
+    start = time.perf_counter()
+    ids = []
+    for i in range(0, len(probes), batch):
+        ids.append(index.search(probes[i:i + batch], k, **kwargs)[1])
+    elapsed = time.perf_counter() - start
+    return np.concatenate(ids), len(probes) / elapsed
+
+
+def recall(truth, found):
+    hits = [len(set(t.tolist()) & set(f.tolist())) for t, f in zip(truth, found)]
+    return float(np.sum(hits)) / truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=50000)
+    parser.add_argument("--photos", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=30, help="queries per search call (faces per frame)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--noise", type=float, default=0.03, help="per-component noise around a student center")
+    parser.add_argument("--groups", type=int, default=256, help="shared directions student centers cluster around")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    gallery, probes = make_data(args.students, args.photos, args.queries, args.dim, args.noise, args.groups, args.seed)
+    ids = np.arange(len(gallery))
+    print(f"Gallery: {len(gallery)} embeddings ({args.students} students x {args.photos}), {args.queries} queries, k={args.k}")
+
+    brute = BruteForceIndex(args.dim)
+    brute.build(ids, gallery)
+    truth, brute_qps = timed_search(brute, probes, args.k, args.batch)
+
+    ivf = IVFIndex(args.dim, nlist=args.nlist, seed=args.seed)
+    start = time.perf_counter()
+    ivf.build(ids, gallery)
+    print(f"IVF build: {time.perf_counter() - start:.2f}s, {len(ivf._centroids)} cells")
+
+    # Incremental maintenance, as done by /enroll and /delete_student
+    extra = normalize(np.random.default_rng(args.seed + 1).normal(size=(args.photos, args.dim)))
+    extra_ids = np.arange(len(gallery), len(gallery) + len(extra))
+    start = time.perf_counter()
+    ivf.add(extra_ids, extra)
+    ivf.remove(extra_ids)
+    print(f"IVF add+remove of one student: {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    print(f"\n{'index':<16} {'recall@' + str(args.k):>10} {'queries/s':>12} {'speedup':>8}")
+    print(f"{'brute force':<16} {1.0:>10.4f} {brute_qps:>12.1f} {1.0:>7.2f}x")
+    for nprobe in args.nprobe:
+        found, qps = timed_search(ivf, probes, args.k, args.batch, nprobe=nprobe)
+        print(f"{'ivf nprobe=' + str(nprobe):<16} {recall(truth, found):>10.4f} {qps:>12.1f} {qps / brute_qps:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
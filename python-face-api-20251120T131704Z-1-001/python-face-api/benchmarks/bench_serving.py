@@ -0,0 +1,103 @@
+"""Throughput vs. tail latency of /recognize at several concurrent streams.
+
+Starts the API on a local threaded WSGI server and drives it with
+`--streams` client threads, each posting JPEG frames back-to-back under its
+own X-Stream-Id for `--duration` seconds. Runs once with the micro-batching
+dispatcher and once without (each request recognized on its own thread).
+
+Every stream sends the same frame over and over, which the frame gate
+(FRAME_GATE) would answer from its cache after the first one, so the gate is
+off unless `--gate` is given.
+
+Usage (from python-face-api/):
+    python benchmarks/bench_serving.py [--image faces/<usn>/1.jpg] [--streams 1 4 16] [--duration 10]
+"""
+import argparse
+import glob
+import http.client
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def client(port, stream_id, body, stop_at, latencies):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {"Content-Type": "image/jpeg", "X-Stream-Id": stream_id}
+    while time.perf_counter() < stop_at:
+        start = time.perf_counter()
+        conn.request("POST", "/recognize", body=body, headers=headers)
+        conn.getresponse().read()
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def run(port, body, num_streams, duration):
+    stop_at = time.perf_counter() + duration
+    latencies = [[] for _ in range(num_streams)]
+    threads = [threading.Thread(target=client, args=(port, f"bench-{num_streams}-{i}", body, stop_at, latencies[i]))
+               for i in range(num_streams)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    all_latencies = np.concatenate([np.asarray(l) for l in latencies])
+    return len(all_latencies) / elapsed, np.percentile(all_latencies, 50), np.percentile(all_latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", default=None, help="frame to send (default: first image under faces/)")
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per configuration")
+    parser.add_argument("--port", type=int, default=5106)
+    parser.add_argument("--gate", action="store_true", help="keep the frame gate on (repeated frames hit its cache)")
+    args = parser.parse_args()
+
+    image = args.image or next(iter(sorted(glob.glob("faces/*/*.jpg"))), None)
+    if image is None or not os.path.exists(image):
+        print("No frame to send. Pass --image.")
+        sys.exit(1)
+    ok, buf = cv2.imencode(".jpg", cv2.imread(image))
+    body = buf.tobytes()
+
+    import logging
+    from werkzeug.serving import make_server
+    import recognize_api as api
+    from engine.batcher import MicroBatcher
+
+    # Keep the per-request logs out of the measurement
+    logging.disable(logging.INFO)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    if not args.gate:
+        api.streams.gate_factory = None
+
+    server = make_server("127.0.0.1", args.port, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    batched = api.batcher or MicroBatcher(api.recognize_frames, max_batch_size=api.BATCH_MAX_SIZE,
+                                          batch_window=api.BATCH_WINDOW_MS / 1000.0, key=lambda job: job[0].stream_id)
+    print(f"Frame {image}, {args.duration:.0f}s per run, window {batched.batch_window * 1000:.0f} ms, "
+          f"max batch {batched.max_batch_size}, frame gate {'on' if api.streams.gate_factory else 'off'}")
+    print(f"\n{'mode':<10} {'streams':>7} {'frames/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'mean batch':>11}")
+    for mode, mode_batcher in (("unbatched", None), ("batched", batched)):
+        api.batcher = mode_batcher
+        for num_streams in args.streams:
+            run(args.port, body, num_streams, min(1.0, args.duration)) # warmup
+            items, batches = batched.items, batched.batches
+            fps, p50, p99 = run(args.port, body, num_streams, args.duration)
+            mean_batch = (batched.items - items) / max(batched.batches - batches, 1) if mode_batcher else 1.0
+            print(f"{mode:<10} {num_streams:>7} {fps:>9.1f} {p50 * 1000:>8.1f} {p99 * 1000:>8.1f} {mean_batch:>11.2f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""Offline end-to-end benchmark of the recognition pipeline, for regression tracking.
+
+Runs detect -> track -> align -> embed -> match (as in /recognize) on synthetic
+frames for every combination of `--resolutions` and `--faces`, and reports
+per-stage milliseconds per frame, frame latency (p50/p95), throughput and
+peak memory. NMS is also timed on its own at fixed candidate counts
+(`--nms-sizes`, up to the pre_nms_topk cap), since per-frame candidate
+counts vary with the scene. No network and no camera needed.
+
+Models: det_10g.onnx / w600k_r50.onnx when present (override with --det /
+--rec); otherwise small generated stand-ins with the same signatures (see
+standin_models.py, needs the onnx package), or always with --standin.
+With stand-ins the detector responds to the bright patches the frames are
+drawn with; with the real models faces are photos from --face-dir pasted
+into the frames. Stand-in inference time is meaningless, but every stage
+around it runs the real code.
+
+Results are written as JSON (--output). With --baseline, each scenario's
+frame p50 and stage times are compared to a previous run; anything slower by
+more than --tolerance (and by more than --min-ms) is reported and the exit
+status is 1. Compare runs from the same machine and model kind.
+
+Usage (from python-face-api/):
+    python benchmarks/bench_suite.py [--frames 30] [--output bench.json]
+    python benchmarks/bench_suite.py --baseline bench.json [--tolerance 0.15]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import onnxruntime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine import metrics
+from engine.face_engine import FaceEngine
+from engine.gallery import Gallery
+from engine.postprocess import nms
+from engine.tracker import FaceTracker
+
+import standin_models
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# Reported stage -> engine.metrics stage names it sums
+STAGES = {
+    "preprocess": ("detect_preprocess",),
+    "detect": ("detect_inference",),
+    "decode": ("detect_decode",),
+    "nms": ("detect_nms",),
+    "align": ("align",),
+    "embed": ("embed_preprocess", "embed_inference"),
+    "match": ("gallery_match",),
+    "track": ("track_assign",),
+}
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def stage_totals():
+    """{stage: (seconds, calls)} recorded so far."""
+    totals = {}
+    for (name,), child in list(metrics.STAGE_SECONDS._children.items()):
+        with child._lock:
+            totals[name] = (child.sum, sum(child.counts))
+    return totals
+
+
+def load_photos(face_dir):
+    photos = []
+    for root, _, files in os.walk(face_dir):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                img = cv2.imread(os.path.join(root, name))
+                if img is not None:
+                    photos.append(img)
+    return photos
+
+
+class SyntheticScene:
+    """Faces at fixed seats on the detector's 32px grid, jittering a little per frame.
+
+    Positions are chosen in detector input pixels (the frame scaled so its
+    long side is 640) and mapped back to the frame, so each stand-in face
+    covers exactly one stride-32 cell whatever the resolution.
+    """
+
+    MARGIN = 6 # Detector pixels of face patch beyond the cell on each side
+    JITTER = 2
+
+    def __init__(self, width, height, faces, seed, photos=None):
+        self.width, self.height = width, height
+        self.scale = min(1.0, 640 / max(width, height))
+        self.rng = np.random.default_rng(seed)
+        self.photos = photos
+
+        # Every other cell, away from the borders, so boxes never overlap much
+        cols = int(width * self.scale) // standin_models.STRIDE
+        rows = int(height * self.scale) // standin_models.STRIDE
+        seats = [(cx, cy) for cy in range(1, rows - 1, 2) for cx in range(1, cols - 1, 2)]
+        if faces > len(seats):
+            raise ValueError(f"{width}x{height} fits at most {len(seats)} faces")
+        picked = self.rng.choice(len(seats), size=faces, replace=False)
+        self.seats = [seats[i] for i in sorted(picked)]
+
+        self.background = self.rng.integers(0, 40, size=(height, width, 3), dtype=np.uint8)
+        # Fixed texture per face, so identities stay the same across frames
+        self.face_seeds = self.rng.integers(0, 2 ** 31, size=faces)
+
+    def frame(self):
+        frame = self.background.copy()
+        stride, margin = standin_models.STRIDE, self.MARGIN
+        for (cx, cy), face_seed in zip(self.seats, self.face_seeds):
+            dx, dy = self.rng.integers(-self.JITTER, self.JITTER + 1, size=2)
+            box = np.array([cx * stride - margin + dx, cy * stride - margin + dy,
+                            (cx + 1) * stride + margin + dx, (cy + 1) * stride + margin + dy]) / self.scale
+            x1, y1, x2, y2 = np.round(box).astype(int)
+            if self.photos:
+                photo = self.photos[face_seed % len(self.photos)]
+                frame[y1:y2, x1:x2] = cv2.resize(photo, (x2 - x1, y2 - y1))
+            else:
+                standin_models.draw_face(frame, x1, y1, x2, y2, np.random.default_rng(face_seed))
+        return frame
+
+
+def make_gallery(students, photos, seed):
+    rng = np.random.default_rng(seed)
+    gallery = Gallery()
+    embeddings = rng.normal(size=(students, photos, 512)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=2, keepdims=True)
+    gallery.replace({f"USN{i:05d}": embeddings[i] for i in range(students)})
+    return gallery
+
+
+def process_frame(engine, tracker, gallery, frame):
+    """One /recognize frame: detect, track, embed the faces that need it, match, vote."""
+    results = engine.detect(frame)
+    detections = [{"bbox": res["bbox"], "kps": res["kps"], "det_score": float(res["confidence"])}
+                  for res in results]
+    tracks = tracker.assign(detections)
+
+    to_embed = [i for i, track in enumerate(tracks) if tracker.needs_embedding(track)]
+    crops = engine.align_faces(frame, [results[i] for i in to_embed])
+    embeddings = engine.recognizer.get_embeddings(crops)
+    with metrics.stage("gallery_match"):
+        matches = gallery.match(embeddings, k=5)
+
+    for pos, i in enumerate(to_embed):
+        score, usn = matches[pos][0] if matches[pos] else (-1.0, "Unknown")
+        detections[i].update({"usn": usn, "score": float(score), "embedding": embeddings[pos]})
+    for track, det in zip(tracks, detections):
+        tracker.observe(track, det)
+    return len(results)
+
+
+def run_scenario(engine, gallery, scene, args):
+    tracker = FaceTracker(reembed_interval=args.reembed_interval)
+    for _ in range(args.warmup):
+        process_frame(engine, tracker, gallery, scene.frame())
+
+    frames = [scene.frame() for _ in range(args.frames)]
+    before = stage_totals()
+    latencies, detected = [], []
+    start = time.perf_counter()
+    for frame in frames:
+        t0 = time.perf_counter()
+        detected.append(process_frame(engine, tracker, gallery, frame))
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    after = stage_totals()
+
+    stages = {}
+    for stage, names in STAGES.items():
+        seconds = sum(after.get(n, (0.0, 0))[0] - before.get(n, (0.0, 0))[0] for n in names)
+        stages[stage] = seconds * 1000 / len(frames)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "frames": len(frames),
+        "faces_detected": float(np.mean(detected)),
+        "fps": len(frames) / elapsed,
+        "frame_ms_p50": float(np.percentile(latencies, 50)),
+        "frame_ms_p95": float(np.percentile(latencies, 95)),
+        "stage_ms": stages,
+        "embedded_per_frame": tracker.embedded / max(tracker.frame, 1),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def nms_timings(sizes, repeats, seed):
+    """{candidates: NMS milliseconds} on clusters of overlapping boxes, like raw detector output."""
+    rng = np.random.default_rng(seed)
+    timings = {}
+    for n in sizes:
+        centers = rng.uniform(0, 640, size=(max(1, n // 20), 2))
+        xy = centers[rng.integers(0, len(centers), size=n)] + rng.normal(0, 4, size=(n, 2))
+        wh = rng.uniform(40, 80, size=(n, 2))
+        dets = np.concatenate([xy, xy + wh, rng.uniform(0.4, 1.0, size=(n, 1))], axis=1)
+        nms(dets, 0.4)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            nms(dets, 0.4)
+        timings[str(n)] = (time.perf_counter() - start) * 1000 / repeats
+    return timings
+
+
+def resolve_models(args):
+    if not args.standin and os.path.exists(args.det) and os.path.exists(args.rec):
+        return args.det, args.rec, "real"
+    det_path, rec_path = standin_models.ensure_models(args.standin_dir)
+    return det_path, rec_path, "standin"
+
+
+def compare(results, baseline, tolerance, min_ms):
+    """Prints a comparison table. Returns the number of regressions."""
+    if baseline["meta"].get("models") != results["meta"]["models"]:
+        print(f"warning: baseline used {baseline['meta'].get('models')} models, this run used "
+              f"{results['meta']['models']}; timings are not comparable")
+
+    regressions = 0
+    print(f"\n{'scenario':<18} {'metric':<14} {'baseline ms':>12} {'current ms':>11} {'change':>8}")
+    for key, current in results["scenarios"].items():
+        base = baseline["scenarios"].get(key)
+        if base is None:
+            print(f"{key:<18} (not in baseline)")
+            continue
+        pairs = [("frame_p50", base["frame_ms_p50"], current["frame_ms_p50"])]
+        pairs += [(s, base["stage_ms"].get(s, 0.0), current["stage_ms"][s]) for s in STAGES]
+        for metric, old, new in pairs:
+            change = (new - old) / old if old > 0 else 0.0
+            regressed = change > tolerance and new - old > min_ms
+            regressions += regressed
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{key:<18} {metric:<14} {old:>12.3f} {new:>11.3f} {change:>+7.0%}{flag}")
+    for n, new in results.get("nms_ms", {}).items():
+        old = baseline.get("nms_ms", {}).get(n)
+        if old is None:
+            continue
+        change = (new - old) / old if old > 0 else 0.0
+        regressed = change > tolerance and new - old > min_ms
+        regressions += regressed
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{'nms/' + n:<18} {'nms':<14} {old:>12.3f} {new:>11.3f} {change:>+7.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolutions", nargs="+", default=["640x480", "1280x720", "1920x1080"])
+    parser.add_argument("--faces", type=int, nargs="+", default=[1, 10, 40])
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--students", type=int, default=1000, help="synthetic gallery size")
+    parser.add_argument("--photos", type=int, default=3, help="embeddings per gallery student")
+    parser.add_argument("--reembed-interval", type=int, default=1,
+                        help="tracker re-embedding interval; 1 embeds every face every frame")
+    parser.add_argument("--det", default="det_10g.onnx")
+    parser.add_argument("--rec", default="w600k_r50.onnx")
+    parser.add_argument("--det-input-size", type=int, default=None, help="fixed detector input, e.g. 640")
+    parser.add_argument("--standin", action="store_true", help="use stand-in models even if the real ones exist")
+    parser.add_argument("--standin-dir", default=os.path.join(tempfile.gettempdir(), "face_api_standin_models"))
+    parser.add_argument("--face-dir", default="faces", help="photos pasted as faces when using the real models")
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    parser.add_argument("--baseline", default=None, help="JSON from a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown, as a fraction")
+    parser.add_argument("--min-ms", type=float, default=0.05, help="ignore slowdowns smaller than this")
+    parser.add_argument("--nms-sizes", type=int, nargs="+", default=[50, 200, 300, 600, 1000],
+                        help="candidate counts NMS is timed at")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    det_path, rec_path, kind = resolve_models(args)
+    photos = None
+    if kind == "real":
+        photos = load_photos(args.face_dir) if os.path.isdir(args.face_dir) else []
+        if not photos:
+            print(f"warning: no photos in {args.face_dir}; the real detector will find no faces")
+
+    engine = FaceEngine(det_path, rec_path, det_input_size=args.det_input_size)
+    gallery = make_gallery(args.students, args.photos, args.seed)
+    print(f"models: {kind} ({os.path.basename(det_path)}, {os.path.basename(rec_path)}), "
+          f"gallery: {args.students}x{args.photos}")
+
+    results = {
+        "meta": {
+            "models": kind,
+            "det": os.path.basename(det_path),
+            "rec": os.path.basename(rec_path),
+            "det_input_size": args.det_input_size,
+            "students": args.students,
+            "photos": args.photos,
+            "reembed_interval": args.reembed_interval,
+            "onnxruntime": onnxruntime.__version__,
+            "numpy": np.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+        },
+        "scenarios": {},
+    }
+
+    stage_header = " ".join(f"{s:>10}" for s in STAGES)
+    print(f"\n{'scenario':<18} {'found':>6} {'fps':>7} {'p50 ms':>8} {'p95 ms':>8} {stage_header} {'rss MB':>7}")
+    for resolution in args.resolutions:
+        width, height = (int(v) for v in resolution.lower().split("x"))
+        for faces in args.faces:
+            key = f"{width}x{height}/{faces}"
+            scene = SyntheticScene(width, height, faces, args.seed, photos)
+            r = run_scenario(engine, gallery, scene, args)
+            results["scenarios"][key] = r
+            stage_cols = " ".join(f"{r['stage_ms'][s]:>10.3f}" for s in STAGES)
+            rss = f"{r['peak_rss_mb']:>7.0f}" if r["peak_rss_mb"] is not None else f"{'-':>7}"
+            print(f"{key:<18} {r['faces_detected']:>6.1f} {r['fps']:>7.1f} {r['frame_ms_p50']:>8.2f} "
+                  f"{r['frame_ms_p95']:>8.2f} {stage_cols} {rss}")
+    results["meta"]["peak_rss_mb"] = peak_rss_mb()
+
+    results["nms_ms"] = nms_timings(args.nms_sizes, max(args.frames, 10), args.seed)
+    print("\nNMS ms by candidates: " + ", ".join(f"{n}: {ms:.2f}" for n, ms in results["nms_ms"].items()))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_ms)
+        if regressions:
+            print(f"\n{regressions} regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
+        print(f"\nno regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Latency vs. recall of tiled detection against the single downscaled pass.
+
+Builds a synthetic hall frame (default 3840x2160) with faces of several sizes
+(`--sizes`, in frame pixels) at random non-overlapping positions, then runs
+FaceEngine.detect on it in single-pass mode and in tiled mode for every
+combination of `--tile-sizes`, `--overlaps` and `--workers`. Reports detect
+latency (p50/p95) and, per face size, the fraction of faces found: a face
+counts as found when a detection's centre lies inside its box. Extra
+detections on an already found face are counted as duplicates, detections
+on no face as false positives.
+
+Models as in bench_suite.py: the real det_10g.onnx / w600k_r50.onnx with
+photos from --face-dir pasted as faces, else the generated stand-ins with
+bright patches. The stand-in detector only fires on a stride-32 input cell
+covered by a patch and always reports an 80px box, so with it the recall
+columns show which faces the detector gets to see at a usable scale, not
+real detector quality.
+
+Usage (from python-face-api/):
+    python benchmarks/bench_tiling.py [--resolution 3840x2160] [--tile-sizes 640 960]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.face_engine import FaceEngine
+
+import standin_models
+from bench_suite import load_photos, resolve_models
+
+
+def make_scene(width, height, sizes, per_size, seed, photos=None):
+    """Returns (frame, [(x1, y1, x2, y2, size)]) with faces that never overlap."""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 40, size=(height, width, 3), dtype=np.uint8)
+    occupied = np.zeros((height, width), dtype=bool)
+    faces = []
+    for size in sorted(sizes, reverse=True):
+        placed = 0
+        for _ in range(1000 * per_size):
+            if placed == per_size:
+                break
+            x1 = int(rng.integers(0, width - size))
+            y1 = int(rng.integers(0, height - size))
+            x2, y2 = x1 + size, y1 + size
+            # Keep a gap of half a face around each one
+            gap = size // 2
+            if occupied[max(0, y1 - gap):y2 + gap, max(0, x1 - gap):x2 + gap].any():
+                continue
+            occupied[y1:y2, x1:x2] = True
+            if photos:
+                frame[y1:y2, x1:x2] = cv2.resize(photos[len(faces) % len(photos)], (size, size))
+            else:
+                standin_models.draw_face(frame, x1, y1, x2, y2, rng)
+            faces.append((x1, y1, x2, y2, size))
+            placed += 1
+        if placed < per_size:
+            raise ValueError(f"could only place {placed} faces of {size}px in {width}x{height}")
+    return frame, faces
+
+
+def score(detections, faces):
+    """({size: found fraction}, duplicates, false positives)."""
+    found = np.zeros(len(faces), dtype=bool)
+    duplicates = false_positives = 0
+    for det in detections:
+        x1, y1, x2, y2 = det["bbox"]
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        hits = [i for i, (fx1, fy1, fx2, fy2, _) in enumerate(faces) if fx1 <= cx <= fx2 and fy1 <= cy <= fy2]
+        if not hits:
+            false_positives += 1
+        elif found[hits[0]]:
+            duplicates += 1
+        else:
+            found[hits[0]] = True
+
+    recall = {}
+    for size in sorted({f[4] for f in faces}):
+        mask = np.array([f[4] == size for f in faces])
+        recall[size] = float(found[mask].mean())
+    return recall, duplicates, false_positives
+
+
+def run(engine, frame, faces, frames, warmup):
+    for _ in range(warmup):
+        engine.detect(frame)
+    latencies = []
+    for _ in range(frames):
+        t0 = time.perf_counter()
+        detections = engine.detect(frame)
+        latencies.append(time.perf_counter() - t0)
+    latencies = np.array(latencies) * 1000
+    recall, duplicates, false_positives = score(detections, faces)
+    return {
+        "ms_p50": float(np.percentile(latencies, 50)),
+        "ms_p95": float(np.percentile(latencies, 95)),
+        "detections": len(detections),
+        "recall": recall,
+        "duplicates": duplicates,
+        "false_positives": false_positives,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolution", default="3840x2160")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[48, 64, 96, 160, 320],
+                        help="face sizes in frame pixels")
+    parser.add_argument("--per-size", type=int, default=8, help="faces of each size")
+    parser.add_argument("--tile-sizes", type=int, nargs="+", default=[640])
+    parser.add_argument("--overlaps", type=float, nargs="+", default=[0.25])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--det", default="det_10g.onnx")
+    parser.add_argument("--rec", default="w600k_r50.onnx")
+    parser.add_argument("--standin", action="store_true", help="use stand-in models even if the real ones exist")
+    parser.add_argument("--standin-dir", default=os.path.join(tempfile.gettempdir(), "face_api_standin_models"))
+    parser.add_argument("--face-dir", default="faces", help="photos pasted as faces when using the real models")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    det_path, rec_path, kind = resolve_models(args)
+    photos = load_photos(args.face_dir) if kind == "real" and os.path.isdir(args.face_dir) else None
+    if kind == "real" and not photos:
+        print(f"warning: no photos in {args.face_dir}; the real detector will find no faces")
+
+    width, height = (int(v) for v in args.resolution.lower().split("x"))
+    frame, faces = make_scene(width, height, args.sizes, args.per_size, args.seed, photos)
+    print(f"models: {kind} ({os.path.basename(det_path)}), frame {width}x{height}, "
+          f"{len(faces)} faces of {', '.join(str(s) for s in sorted(set(args.sizes)))}px")
+
+    configs = [("single pass", None, None, None)]
+    configs += [(f"tile {t} / {o:.0%} / {w}w", t, o, w)
+                for t in args.tile_sizes for o in args.overlaps for w in args.workers]
+
+    size_header = " ".join(f"{str(s) + 'px':>6}" for s in sorted(set(args.sizes)))
+    print(f"\n{'mode':<22} {'tiles':>5} {'p50 ms':>8} {'p95 ms':>8} {size_header} {'dup':>4} {'fp':>4}")
+    for name, tile_size, overlap, workers in configs:
+        engine = FaceEngine(det_path, rec_path, det_tile_size=tile_size, det_tile_overlap=overlap or 0.25,
+                            det_tile_workers=workers or 1)
+        tiles = len(engine.detector.tiles(height, width)) if tile_size else 1
+        r = run(engine, frame, faces, args.frames, args.warmup)
+        recall = " ".join(f"{r['recall'][s]:>6.0%}" for s in sorted(r["recall"]))
+        print(f"{name:<22} {tiles:>5} {r['ms_p50']:>8.1f} {r['ms_p95']:>8.1f} {recall} "
+              f"{r['duplicates']:>4} {r['false_positives']:>4}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Small generated ONNX models with the det_10g / w600k_r50 signatures.
+
+Used by bench_suite.py when the real models are not on disk, so the pipeline
+around the models (preprocess, decode, NMS, align, match, track) can be timed
+on any machine. Inference time of a stand-in says nothing about the real
+networks.
+
+Detector: input "input.1" (1, 3, H, W); nine outputs in SCRFD order
+(score_8/16/32, bbox_8/16/32, kps_8/16/32), each (N, C) as in
+engine.postprocess. Only the first stride-32 anchor ever fires, on a 32x32
+input cell whose normalized mean is above SCORE_LEVEL, i.e. a cell fully
+covered by a bright patch such as those drawn by `draw_face`. Boxes are
+FACE_SIZE input pixels wide and centred on the cell, with landmarks on the
+ArcFace template, so every detection aligns and embeds like a real face.
+
+Recognizer: input "input.1" (N, 3, 112, 112), output "683" (N, 512): two
+strided convolutions and a projection with fixed random weights, so different
+crops give different embeddings.
+
+Requires the `onnx` package (pip install onnx).
+"""
+import os
+
+import numpy as np
+
+# Detector input pixels; a face box is FACE_SIZE wide on a STRIDE grid
+STRIDE = 32
+FACE_SIZE = 80
+SCORE_LEVEL = 0.5
+SCORE_GAIN = 40.0
+
+ARCFACE_TEMPLATE = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041]], dtype=np.float32)
+
+
+def _import_onnx():
+    try:
+        import onnx
+        from onnx import helper, numpy_helper, TensorProto
+    except ImportError:
+        raise RuntimeError("Generating stand-in models needs the onnx package: pip install onnx")
+    return onnx, helper, numpy_helper, TensorProto
+
+
+def _head_params(kind, stride, channels):
+    """Conv weights and bias for one SCRFD head; channels are per anchor, 2 anchors."""
+    weight = np.zeros((2 * channels, 3, stride, stride), dtype=np.float32)
+    bias = np.zeros(2 * channels, dtype=np.float32)
+    if kind == "score":
+        bias[:] = -20.0 # Never fires
+        if stride == STRIDE:
+            # Anchor 0: sigmoid(gain * (cell mean - level))
+            weight[0] = SCORE_GAIN / (3 * stride * stride)
+            bias[0] = -SCORE_GAIN * SCORE_LEVEL
+    elif kind == "bbox" and stride == STRIDE:
+        # Centred box of FACE_SIZE for the 256px anchor: w = exp(0.2 * b) * 256
+        bias[2:4] = 5.0 * np.log(FACE_SIZE / 256.0)
+    elif kind == "kps" and stride == STRIDE:
+        # Template landmarks, in strides from the cell centre
+        offsets = (ARCFACE_TEMPLATE - 56.0) * (FACE_SIZE / 112.0) / stride
+        bias[:10] = offsets.ravel()
+    return weight, bias
+
+
+def make_detector(path):
+    onnx, helper, numpy_helper, TensorProto = _import_onnx()
+    nodes, inits, outputs = [], [], []
+    for kind, channels in (("score", 1), ("bbox", 4), ("kps", 10)):
+        for stride in (8, 16, 32):
+            name = f"{kind}_{stride}"
+            weight, bias = _head_params(kind, stride, channels)
+            inits += [numpy_helper.from_array(weight, f"{name}_w"),
+                      numpy_helper.from_array(bias, f"{name}_b"),
+                      numpy_helper.from_array(np.array([-1, channels], dtype=np.int64), f"{name}_shape")]
+            nodes += [helper.make_node("Conv", ["input.1", f"{name}_w", f"{name}_b"], [f"{name}_conv"],
+                                       kernel_shape=[stride, stride], strides=[stride, stride]),
+                      helper.make_node("Transpose", [f"{name}_conv"], [f"{name}_nhwc"], perm=[0, 2, 3, 1])]
+            if kind == "score":
+                nodes += [helper.make_node("Reshape", [f"{name}_nhwc", f"{name}_shape"], [f"{name}_logits"]),
+                          helper.make_node("Sigmoid", [f"{name}_logits"], [name])]
+            else:
+                nodes.append(helper.make_node("Reshape", [f"{name}_nhwc", f"{name}_shape"], [name]))
+            outputs.append(helper.make_tensor_value_info(name, TensorProto.FLOAT, ["n", channels]))
+
+    image = helper.make_tensor_value_info("input.1", TensorProto.FLOAT, [1, 3, "h", "w"])
+    graph = helper.make_graph(nodes, "scrfd_standin", [image], outputs, inits)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+
+
+def make_recognizer(path, seed=0):
+    onnx, helper, numpy_helper, TensorProto = _import_onnx()
+    rng = np.random.default_rng(seed)
+    inits = [numpy_helper.from_array(rng.normal(0, 0.1, (64, 3, 3, 3)).astype(np.float32), "conv1_w"),
+             numpy_helper.from_array(rng.normal(0, 0.1, (128, 64, 3, 3)).astype(np.float32), "conv2_w"),
+             numpy_helper.from_array(rng.normal(0, 0.1, (128 * 7 * 7, 512)).astype(np.float32), "fc_w"),
+             numpy_helper.from_array(np.array([0, -1], dtype=np.int64), "flat_shape")]
+    nodes = [helper.make_node("Conv", ["input.1", "conv1_w"], ["conv1"], kernel_shape=[3, 3], strides=[4, 4],
+                              pads=[1, 1, 1, 1]),
+             helper.make_node("Relu", ["conv1"], ["relu1"]),
+             helper.make_node("Conv", ["relu1", "conv2_w"], ["conv2"], kernel_shape=[3, 3], strides=[4, 4],
+                              pads=[1, 1, 1, 1]),
+             helper.make_node("Relu", ["conv2"], ["relu2"]),
+             helper.make_node("Reshape", ["relu2", "flat_shape"], ["flat"]),
+             helper.make_node("MatMul", ["flat", "fc_w"], ["683"])]
+
+    image = helper.make_tensor_value_info("input.1", TensorProto.FLOAT, ["N", 3, 112, 112])
+    embedding = helper.make_tensor_value_info("683", TensorProto.FLOAT, ["N", 512])
+    graph = helper.make_graph(nodes, "arcface_standin", [image], [embedding], inits)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+
+
+def ensure_models(directory):
+    """Writes both stand-ins into `directory` (once). Returns (det_path, rec_path)."""
+    os.makedirs(directory, exist_ok=True)
+    det_path = os.path.join(directory, "det_standin.onnx")
+    rec_path = os.path.join(directory, "rec_standin.onnx")
+    if not os.path.exists(det_path):
+        make_detector(det_path)
+    if not os.path.exists(rec_path):
+        make_recognizer(rec_path)
+    return det_path, rec_path
+
+
+def draw_face(frame, x1, y1, x2, y2, rng):
+    """Paints a bright textured patch the stand-in detector reports as a face."""
+    frame[y1:y2, x1:x2] = rng.integers(190, 256, size=(y2 - y1, x2 - x1, 3), dtype=np.uint8)
@@ -0,0 +1,77 @@
+"""Bulk-enrolls students through a running API's /enroll_bulk endpoint.
+
+SOURCE is a zip of <usn>/<image> entries, or a directory with one sub-folder
+per student (zipped on the fly, uncompressed: JPEGs do not shrink). Progress
+is printed per student as the server reports it; the exit status is 1 if any
+image or student failed.
+
+Usage:
+    python bulk_enroll.py new_students/ [--url http://localhost:5006]
+    python bulk_enroll.py semester.zip
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import urllib.request
+import zipfile
+
+
+def zip_directory(directory, archive):
+    count = 0
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zf:
+        for student in sorted(os.scandir(directory), key=lambda e: e.name):
+            if not student.is_dir() or student.name.startswith("."):
+                continue
+            for img in sorted(os.scandir(student.path), key=lambda e: e.name):
+                if img.is_file():
+                    zf.write(img.path, f"{student.name}/{img.name}")
+                    count += 1
+    return count
+
+
+def describe(update):
+    line = f"{update['usn']}: saved {update['saved']}, embedded {update['embedded']}"
+    problems = [f"{f['image']}: {f['error']}" for f in update["failed"]]
+    if "error" in update:
+        problems.append(update["error"])
+    if problems:
+        line += " -- " + "; ".join(problems)
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="zip archive or directory of student folders")
+    parser.add_argument("--url", default="http://localhost:5006", help="API base URL")
+    parser.add_argument("--timeout", type=float, default=3600)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryFile() as archive:
+        if os.path.isdir(args.source):
+            print(f"Zipping {zip_directory(args.source, archive)} images from {args.source}...")
+        else:
+            with open(args.source, "rb") as f:
+                shutil.copyfileobj(f, archive)
+        size = archive.tell()
+        archive.seek(0)
+
+        request = urllib.request.Request(args.url.rstrip("/") + "/enroll_bulk", data=archive, method="POST",
+                                         headers={"Content-Type": "application/zip", "Content-Length": str(size)})
+        failed = 0
+        with urllib.request.urlopen(request, timeout=args.timeout) as response:
+            for raw in response:
+                update = json.loads(raw)
+                if update.get("done"):
+                    print(f"Done: {update['students']} students, {update['images']} images, "
+                          f"{update['embedded']} embedded, {update['failed']} failures in {update['seconds']:.1f}s")
+                    failed = update["failed"]
+                else:
+                    print(describe(update), flush=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+
+from engine import metrics
+
+CROP_SIZE = 112
+
+# Computed via skimage.transform.SimilarityTransform
+# for standard 112x112 ArcFace
+ARCFACE_DST = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041]], dtype=np.float32)
+
+
+def similarity_transforms(landmarks, dst=ARCFACE_DST):
+    """Least-squares similarity transforms (Umeyama) for N landmark sets in one pass.
+
+    landmarks: (N, K, 2) points, dst: (K, 2) template.
+    Returns ((N, 2, 3) float64 matrices for cv2.warpAffine, (N,) bool mask of
+    valid ones). A set is invalid when its points coincide or are not finite.
+
+    In 2D a rotation plus uniform scale is [[a, -b], [b, a]], and the
+    least-squares a and b have a closed form over the centred points, so no
+    SVD or iteration is needed.
+    """
+    src = np.asarray(landmarks, dtype=np.float64).reshape(len(landmarks), -1, 2)
+    dst = np.asarray(dst, dtype=np.float64)
+
+    src_mean = src.mean(axis=1, keepdims=True)
+    dst_mean = dst.mean(axis=0)
+    s = src - src_mean
+    d = dst - dst_mean
+
+    var = (s ** 2).sum(axis=(1, 2))
+    valid = np.isfinite(var) & (var > 1e-12)
+    var = np.where(valid, var, 1.0)
+    a = (s[..., 0] * d[:, 0] + s[..., 1] * d[:, 1]).sum(axis=1) / var
+    b = (s[..., 0] * d[:, 1] - s[..., 1] * d[:, 0]).sum(axis=1) / var
+
+    M = np.empty((len(src), 2, 3), dtype=np.float64)
+    M[:, 0, 0] = a
+    M[:, 0, 1] = -b
+    M[:, 1, 0] = b
+    M[:, 1, 1] = a
+    M[:, :, 2] = dst_mean - np.einsum("nij,nj->ni", M[:, :, :2], src_mean[:, 0])
+    return M, valid
+
+
+def align_batch(images, landmarks, boxes=None, out=None, transforms=None):
+    """Warps N faces into one (N, 112, 112, 3) uint8 batch, ready for ArcFace.
+
+    images: one BGR image holding every face, or a sequence with one image
+    per face. landmarks: (N, 5, 2). Where a transform is invalid, the face's
+    box from `boxes` ([x1, y1, x2, y2] per face) is resized instead, or the
+    crop is left black. `out` may be a preallocated buffer to fill;
+    `transforms` the (matrices, valid) similarity_transforms already returned
+    for `landmarks`.
+    """
+    n = len(landmarks)
+    if out is None:
+        out = np.empty((n, CROP_SIZE, CROP_SIZE, 3), dtype=np.uint8)
+    if n == 0:
+        return out
+
+    with metrics.stage("align"):
+        transforms, valid = transforms if transforms is not None else similarity_transforms(landmarks)
+        single = isinstance(images, np.ndarray)
+        for i in range(n):
+            img = images if single else images[i]
+            if valid[i]:
+                cv2.warpAffine(img, transforms[i], (CROP_SIZE, CROP_SIZE), dst=out[i], borderValue=0.0)
+                continue
+            crop = None
+            if boxes is not None:
+                h, w = img.shape[:2]
+                x1, y1, x2, y2 = boxes[i][:4]
+                crop = img[max(0, int(y1)):min(h, int(y2)), max(0, int(x1)):min(w, int(x2))]
+            if crop is not None and crop.size:
+                cv2.resize(crop, (CROP_SIZE, CROP_SIZE), dst=out[i])
+            else:
+                out[i] = 0
+    return out
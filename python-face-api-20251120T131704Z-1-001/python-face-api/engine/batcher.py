@@ -0,0 +1,129 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+log = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Gathers concurrent requests into small batches for one dispatcher thread.
+
+    Request handlers call `submit(item)` and wait on the returned Future. The
+    dispatcher takes the first queued item, keeps collecting until
+    `batch_window` seconds have passed or `max_batch_size` items are in hand,
+    then calls `process_fn(items)`, which must return one result per item.
+
+    With `key` set, at most one item per key goes into a batch; later items
+    with the same key (e.g. the next frame of the same camera) wait for the
+    following batch, in order. The dispatcher also stops waiting as soon as
+    every key seen in the last `active_horizon` seconds is in the batch, so a
+    single camera never pays the batch window.
+
+    The dispatcher thread starts on first use and is restarted in a forked
+    child, so the batcher can be created at import time under a pre-fork
+    WSGI server.
+    """
+
+    def __init__(self, process_fn, max_batch_size=8, batch_window=0.005, key=None, active_horizon=1.0,
+                 name="micro-batcher"):
+        self.process_fn = process_fn
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.key = key
+        self.active_horizon = active_horizon
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._deferred = deque() # Items pushed out of a batch by a key collision, oldest first
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._last_seen = {} # key -> monotonic time it was last batched
+
+        self.batches = 0
+        self.items = 0
+
+    @property
+    def mean_batch_size(self):
+        return self.items / self.batches if self.batches else 0.0
+
+    def submit(self, item):
+        """Queues an item. Returns a Future resolved with process_fn's result for it."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch, keys = [], set()
+
+        def take(entry):
+            k = self.key(entry[0]) if self.key else None
+            if k is not None and k in keys:
+                return False
+            keys.add(k)
+            batch.append(entry)
+            return True
+
+        # Deferred items first, so a stream's frames stay in order
+        still_deferred = deque()
+        while self._deferred:
+            entry = self._deferred.popleft()
+            if len(batch) >= self.max_batch_size or not take(entry):
+                still_deferred.append(entry)
+        self._deferred = still_deferred
+
+        if not batch:
+            take(self._queue.get())
+
+        now = time.monotonic()
+        deadline = now + self.batch_window
+        expected = self.max_batch_size
+        if self.key:
+            self._last_seen = {k: t for k, t in self._last_seen.items() if now - t < self.active_horizon}
+            expected = min(expected, max(len(keys.union(self._last_seen)), 1))
+
+        while len(batch) < self.max_batch_size:
+            # Past the expected size only take what is already queued
+            remaining = deadline - time.monotonic() if len(batch) < expected else 0
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if not take(entry):
+                self._deferred.append(entry)
+
+        if self.key:
+            now = time.monotonic()
+            self._last_seen.update((k, now) for k in keys)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = self.process_fn(items)
+            except Exception as e:
+                log.error("%s: batch of %d failed: %s", self.name, len(items), e)
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(items)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,193 @@
+import logging
+import os
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from engine.image_io import decode_image, jpeg_size
+
+log = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def valid_usn(name):
+    """True if `name` can be used as a student folder under faces/."""
+    return bool(name) and name not in (".", "..") and os.path.basename(name) == name and not name.startswith(".")
+
+
+def _group_by_student(paths):
+    # "<anything>/<usn>/<image>" -> {usn: [index, ...]}, skipping non-images and OS metadata
+    by_usn = {}
+    for i, path in enumerate(paths):
+        parts = path.replace("\\", "/").split("/")
+        if len(parts) < 2 or any(p.startswith(".") or p == "__MACOSX" for p in parts):
+            continue
+        if not parts[-1].lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        by_usn.setdefault(parts[-2], []).append(i)
+    return by_usn
+
+
+def students_from_zip(archive):
+    """Iterator of (usn, [(image name, bytes)]) from a zip of <usn>/<image> entries.
+
+    The student is the image's parent folder, so the folders may sit under a
+    common root. The archive is opened right away (raising zipfile.BadZipFile
+    if it is not a zip); each student's images are read only when reached.
+    """
+    zf = zipfile.ZipFile(archive)
+    infos = [info for info in zf.infolist() if not info.is_dir()]
+    by_usn = _group_by_student([info.filename for info in infos])
+
+    def read():
+        with zf:
+            for usn, indices in by_usn.items():
+                yield usn, [(os.path.basename(infos[i].filename), zf.read(infos[i])) for i in indices]
+    return read()
+
+
+def students_from_files(files):
+    """Same as students_from_zip for (path, bytes) pairs, e.g. multipart files named <usn>/<image>."""
+    files = list(files)
+    for usn, indices in _group_by_student([path for path, _ in files]).items():
+        yield usn, [(os.path.basename(files[i][0]), files[i][1]) for i in indices]
+
+
+def next_image_index(folder):
+    """First free N for "<N>.jpg" in a student folder, from a single listing."""
+    last = 0
+    for entry in os.scandir(folder):
+        stem, ext = os.path.splitext(entry.name)
+        if ext == ".jpg" and stem.isdigit():
+            last = max(last, int(stem))
+    return last + 1
+
+
+class BulkEnroller:
+    """Enrolls many students at once.
+
+    A small thread pool decodes, saves, detects and aligns each student's
+    images (OpenCV and ONNX Runtime release the GIL). Aligned crops are
+    gathered across students and embedded `batch_size` at a time; each batch
+    is handed to `commit({usn: [(image path, embedding), ...]})` in one call,
+    so the gallery is rebuilt once per batch rather than once per student.
+
+    Images are written as "<N>.jpg" under faces_dir/<usn>/, numbered after
+    the folder's existing images. JPEG uploads are saved as received.
+    """
+
+    def __init__(self, engine, faces_dir, commit, workers=2, batch_size=32, threshold=0.5):
+        self.engine = engine
+        self.faces_dir = faces_dir
+        self.commit = commit
+        self.workers = workers
+        self.batch_size = batch_size
+        self.threshold = threshold
+
+    def _prepare(self, usn, images):
+        """Worker: saves one student's images and aligns their faces."""
+        result = {"usn": usn, "saved": 0, "crops": [], "paths": [], "failed": []}
+        try:
+            folder = os.path.join(self.faces_dir, usn)
+            os.makedirs(folder, exist_ok=True)
+            index = next_image_index(folder)
+            for name, data in images:
+                img, _ = decode_image(data)
+                if img is None:
+                    result["failed"].append({"image": name, "error": "unreadable image"})
+                    continue
+
+                path = os.path.join(folder, f"{index}.jpg")
+                index += 1
+                if jpeg_size(data) is not None:
+                    with open(path, "wb") as f:
+                        f.write(data)
+                else:
+                    cv2.imwrite(path, img)
+                result["saved"] += 1
+
+                crop = self.engine.enrollment_crop(img, self.threshold)
+                if crop is None:
+                    result["failed"].append({"image": name, "error": "no usable face"})
+                    continue
+                result["crops"].append(crop)
+                result["paths"].append(path)
+        except Exception as e:
+            log.warning("Bulk enrollment of %s failed: %s", usn, e)
+            result["error"] = str(e)
+        return result
+
+    def _flush(self, ready):
+        # One ArcFace pass and one gallery update for every student in `ready`
+        crops = [crop for r in ready for crop in r["crops"]]
+        embeddings = self.engine.recognizer.get_embeddings(crops) if crops else np.zeros((0, 512), np.float32)
+        by_usn = {}
+        pos = 0
+        for r in ready:
+            paths = r.pop("paths")
+            n = len(r.pop("crops"))
+            r["embedded"] = n
+            if n:
+                by_usn[r["usn"]] = list(zip(paths, embeddings[pos:pos + n]))
+            pos += n
+        if by_usn:
+            self.commit(by_usn)
+        done = list(ready)
+        ready.clear()
+        return done
+
+    def run(self, students):
+        """Enrolls an iterable of (usn, [(image name, bytes)]).
+
+        Yields one progress dict per student, in input order, as soon as its
+        embeddings are in the gallery: {usn, saved, embedded, failed[, error]}.
+        The last dict is a summary: {done, students, images, embedded, failed, seconds}.
+        """
+        start = time.perf_counter()
+        totals = {"students": 0, "images": 0, "embedded": 0, "failed": 0}
+        pending = deque()
+        ready = []
+        ready_crops = 0
+
+        def account(results):
+            for r in results:
+                totals["students"] += 1
+                totals["images"] += r["saved"]
+                totals["embedded"] += r["embedded"]
+                totals["failed"] += len(r["failed"]) + ("error" in r)
+            return results
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="bulk-enroll") as pool:
+            students = iter(students)
+            exhausted = False
+            while not exhausted or pending:
+                # Keep a couple of students per worker in flight; decoded images stay bounded
+                while not exhausted and len(pending) < 2 * self.workers:
+                    entry = next(students, None)
+                    if entry is None:
+                        exhausted = True
+                        break
+                    usn, images = entry
+                    if not valid_usn(usn):
+                        totals["failed"] += 1
+                        yield {"usn": usn, "saved": 0, "embedded": 0, "failed": [], "error": "invalid student id"}
+                        continue
+                    pending.append(pool.submit(self._prepare, usn, images))
+
+                if pending:
+                    result = pending.popleft().result()
+                    ready.append(result)
+                    ready_crops += len(result["crops"])
+                if ready and (ready_crops >= self.batch_size or (exhausted and not pending)):
+                    yield from account(self._flush(ready))
+                    ready_crops = 0
+
+        seconds = time.perf_counter() - start
+        log.info("Bulk enrollment: %d students, %d images, %d embedded, %d failures in %.1fs",
+                 totals["students"], totals["images"], totals["embedded"], totals["failed"], seconds)
+        yield dict(done=True, seconds=round(seconds, 3), **totals)
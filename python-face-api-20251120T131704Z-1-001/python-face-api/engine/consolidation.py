@@ -0,0 +1,84 @@
+from collections import namedtuple
+
+import numpy as np
+
+# What a consolidated student's rows stand for: `count` raw embeddings whose
+# (unnormalized) mean is `mean`. Row 0 is the normalized mean, the rest medoids.
+Summary = namedtuple("Summary", ["count", "mean"])
+
+
+def _normalize(v):
+    return (v / max(float(np.linalg.norm(v)), 1e-12)).astype(np.float32)
+
+
+def select_medoids(embeddings, k, iterations=5):
+    """Indices of up to k diverse, representative rows of `embeddings`.
+
+    Farthest-point seeding (starting from the most central row) followed by a
+    few rounds of k-medoids: each row joins its most similar medoid, and each
+    cluster's new medoid is the member most similar to the rest of it.
+    """
+    n = len(embeddings)
+    if n <= k:
+        return np.arange(n)
+    sims = embeddings @ embeddings.T
+
+    chosen = [int(np.argmax(sims.sum(axis=1)))]
+    nearest = sims[chosen[0]].copy()
+    for _ in range(k - 1):
+        far = int(np.argmin(nearest))
+        chosen.append(far)
+        np.maximum(nearest, sims[far], out=nearest)
+
+    for _ in range(iterations):
+        assign = np.argmax(sims[:, chosen], axis=1)
+        updated = []
+        for c, medoid in enumerate(chosen):
+            members = np.flatnonzero(assign == c)
+            if len(members) == 0:
+                updated.append(medoid)
+                continue
+            within = sims[np.ix_(members, members)].sum(axis=1)
+            updated.append(int(members[np.argmax(within)]))
+        if updated == chosen:
+            break
+        chosen = updated
+    return np.array(chosen)
+
+
+class Consolidator:
+    """Bounds a student's embeddings to a centroid plus up to `max_medoids` medoids.
+
+    Students with at most max_medoids + 1 embeddings are kept as they are
+    (summary None). `extend` folds new embeddings into an existing set without
+    the original raw embeddings: the centroid is a running mean, and the
+    medoids are re-selected from the previous medoids plus the new rows.
+    """
+
+    def __init__(self, max_medoids=4, iterations=5):
+        self.max_medoids = max_medoids
+        self.iterations = iterations
+
+    def reduce(self, embeddings):
+        """(rows, summary) for a full set of one student's embeddings."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(embeddings) <= self.max_medoids + 1:
+            return embeddings, None
+        mean = embeddings.mean(axis=0)
+        medoids = embeddings[select_medoids(embeddings, self.max_medoids, self.iterations)]
+        return np.vstack([_normalize(mean), medoids]), Summary(len(embeddings), mean)
+
+    def extend(self, rows, summary, new_embeddings):
+        """(rows, summary) after adding new_embeddings to a student's current rows."""
+        new_embeddings = np.asarray(new_embeddings, dtype=np.float32)
+        if rows is None:
+            return self.reduce(new_embeddings)
+        if summary is None:
+            # Rows are still raw embeddings
+            return self.reduce(np.concatenate([rows, new_embeddings]))
+
+        count = summary.count + len(new_embeddings)
+        mean = (summary.mean * summary.count + new_embeddings.sum(axis=0)) / count
+        candidates = np.concatenate([rows[1:], new_embeddings])
+        medoids = candidates[select_medoids(candidates, self.max_medoids, self.iterations)]
+        return np.vstack([_normalize(mean), medoids]), Summary(count, mean)
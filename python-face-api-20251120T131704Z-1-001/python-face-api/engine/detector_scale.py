@@ -0,0 +1,67 @@
+from collections import deque
+
+
+class DetectorScale:
+    """Per-stream choice of detector input size (the long side the frame is scaled to).
+
+    Picks the smallest of `sizes` at which the smallest face seen over the
+    last `window` detections would still measure `min_face` detector pixels.
+    Faces are sized in frame pixels, so a kiosk camera where faces fill the
+    frame settles at the smallest input while a hall camera stays at the
+    largest.
+
+    When a detection finds fewer faces than any of the last `window`, the
+    next one runs one size larger. Every `probe_every`-th detection runs at the
+    largest size, so small faces entering a scene watched at a small input
+    are still found.
+
+    `cost` holds a running average of detect seconds per input size; with
+    it, `saved` estimates the time a detection at `size` saved.
+    """
+
+    def __init__(self, sizes=(320, 480, 640), min_face=32, window=5, probe_every=30):
+        self.sizes = sorted(sizes)
+        self.min_face = min_face
+        self.probe_every = probe_every
+
+        self.size = self.sizes[-1]
+        self.last_size = None # Size of the latest detection
+        self._recent = deque(maxlen=window) # Smallest face per detection that found any
+        self._counts = deque(maxlen=window) # Faces found per detection
+        self._observed = 0
+        self.cost = {}
+
+    def next_size(self):
+        """Input size for the stream's next detection."""
+        if self.probe_every and self._observed % self.probe_every == self.probe_every - 1:
+            return self.sizes[-1]
+        return self.size
+
+    def observe(self, size, frame_size, face_sizes, seconds):
+        """Records a detection run at `size` on a frame whose long side is `frame_size`.
+
+        face_sizes: shorter side, in frame pixels, of every face it found.
+        Returns the detect seconds saved against the largest size (0 if unknown).
+        """
+        self._observed += 1
+        self.last_size = size
+        previous = self.cost.get(size)
+        self.cost[size] = seconds if previous is None else 0.9 * previous + 0.1 * seconds
+
+        if face_sizes:
+            self._recent.append(min(face_sizes))
+        if self._counts and len(face_sizes) < min(self._counts):
+            # Lost a face: maybe too small at this scale
+            self.size = self.sizes[min(self.sizes.index(self.size) + 1, len(self.sizes) - 1)]
+        elif self._recent:
+            # Input long side at which the smallest recent face measures min_face pixels
+            needed = self.min_face * frame_size / min(self._recent)
+            self.size = next((s for s in self.sizes if s >= needed), self.sizes[-1])
+        self._counts.append(len(face_sizes))
+        return self.saved(size)
+
+    def saved(self, size):
+        largest = self.cost.get(self.sizes[-1])
+        if largest is None or size == self.sizes[-1]:
+            return 0.0
+        return max(0.0, largest - self.cost[size])
@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import threading
+import uuid
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def model_fingerprint(*model_paths):
+    """Identifies the model files an embedding was produced with.
+
+    Uses name, size and mtime, so swapping DET_MODEL/REC_MODEL (or regenerating
+    an int8 file in place) invalidates the store.
+    """
+    parts = []
+    for path in model_paths:
+        try:
+            st = os.stat(path)
+            parts.append(f"{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns}")
+        except OSError:
+            parts.append(f"{os.path.basename(path)}:missing")
+    return "|".join(parts)
+
+
+class EmbeddingStore:
+    """Persistent embeddings for the images under faces/.
+
+    Layout of store_dir:
+      manifest.json          model fingerprint + one entry per image file
+      embeddings-<id>.npy    float32 (rows, dim) matrix, memory-mapped on load
+
+    The manifest names the matrix file it belongs to and is replaced atomically
+    after the matrix is written, so a crash never pairs a manifest with the
+    wrong matrix.
+
+    Embeddings computed at enrollment can be handed over with `remember`, so
+    the next sync stores them instead of embedding those images again.
+    """
+
+    def __init__(self, faces_dir, store_dir, model_key, dim=512, embed_batch=32):
+        self.faces_dir = faces_dir
+        self.store_dir = store_dir
+        self.model_key = model_key
+        self.dim = dim
+        self.embed_batch = embed_batch
+        self.manifest_path = os.path.join(store_dir, "manifest.json")
+        self.last_changes = {"added": 0, "changed": 0, "removed": 0} # Image files, as of the last sync
+        self._pending = {} # rel_path -> (size, mtime_ns, embedding) from remember()
+        self._pending_lock = threading.Lock()
+
+    def _empty(self):
+        return {}, np.zeros((0, self.dim), dtype=np.float32)
+
+    def load(self):
+        """Returns ({rel_path: entry}, matrix). Empty if missing or stale."""
+        if not os.path.exists(self.manifest_path):
+            return self._empty()
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            if (manifest.get("version") != MANIFEST_VERSION
+                    or manifest.get("model_key") != self.model_key
+                    or manifest.get("dim") != self.dim):
+                return self._empty()
+            matrix = np.load(os.path.join(self.store_dir, manifest["matrix"]), mmap_mode="r")
+            if matrix.ndim != 2 or matrix.shape[1] != self.dim:
+                return self._empty()
+            entries = {e["path"]: e for e in manifest["files"]}
+            return entries, matrix
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("Embedding store unreadable, rebuilding: %s", e)
+            return self._empty()
+
+    def scan(self):
+        """Lists {rel_path: (usn, size, mtime_ns)} for every student image."""
+        found = {}
+        if not os.path.exists(self.faces_dir):
+            return found
+        for student in os.scandir(self.faces_dir):
+            if not student.is_dir() or student.name.startswith("."):
+                continue
+            for img in os.scandir(student.path):
+                if not img.is_file() or not img.name.endswith(".jpg"):
+                    continue
+                st = img.stat()
+                rel_path = f"{student.name}/{img.name}"
+                found[rel_path] = (student.name, st.st_size, st.st_mtime_ns)
+        return found
+
+    def _rel_path(self, path):
+        return os.path.relpath(path, self.faces_dir).replace(os.sep, "/")
+
+    def remember(self, embeddings_by_path):
+        """Keeps embeddings of newly enrolled images (under faces/) for the next sync.
+
+        Returns the set of paths the store already holds with the same
+        size/mtime, i.e. a sync has embedded them first.
+        """
+        entries, _ = self.load()
+        stored = set()
+        with self._pending_lock:
+            for path, embedding in embeddings_by_path.items():
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                rel_path = self._rel_path(path)
+                old = entries.get(rel_path)
+                if old is not None and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+                    stored.add(path)
+                    continue
+                self._pending[rel_path] = (st.st_size, st.st_mtime_ns, np.asarray(embedding, dtype=np.float32))
+        return stored
+
+    def persist_pending(self):
+        """Writes the embeddings handed to remember() into the store on disk now.
+
+        Needed when several processes sync the same faces/ (a shared
+        gallery): remembered embeddings only live in the enrolling process,
+        so without this another worker's sync would embed those images again.
+        Call under the same cross-process lock as sync().
+        """
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        entries, matrix = self.load()
+        # Rows are renumbered: stored images first, then the remembered ones
+        new_files = []
+        kept = []
+        for path, e in entries.items():
+            if path in pending:
+                continue
+            e = dict(e)
+            if e["row"] is not None:
+                kept.append(matrix[e["row"]])
+                e["row"] = len(kept) - 1
+            new_files.append(e)
+        for rel_path, (size, mtime_ns, embedding) in sorted(pending.items()):
+            kept.append(embedding.reshape(self.dim))
+            new_files.append({"path": rel_path, "usn": rel_path.split("/", 1)[0], "size": size,
+                              "mtime_ns": mtime_ns, "row": len(kept) - 1})
+        self.save(new_files, np.stack(kept))
+        return len(pending)
+
+    def sync(self, embed_fn):
+        """Brings the store up to date with faces/ and returns {usn: (n, dim) array}.
+
+        embed_fn(paths) -> list of embeddings (or None when an image is unusable).
+        Only images that are new or whose size/mtime changed are passed to it,
+        unless remember() already supplied their embedding, and at most
+        `embed_batch` paths per call, so a cold start over a large faces/
+        never holds more than one chunk of images. Counts of added,
+        changed and removed images are left in `last_changes`.
+        """
+        entries, matrix = self.load()
+        found = self.scan()
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+
+        new_entries = []
+        rows = []
+        to_embed = []
+        changes = {"added": 0, "changed": 0, "removed": len(set(entries) - set(found))}
+        for rel_path, (usn, size, mtime_ns) in sorted(found.items()):
+            new_entries.append({"path": rel_path, "usn": usn, "size": size,
+                                "mtime_ns": mtime_ns, "row": None})
+            old = entries.get(rel_path)
+            if old is not None and old["size"] == size and old["mtime_ns"] == mtime_ns:
+                # Unchanged: reuse the stored row (None if it had no usable face)
+                rows.append(None if old["row"] is None else matrix[old["row"]])
+                continue
+
+            changes["added" if old is None else "changed"] += 1
+            known = pending.get(rel_path)
+            if known is not None and known[:2] == (size, mtime_ns):
+                # Embedded at enrollment
+                rows.append(known[2])
+            else:
+                rows.append(None)
+                to_embed.append(len(new_entries) - 1)
+        self.last_changes = changes
+
+        if to_embed:
+            log.info("Embedding %d new or changed images...", len(to_embed))
+            for start in range(0, len(to_embed), self.embed_batch):
+                chunk = to_embed[start:start + self.embed_batch]
+                paths = [os.path.join(self.faces_dir, new_entries[i]["path"]) for i in chunk]
+                for i, emb in zip(chunk, embed_fn(paths)):
+                    rows[i] = emb
+                if len(to_embed) > self.embed_batch:
+                    log.info("Embedded %d/%d images", min(start + self.embed_batch, len(to_embed)), len(to_embed))
+
+        # Assign matrix rows in order
+        kept = []
+        for entry, emb in zip(new_entries, rows):
+            if emb is not None:
+                entry["row"] = len(kept)
+                kept.append(np.asarray(emb, dtype=np.float32).reshape(self.dim))
+
+        new_matrix = np.stack(kept) if kept else np.zeros((0, self.dim), dtype=np.float32)
+        if any(changes.values()):
+            self.save(new_entries, new_matrix)
+
+        by_usn = {}
+        for entry in new_entries:
+            if entry["row"] is not None:
+                by_usn.setdefault(entry["usn"], []).append(new_matrix[entry["row"]])
+        return {usn: np.stack(embs) for usn, embs in by_usn.items()}
+
+    def save(self, entries, matrix):
+        os.makedirs(self.store_dir, exist_ok=True)
+        matrix_name = f"embeddings-{uuid.uuid4().hex[:12]}.npy"
+        np.save(os.path.join(self.store_dir, matrix_name), np.ascontiguousarray(matrix, dtype=np.float32))
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "model_key": self.model_key,
+            "dim": self.dim,
+            "matrix": matrix_name,
+            "files": entries,
+        }
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+        # Old matrices are no longer referenced
+        for name in os.listdir(self.store_dir):
+            if name.startswith("embeddings-") and name.endswith(".npy") and name != matrix_name:
+                try:
+                    os.remove(os.path.join(self.store_dir, name))
+                except OSError:
+                    pass
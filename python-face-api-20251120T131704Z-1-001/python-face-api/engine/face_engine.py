@@ -1,26 +1,115 @@
 
 import os
+import logging
 import cv2
 import numpy as np
 import onnxruntime
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from engine.postprocess import SCRFDPostprocessor, FEAT_STRIDES, nms, merge_tiles
+from engine.alignment import ARCFACE_DST, align_batch, similarity_transforms
+from engine.session_config import load_session_config, create_session
+from engine import metrics
+
+log = logging.getLogger(__name__)
 
 class RetinaFace:
-    def __init__(self, model_file, nms_threshold=0.4):
-        self.session = onnxruntime.InferenceSession(model_file, providers=['CPUExecutionProvider'])
+    def __init__(self, model_file, nms_threshold=0.4, pre_nms_topk=1000, input_size=None, session_config=None,
+                 tile_size=None, tile_overlap=0.25, tile_workers=2):
+        self.session = create_session(model_file, session_config)
         self.nms_threshold = nms_threshold
         # SCRFD strides
-        self.strides = [8, 16, 32]
+        self.strides = FEAT_STRIDES
+        # Anchor grids are cached per padded input shape inside the postprocessor
+        self.postprocess = SCRFDPostprocessor(nms_threshold=nms_threshold, pre_nms_topk=pre_nms_topk)
         
-    def detect_scrfd(self, img, threshold=0.5):
-        # Implementation for SCRFD (buffalo_l det_10g.onnx)
+        # Optional fixed letterbox input, e.g. 640 or (640, 480) as (width, height)
+        self.input_size = None
+        if input_size:
+            self._init_fixed_input(input_size)
+
+        # Optional tiled mode for large frames (see detect_tiled)
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_workers = tile_workers
+        self._tile_pool = None
+        self._tile_pool_pid = None
+        self._tile_pool_lock = threading.Lock()
+
+    def _init_fixed_input(self, input_size):
+        if isinstance(input_size, int):
+            input_size = (input_size, input_size)
+        width, height = input_size
+        if width % 32 or height % 32:
+            raise ValueError(f"Detector input size must be a multiple of 32, got {input_size}")
+        self.input_size = (width, height)
+
+        # Preallocated NCHW input; the letterbox padding value is a normalized 0
+        self._pad_value = (0.0 - 127.5) / 128.0
+        self._input = np.full((1, 3, height, width), self._pad_value, dtype=np.float32)
+        self._filled_hw = None
+        self._resized = None
+
+        # Bind input and outputs once so ORT reuses the same buffers on every call.
+        # Output shapes are fixed for a fixed input, so one dry run discovers them.
+        input_name = self.session.get_inputs()[0].name
+        outs = self.session.run(None, {input_name: self._input})
+        self._outputs = [np.empty_like(o) for o in outs]
+
+        self._binding = self.session.io_binding()
+        self._binding.bind_ortvalue_input(input_name, onnxruntime.OrtValue.ortvalue_from_numpy(self._input))
+        for meta, out in zip(self.session.get_outputs(), self._outputs):
+            self._binding.bind_ortvalue_output(meta.name, onnxruntime.OrtValue.ortvalue_from_numpy(out))
+
+        # The bound buffers are shared, so fixed-shape calls run one at a time
+        self._io_lock = threading.Lock()
+
+    def _fill_input(self, img):
+        """Letterboxes a BGR frame into the preallocated input buffer.
+
+        Fuses BGR->RGB, (x - 127.5) / 128 and HWC->CHW; only the resize allocates,
+        and its output is reused while the frame size stays the same.
+        Returns the scale used to map detections back to the frame.
+        """
+        width, height = self.input_size
+        input_height, input_width = img.shape[:2]
+        
+        # Same rule as the dynamic path: only ever downscale
+        ratio = min(width / input_width, height / input_height)
+        if ratio < 1.0:
+            new_height = int(input_height * ratio)
+            new_width = int(input_width * ratio)
+            if self._resized is None or self._resized.shape[:2] != (new_height, new_width):
+                self._resized = np.empty((new_height, new_width, 3), dtype=np.uint8)
+            src = cv2.resize(img, (new_width, new_height), dst=self._resized)
+            scale = ratio
+        else:
+            src = img
+            scale = 1.0
+
+        h, w = src.shape[:2]
+        blob = self._input[0]
+        if self._filled_hw != (h, w):
+            # Content area moved: reset the padding
+            blob.fill(self._pad_value)
+            self._filled_hw = (h, w)
+            
+        for c in range(3):
+            np.subtract(src[:, :, 2 - c], 127.5, out=blob[c, :h, :w], dtype=np.float32)
+        blob[:, :h, :w] *= 1.0 / 128.0
+        return scale
+
+    def preprocess(self, img, target_size=640):
+        """Dynamic-shape input: long side scaled to `target_size`, padded to a multiple of 32.
+
+        Returns (NCHW float32 blob, scale).
+        """
         # Preprocessing
         img_input = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         input_height, input_width, _ = img_input.shape
         
         # Dynamic resize
-        target_size = 640
-        const_max_size = 1280
         
         ratio = target_size / max(input_height, input_width)
         if ratio < 1.0:
@@ -37,252 +126,403 @@ class RetinaFace:
         pad_w = (32 - w % 32) % 32
         if pad_h > 0 or pad_w > 0:
             img_input = cv2.copyMakeBorder(img_input, 0, pad_h, 0, pad_w, cv2.BORDER_CONSTANT, value=(0,0,0))
-            
-        final_h, final_w = img_input.shape[:2]
         
         img_blob = img_input.transpose(2, 0, 1)
         img_blob = np.expand_dims(img_blob, 0).astype(np.float32)
         img_blob = (img_blob - 127.5) / 128.0
         
-        input_name = self.session.get_inputs()[0].name
-        outs = self.session.run(None, {input_name: img_blob})
-        
-        # DEBUG: Print all output shapes
-        print("DEBUG: ONNX Output Shapes:")
-        for i, o in enumerate(outs):
-            print(f"  Out {i}: {o.shape}")
+        return img_blob, scale
 
-        proposals = []
-        
-        # RetinaFace/SCRFD Anchor Config for det_10g
-        _feat_stride_fpn = [8, 16, 32]
-        _anchors_fpn = {
-            8:  [16, 32],
-            16: [64, 128],
-            32: [256, 512]
-        }
+    def detect_scrfd(self, img, threshold=0.5, target_size=640):
+        """Single-pass detection; `target_size` is the dynamic path's long side (a fixed input ignores it)."""
+        if self.input_size is not None:
+            width, height = self.input_size
+            with self._io_lock:
+                with metrics.stage("detect_preprocess"):
+                    scale = self._fill_input(img)
+                with metrics.stage("detect_inference"):
+                    self.session.run_with_iobinding(self._binding)
+                return self.postprocess(self._outputs, height, width, scale, threshold)
+        return self.detect_dynamic(img, threshold, target_size)
+
+    def detect_dynamic(self, img, threshold=0.5, target_size=640):
+        """Dynamic-shape detection; small images (e.g. ROI crops) run at their own size."""
+        # Implementation for SCRFD (buffalo_l det_10g.onnx)
+        with metrics.stage("detect_preprocess"):
+            img_blob, scale = self.preprocess(img, target_size)
+        final_h, final_w = img_blob.shape[2:]
         
-        # Output mapping (based on debug_shapes_out.txt)
-        # Stride 8:  0 (score), 3 (bbox), 6 (kps)
-        # Stride 16: 1 (score), 4 (bbox), 7 (kps)
-        # Stride 32: 2 (score), 5 (bbox), 8 (kps)
+        input_name = self.session.get_inputs()[0].name
+        with metrics.stage("detect_inference"):
+            outs = self.session.run(None, {input_name: img_blob})
         
-        output_map = {
-            8:  {'score': 0, 'bbox': 3, 'kps': 6},
-            16: {'score': 1, 'bbox': 4, 'kps': 7},
-            32: {'score': 2, 'bbox': 5, 'kps': 8}
-        }
-
-        for stride in _feat_stride_fpn:
-            anchors_size = _anchors_fpn[stride] 
-            
-            idx_score = output_map[stride]['score']
-            idx_bbox = output_map[stride]['bbox']
-            idx_kps = output_map[stride]['kps']
-
-            # Handle (N, C) or (1, N, C)
-            score_blob = outs[idx_score]
-            bbox_blob = outs[idx_bbox]
-            kps_blob = outs[idx_kps]
-            
-            if len(score_blob.shape) == 3: score_blob = score_blob[0]
-            if len(bbox_blob.shape) == 3: bbox_blob = bbox_blob[0]
-            if len(kps_blob.shape) == 3: kps_blob = kps_blob[0]
-            
-            fh = final_h // stride
-            fw = final_w // stride
-            num_anchors = len(anchors_size) # 2
-            
-            # Sanity check
-            if score_blob.shape[0] != fh * fw * num_anchors:
-                continue
-                
-            scores = score_blob[:, 0]
-            mask = scores > threshold
-            if not np.any(mask):
-                continue
-                
-            scores = scores[mask]
-            bbox_blob = bbox_blob[mask]
-            kps_blob = kps_blob[mask]
-            
-            # Grid
-            grid_y, grid_x = np.meshgrid(np.arange(fh), np.arange(fw), indexing='ij')
-            grid_x_tiled = np.repeat(grid_x.flatten(), num_anchors)
-            grid_y_tiled = np.repeat(grid_y.flatten(), num_anchors)
-            
-            grid_x_masked = grid_x_tiled[mask]
-            grid_y_masked = grid_y_tiled[mask]
-            
-            # Anchor sizes
-            anchor_sizes_tiled = np.tile(anchors_size, fh * fw)
-            proposals_anchor_sizes = anchor_sizes_tiled[mask]
-            
-            # Decode centers
-            cx = grid_x_masked * stride + stride / 2
-            cy = grid_y_masked * stride + stride / 2
-            
-            # Decode bbox
-            tx = bbox_blob[:, 0]
-            ty = bbox_blob[:, 1]
-            tw = bbox_blob[:, 2]
-            th = bbox_blob[:, 3]
-            
-            anchor_w = proposals_anchor_sizes
-            anchor_h = proposals_anchor_sizes
-            
-            dx = tx * 0.1 * anchor_w
-            dy = ty * 0.1 * anchor_h
-            dw = np.exp(tw * 0.2) * anchor_w
-            dh = np.exp(th * 0.2) * anchor_h
-            
-            pred_cx = dx + cx
-            pred_cy = dy + cy
-            pred_w = dw
-            pred_h = dh
-            
-            x1 = pred_cx - pred_w / 2
-            y1 = pred_cy - pred_h / 2
-            x2 = pred_cx + pred_w / 2
-            y2 = pred_cy + pred_h / 2
-            
-            # Decode KPS (5 points: x1,y1, x2,y2 ...)
-            kps = np.zeros_like(kps_blob)
-            for i in range(5):
-                px = kps_blob[:, i*2] * stride + cx
-                py = kps_blob[:, i*2+1] * stride + cy
-                kps[:, i*2] = px
-                kps[:, i*2+1] = py
-            
-            # Combine [x1, y1, x2, y2, score, kps(10)]
-            dets = np.stack([x1, y1, x2, y2, scores], axis=1)
-            dets = np.concatenate([dets, kps], axis=1)
-            
-            # Rescale
-            dets[:, :15] /= scale
-            proposals.append(dets)
+        # Decode all strides, cap candidates and run NMS
+        return self.postprocess(outs, final_h, final_w, scale, threshold)
 
-            fh = final_h // stride
-            fw = final_w // stride
-            target_n = fh * fw
-            
-            # Find matching outputs
-            
-        if not proposals:
-            return []
-            
-        proposals = np.concatenate(proposals, axis=0)
-        
-        # NMS
-        keep = self.nms(proposals, self.nms_threshold)
-        return proposals[keep]
+    def tiles(self, height, width):
+        """(x, y, w, h) of overlapping tiles covering a frame; edge tiles sit flush with the border."""
+        size = self.tile_size
+        step = max(1, int(size * (1.0 - self.tile_overlap)))
+
+        def starts(length):
+            if length <= size:
+                return [0]
+            positions = list(range(0, length - size, step))
+            return positions + [length - size]
+
+        return [(x, y, min(size, width), min(size, height)) for y in starts(height) for x in starts(width)]
+
+    def _executor(self):
+        # Created on first use and again in a forked child, whose copy has no threads
+        if self._tile_pool is None or self._tile_pool_pid != os.getpid():
+            with self._tile_pool_lock:
+                if self._tile_pool is None or self._tile_pool_pid != os.getpid():
+                    self._tile_pool = ThreadPoolExecutor(self.tile_workers, thread_name_prefix="det-tile")
+                    self._tile_pool_pid = os.getpid()
+        return self._tile_pool
+
+    def detect_tiled(self, img, threshold=0.5):
+        """Detection on overlapping `tile_size` tiles at full resolution, for small distant faces.
+
+        Each tile runs through the dynamic-shape detector (in `tile_workers`
+        threads), alongside one regular downscaled pass over the whole frame
+        that catches faces too large for a tile. Boxes and landmarks are
+        shifted to frame coordinates and merged by one cross-tile NMS. Frames
+        that fit in a single tile take the regular path.
+        """
+        height, width = img.shape[:2]
+        if not self.tile_size or max(height, width) <= self.tile_size:
+            return self.detect_scrfd(img, threshold)
+
+        tiles = self.tiles(height, width)
+
+        def run(tile):
+            x, y, w, h = tile
+            dets = self.detect_dynamic(img[y:y + h, x:x + w], threshold)
+            return dets if len(dets) else np.zeros((0, 15), dtype=np.float64)
+
+        if self.tile_workers and self.tile_workers > 1:
+            global_future = self._executor().submit(self.detect_scrfd, img, threshold)
+            per_tile = list(self._executor().map(run, tiles))
+            whole = global_future.result()
+        else:
+            per_tile = [run(tile) for tile in tiles]
+            whole = self.detect_scrfd(img, threshold)
+
+        with metrics.stage("detect_merge"):
+            # Boxes within `margin` of an inner tile border may be cut off
+            margin = 0.01 * self.tile_size
+            dets = [np.asarray(whole, dtype=np.float64).reshape(-1, 15)]
+            clipped = [np.zeros(len(dets[0]), dtype=bool)]
+            for (x, y, w, h), tile_dets in zip(tiles, per_tile):
+                if len(tile_dets) == 0:
+                    continue
+                tile_dets = tile_dets.copy()
+                tile_dets[:, [0, 2, 5, 7, 9, 11, 13]] += x
+                tile_dets[:, [1, 3, 6, 8, 10, 12, 14]] += y
+                cut = np.zeros(len(tile_dets), dtype=bool)
+                if x > 0:
+                    cut |= tile_dets[:, 0] < x + margin
+                if y > 0:
+                    cut |= tile_dets[:, 1] < y + margin
+                if x + w < width:
+                    cut |= tile_dets[:, 2] > x + w - margin
+                if y + h < height:
+                    cut |= tile_dets[:, 3] > y + h - margin
+                dets.append(tile_dets)
+                clipped.append(cut)
+
+            dets = np.concatenate(dets)
+            if len(dets) == 0:
+                return []
+            keep = merge_tiles(dets, np.concatenate(clipped), self.nms_threshold)
+        return dets[keep]
 
     def nms(self, dets, thresh):
-        x1 = dets[:, 0]
-        y1 = dets[:, 1]
-        x2 = dets[:, 2]
-        y2 = dets[:, 3]
-        scores = dets[:, 4]
-
-        areas = (x2 - x1 + 1) * (y2 - y1 + 1)
-        order = scores.argsort()[::-1]
-
-        keep = []
-        while order.size > 0:
-            i = order[0]
-            keep.append(i)
-            xx1 = np.maximum(x1[i], x1[order[1:]])
-            yy1 = np.maximum(y1[i], y1[order[1:]])
-            xx2 = np.minimum(x2[i], x2[order[1:]])
-            yy2 = np.minimum(y2[i], y2[order[1:]])
-
-            w = np.maximum(0.0, xx2 - xx1 + 1)
-            h = np.maximum(0.0, yy2 - yy1 + 1)
-            inter = w * h
-            ovr = inter / (areas[i] + areas[order[1:]] - inter)
-
-            inds = np.where(ovr <= thresh)[0]
-            order = order[inds + 1]
-
-        return keep
+        return nms(dets, thresh)
 
 class ArcFace:
-    def __init__(self, model_file):
-        self.session = onnxruntime.InferenceSession(model_file, providers=['CPUExecutionProvider'])
+    def __init__(self, model_file, max_batch_size=None, session_config=None):
+        self.session = create_session(model_file, session_config)
+        self.input_name = self.session.get_inputs()[0].name
         
-    def get_embedding(self, face_img):
-        # Resize to 112x112 using linear interpolation for better quality than default nearest?
-        # Actually cv2 default is linear.
-        face_img = cv2.resize(face_img, (112, 112))
-        face_img = cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB)
+        # Models exported with a fixed batch dimension can only take that many crops per run
+        batch_dim = self.session.get_inputs()[0].shape[0]
+        if isinstance(batch_dim, int) and batch_dim > 0:
+            max_batch_size = batch_dim if max_batch_size is None else min(max_batch_size, batch_dim)
+        self.max_batch_size = max_batch_size
         
-        face_img = np.transpose(face_img, (2, 0, 1)).astype(np.float32)
-        face_img = np.expand_dims(face_img, 0)
-        face_img = (face_img - 127.5) / 128.0
+    def get_embedding(self, face_img):
+        return self.get_embeddings([face_img])[0]
+
+    def get_embeddings(self, face_imgs, max_batch_size=None):
+        """Embeds a list of BGR face crops with one ORT run per batch.
+
+        Crops that are not already 112x112 are resized first.
+        Returns: (N, 512) float32 array of L2-normalized embeddings.
+        """
+        if len(face_imgs) == 0:
+            return np.zeros((0, 512), dtype=np.float32)
+
+        with metrics.stage("embed_preprocess"):
+            blob = self.preprocess(face_imgs)
+        batch_size = min(b for b in (max_batch_size, self.max_batch_size, len(blob)) if b)
         
-        input_name = self.session.get_inputs()[0].name
-        embedding = self.session.run(None, {input_name: face_img})[0]
+        outputs = []
+        with metrics.stage("embed_inference"):
+            for start in range(0, len(blob), batch_size):
+                outputs.append(self.session.run(None, {self.input_name: blob[start:start + batch_size]})[0])
+        embeddings = np.concatenate(outputs, axis=0).reshape(len(blob), -1)
         
-        embedding = embedding / np.linalg.norm(embedding)
-        return embedding.flatten()
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings.astype(np.float32)
+
+    def preprocess(self, face_imgs):
+        """BGR face crops (a list, or an (N,112,112,3) uint8 batch) -> (N,3,112,112) float32 blob."""
+        # Stack into (N,112,112,3), then BGR->RGB, HWC->CHW and normalize in one pass
+        if isinstance(face_imgs, np.ndarray) and face_imgs.shape[1:] == (112, 112, 3):
+            crops = face_imgs
+        else:
+            crops = np.empty((len(face_imgs), 112, 112, 3), dtype=np.uint8)
+            for i, face_img in enumerate(face_imgs):
+                if face_img.shape[:2] != (112, 112):
+                    face_img = cv2.resize(face_img, (112, 112))
+                crops[i] = face_img
+        blob = crops[..., ::-1].transpose(0, 3, 1, 2).astype(np.float32)
+        blob -= 127.5
+        blob /= 128.0
+        return blob
 
 class FaceEngine:
-    def __init__(self, det_path, rec_path):
-        self.detector = RetinaFace(det_path) 
-        self.recognizer = ArcFace(rec_path)
+    def __init__(self, det_path, rec_path, rec_batch_size=None, det_input_size=None, config_file=None,
+                 det_tile_size=None, det_tile_overlap=0.25, det_tile_workers=2):
+        # Threads, execution mode, optimization level, arena and graph caching per model
+        det_config = load_session_config("det", config_file)
+        rec_config = load_session_config("rec", config_file)
         
-        # Computed via skimage.transform.SimilarityTransform
-        # for standard 112x112 ArcFace
-        self.arcface_dst = np.array([
-            [38.2946, 51.6963],
-            [73.5318, 51.5014],
-            [56.0252, 71.7366],
-            [41.5493, 92.3655],
-            [70.7299, 92.2041] ], dtype=np.float32)
+        self.detector = RetinaFace(det_path, input_size=det_input_size, session_config=det_config,
+                                   tile_size=det_tile_size, tile_overlap=det_tile_overlap, tile_workers=det_tile_workers)
+        self.recognizer = ArcFace(rec_path, max_batch_size=rec_batch_size, session_config=rec_config)
+        
+        self.arcface_dst = ARCFACE_DST
+        # Aligned crop buffers for align_faces, one per thread
+        self._crops = threading.local()
 
     def estimate_norm(self, lmk):
+        """2x3 similarity transform from 5 landmarks to the ArcFace template, or None."""
         assert lmk.shape == (5, 2)
-        dst = self.arcface_dst
-        M, _ = cv2.estimateAffinePartial2D(lmk, dst, method=cv2.LMEDS)
-        return M
+        M, valid = similarity_transforms(lmk[None], self.arcface_dst)
+        return M[0] if valid[0] else None
+
+    def detect(self, frame, input_size=640, min_face=40):
+        """Detects faces large enough to recognize.
+
+        Returns a list of {bbox, confidence, kps} in frame coordinates.
+        `input_size` is the long side the frame is scaled down to for the
+        detector. With a detector tile size set, large frames are detected in tiles.
+        Faces narrower or shorter than `min_face` frame pixels are dropped; for a
+        frame decoded at reduced size, pass the original threshold divided by the
+        reduction.
+        """
+        if self.detector.tile_size:
+            faces = self.detector.detect_tiled(frame, threshold=0.4)
+        else:
+            faces = self.detector.detect_scrfd(frame, threshold=0.4, target_size=input_size)
 
-    def analyze(self, frame):
-        # 1. Detect
-        faces = self.detector.detect_scrfd(frame, threshold=0.4)
-        
         results = []
         for face in faces:
             # Face: [x1, y1, x2, y2, score, kps(10)]
             x1, y1, x2, y2, score = face[:5]
-            kps = face[5:15].reshape(5, 2)
-            
-            # Align
+
             # Filter small faces
-            if (x2 - x1) < 40 or (y2 - y1) < 40:
+            if (x2 - x1) < min_face or (y2 - y1) < min_face:
                 continue
 
-            try:
-                M = self.estimate_norm(kps)
-                if M is None:
-                    raise ValueError("Transform failed")
-                face_crop = cv2.warpAffine(frame, M, (112, 112), borderValue=0.0)
-            except:
-                # Fallback to simple crop
-                h, w, _ = frame.shape
-                x1 = max(0, int(x1))
-                y1 = max(0, int(y1))
-                x2 = min(w, int(x2))
-                y2 = min(h, int(y2))
-                face_crop = frame[y1:y2, x1:x2]
-            
-            # 2. Recognize
-            embedding = self.recognizer.get_embedding(face_crop)
-            
             results.append({
                 "bbox": [x1, y1, x2, y2],
                 "confidence": score,
-                "embedding": embedding,
-                "kps": kps.tolist()
+                "kps": face[5:15].reshape(5, 2).tolist()
             })
-            
         return results
+
+    def detect_in_rois(self, frame, boxes, margin=0.5, threshold=0.4, gap=16, target_size=640, min_face=40):
+        """Looks for one face inside each box, expanded by `margin` of its size per side.
+
+        Used to confirm tracks between full-frame detections. The ROIs are
+        packed side by side, `gap` black pixels apart, into one canvas that
+        goes through the detector in a single run at full resolution. When
+        the canvas (at most `target_size` wide, unless one ROI is wider) would
+        hold more pixels than the frame scaled to `target_size`, as with many
+        or large tracks, the whole frame is detected once instead. Returns a list aligned with
+        `boxes` holding the highest-scoring {bbox, confidence, kps} dict whose
+        centre lies in the ROI, in frame coordinates, or None where no face
+        was found. `min_face` is as in detect.
+        """
+        h, w = frame.shape[:2]
+        rois = []
+        for box in boxes:
+            x1, y1, x2, y2 = box[:4]
+            mx, my = (x2 - x1) * margin, (y2 - y1) * margin
+            rx1, ry1 = max(0, int(x1 - mx)), max(0, int(y1 - my))
+            rx2, ry2 = min(w, int(x2 + mx)), min(h, int(y2 + my))
+            rois.append((rx1, ry1, rx2, ry2) if rx2 - rx1 >= min_face and ry2 - ry1 >= min_face else None)
+
+        valid = [i for i, roi in enumerate(rois) if roi is not None]
+        if not valid:
+            return [None] * len(boxes)
+
+        sizes = [(rois[i][2] - rois[i][0], rois[i][3] - rois[i][1]) for i in valid]
+        canvas_w, canvas_h, offsets = self._pack(sizes, target_size, gap)
+        if canvas_w * canvas_h > w * h * min(1.0, target_size / max(h, w)) ** 2:
+            faces = self.detector.detect_scrfd(frame, threshold=threshold, target_size=target_size)
+        else:
+            canvas = np.zeros((canvas_h, canvas_w, 3), dtype=np.uint8)
+            for i, (cx, cy) in zip(valid, offsets):
+                rx1, ry1, rx2, ry2 = rois[i]
+                canvas[cy:cy + ry2 - ry1, cx:cx + rx2 - rx1] = frame[ry1:ry2, rx1:rx2]
+            faces = self.detector.detect_dynamic(canvas, threshold=threshold, target_size=max(canvas_h, canvas_w))
+            faces = self._unpack(faces, [rois[i] for i in valid], offsets)
+
+        faces = np.asarray(faces, dtype=np.float64).reshape(-1, 15)
+        faces = faces[((faces[:, 2] - faces[:, 0]) >= min_face) & ((faces[:, 3] - faces[:, 1]) >= min_face)]
+        centres = (faces[:, :2] + faces[:, 2:4]) / 2
+        found = [None] * len(boxes)
+        for i in valid:
+            rx1, ry1, rx2, ry2 = rois[i]
+            inside = np.flatnonzero((centres[:, 0] >= rx1) & (centres[:, 0] < rx2) &
+                                    (centres[:, 1] >= ry1) & (centres[:, 1] < ry2))
+            if len(inside) == 0:
+                continue
+            face = faces[inside[np.argmax(faces[inside, 4])]]
+            found[i] = {
+                "bbox": face[:4].tolist(),
+                "confidence": face[4],
+                "kps": face[5:15].reshape(5, 2).tolist()
+            }
+        return found
+
+    @staticmethod
+    def _pack(sizes, width, gap, align=32):
+        """Shelf-packs (w, h) rectangles at least `gap` apart into shelves up to `width` wide.
+
+        Rectangles start on multiples of `align` (the largest detector stride),
+        so each ROI meets the detector's anchor grid as it would on its own.
+        Returns (width, height, [(x, y)] per rectangle).
+        """
+        def up(v):
+            return -(-v // align) * align
+
+        offsets = [None] * len(sizes)
+        x = y = shelf = right = 0
+        for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+            w, h = sizes[i]
+            if x and x + w > width:
+                x, y, shelf = 0, up(y + shelf + gap), 0
+            offsets[i] = (x, y)
+            right = max(right, x + w)
+            x = up(x + w + gap)
+            shelf = max(shelf, h)
+        return right, y + shelf, offsets
+
+    @staticmethod
+    def _unpack(faces, rois, offsets):
+        # Keeps each face whose centre lies in a packed ROI, shifted to frame coordinates
+        kept = []
+        for face in faces:
+            cx, cy = (face[0] + face[2]) / 2, (face[1] + face[3]) / 2
+            for (rx1, ry1, rx2, ry2), (ox, oy) in zip(rois, offsets):
+                if ox <= cx < ox + rx2 - rx1 and oy <= cy < oy + ry2 - ry1:
+                    face = face.copy()
+                    face[[0, 2, 5, 7, 9, 11, 13]] += rx1 - ox
+                    face[[1, 3, 6, 8, 10, 12, 14]] += ry1 - oy
+                    kept.append(face)
+                    break
+        return kept
+
+    def align_faces(self, frame, results):
+        """(N, 112, 112, 3) aligned crops for detected faces (as returned by `detect`).
+
+        `frame` is the image holding every face, or a sequence with one image
+        per face, so the faces of several frames can be aligned together.
+        The crops are a view of a per-thread buffer that only grows, valid
+        until the thread's next align_faces call.
+        """
+        if not results:
+            return np.empty((0, 112, 112, 3), dtype=np.uint8)
+        kps = np.array([res["kps"] for res in results], dtype=np.float32)
+        boxes = np.array([res["bbox"] for res in results], dtype=np.float64)
+        buffer = getattr(self._crops, "buffer", None)
+        if buffer is None or len(buffer) < len(results):
+            buffer = self._crops.buffer = np.empty((max(len(results), 16), 112, 112, 3), dtype=np.uint8)
+        # Faces whose transform fails fall back to a plain crop of their box
+        return align_batch(frame, kps, boxes, out=buffer[:len(results)])
+
+    def embed_faces(self, frame, results):
+        """Aligns and embeds detected faces in one batched pass.
+
+        Sets "embedding" on each of `results` (as returned by `detect`).
+        """
+        embeddings = self.recognizer.get_embeddings(self.align_faces(frame, results))
+        for res, embedding in zip(results, embeddings):
+            res["embedding"] = embedding
+        return results
+
+    def analyze(self, frame):
+        # 1. Detect, 2. recognize all faces of the frame in one batched pass
+        return self.embed_faces(frame, self.detect(frame))
+
+    def enrollment_crop(self, img, threshold=0.5):
+        """Aligned 112x112 crop of the largest face in an enrollment image.
+
+        An image with no detected face is returned whole (it is assumed to be
+        a face crop already). Returns None if the face could not be cropped.
+        """
+        faces = self.detector.detect_scrfd(img, threshold=threshold)
+        if len(faces) == 0:
+            # Fallback: assume image IS the face
+            return img
+
+        # Take largest face
+        areas = (faces[:, 2] - faces[:, 0]) * (faces[:, 3] - faces[:, 1])
+        face = faces[np.argmax(areas)]
+        kps = face[5:15].reshape(5, 2)
+
+        transforms = similarity_transforms(kps[None], self.arcface_dst)
+        if transforms[1][0]:
+            return align_batch(img, kps[None], transforms=transforms)[0]
+        # Fallback crop
+        x1, y1, x2, y2 = face[:4].astype(int)
+        crop = img[max(0, y1):y2, max(0, x1):x2]
+        return crop if crop.size > 0 else None
+
+    def get_enrollment_embeddings(self, images, threshold=0.5):
+        """Embeds the largest face of each enrollment image.
+
+        Images with no detected face are embedded whole (they are assumed to be
+        a face crop already). `images` may be a generator: each image is
+        reduced to its 112x112 crop before the next one is read. Returns a
+        list aligned with `images`, holding None where an image could not be used.
+        """
+        crops = []
+        crop_idx = []
+        count = 0
+        for i, img in enumerate(images):
+            count += 1
+            if img is None:
+                continue
+            try:
+                crop = self.enrollment_crop(img, threshold)
+            except Exception as e:
+                log.warning("Error detecting enrollment face %d: %s", i, e)
+                continue
+            if crop is None:
+                continue
+            if crop.shape[:2] != (112, 112):
+                crop = cv2.resize(crop, (112, 112))
+            crops.append(crop)
+            crop_idx.append(i)
+            
+        embeddings = [None] * count
+        for i, emb in zip(crop_idx, self.recognizer.get_embeddings(crops)):
+            embeddings[i] = emb
+        return embeddings
@@ -0,0 +1,70 @@
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class FacesWatcher:
+    """Polls faces/ and calls `on_change()` from a background thread when it changes.
+
+    Each poll stats faces/ and every student folder: adding, removing or
+    renaming an image (or a student) changes a folder mtime. Overwriting an
+    image in place only changes the file itself, so every `rescan_every`
+    polls on_change() runs regardless and the store's per-file size/mtime
+    check catches it.
+
+    Like MicroBatcher, the thread starts on first `ensure_started()` and is
+    restarted in a forked child, so the watcher can be created at import time
+    under a pre-fork WSGI server.
+    """
+
+    def __init__(self, faces_dir, on_change, interval=10.0, rescan_every=6, name="faces-watcher"):
+        self.faces_dir = faces_dir
+        self.on_change = on_change
+        self.interval = interval
+        self.rescan_every = rescan_every
+        self.name = name
+
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def signature(self):
+        """mtimes of faces/ and each student folder; changes when images are added or removed."""
+        try:
+            sig = [("", os.stat(self.faces_dir).st_mtime_ns)]
+            for entry in os.scandir(self.faces_dir):
+                if entry.is_dir() and not entry.name.startswith("."):
+                    sig.append((entry.name, entry.stat().st_mtime_ns))
+        except OSError:
+            return None
+        return sorted(sig)
+
+    def ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        last = self.signature()
+        polls = 0
+        while not self._stop.wait(self.interval):
+            polls += 1
+            sig = self.signature()
+            if sig == last and polls % self.rescan_every:
+                continue
+            try:
+                self.on_change()
+                last = sig
+            except Exception as e:
+                log.error("%s: sync failed: %s", self.name, e)
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class FrameGate:
+    """Per-stream change gate: reuses the last result while the picture stays the same.
+
+    Each frame is reduced to a small grayscale thumbnail (area-averaged, so
+    sensor noise mostly cancels out). A frame counts as changed
+    when more than `min_changed` of the thumbnail's pixels differ from the
+    last *recognized* frame by more than `pixel_delta` grey levels; comparing
+    against the last recognized frame rather than the previous one keeps
+    slow drift from sneaking past. A cached result is never older than
+    `max_age` seconds, and is only replayed for the gallery generation it
+    was recognized under.
+
+    `cost` is a running average of the recognition time the gate saves per
+    skipped frame.
+    """
+
+    def __init__(self, min_changed=0.01, pixel_delta=12, max_age=2.0, size=(64, 48)):
+        self.min_changed = min_changed
+        self.pixel_delta = pixel_delta
+        self.max_age = max_age
+        self.size = size
+
+        self._lock = threading.Lock()
+        self._reference = None
+        self._result = None
+        self._stamp = 0.0
+        self._generation = None
+        self.cost = 0.0
+        self.skipped = 0
+        self.recognized = 0
+
+    def thumbnail(self, frame):
+        # Green channel of every k-th pixel (~4x the thumbnail size) as luminance:
+        # area-resizing the full BGR frame costs more than 1ms at 720p
+        step = max(1, min(frame.shape[1] // (4 * self.size[0]), frame.shape[0] // (4 * self.size[1])))
+        luma = frame[::step, ::step, 1] if frame.ndim == 3 else frame[::step, ::step]
+        return cv2.resize(np.ascontiguousarray(luma), self.size, interpolation=cv2.INTER_AREA)
+
+    def changed_fraction(self, thumb):
+        if self._reference is None or self._reference.shape != thumb.shape:
+            return 1.0
+        diff = cv2.absdiff(thumb, self._reference)
+        return np.count_nonzero(diff > self.pixel_delta) / diff.size
+
+    def lookup(self, thumb, generation=None):
+        """The cached result if `thumb` shows the same scene as the last recognized frame, else None."""
+        with self._lock:
+            if self._result is None or time.monotonic() - self._stamp > self.max_age:
+                return None
+            if generation != self._generation:
+                return None
+            if self.changed_fraction(thumb) > self.min_changed:
+                return None
+            self.skipped += 1
+            return self._result
+
+    def update(self, thumb, result, seconds, generation=None):
+        """Records a freshly recognized frame, its result, what recognizing it cost
+        and the gallery generation it was recognized under."""
+        with self._lock:
+            self._reference = thumb
+            self._result = result
+            self._stamp = time.monotonic()
+            self._generation = generation
+            self.cost = seconds if self.recognized == 0 else 0.9 * self.cost + 0.1 * seconds
+            self.recognized += 1
+
+    @property
+    def skip_rate(self):
+        total = self.skipped + self.recognized
+        return self.skipped / total if total else 0.0
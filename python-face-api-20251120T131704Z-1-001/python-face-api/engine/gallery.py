@@ -0,0 +1,313 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# Immutable view of the gallery. Rows of `matrix` are grouped per student:
+# student i owns rows [starts[i], starts[i] + counts[i]).
+# `ids` are stable per-embedding ids shared with the optional ANN index.
+_Snapshot = namedtuple("_Snapshot", ["matrix", "labels", "usns", "starts", "counts", "ids", "id_to_student"])
+
+
+class Gallery:
+    """Enrolled embeddings kept as one contiguous float32 matrix.
+
+    `labels` is the parallel array of USNs (one per row). Every mutation builds
+    a new snapshot and swaps it in, so `match` never sees a half-updated gallery.
+
+    Without an index, `match` scores every row (exact). With an index from
+    engine.index (e.g. IVFIndex), the index proposes candidate rows and only
+    the students they belong to are scored and pooled.
+
+    With a `consolidator` (engine.consolidation.Consolidator), each student is
+    kept as a centroid plus a few medoids instead of every embedding; `add`
+    folds new embeddings in incrementally.
+    """
+
+    def __init__(self, dim=512, index=None, candidate_factor=4, consolidator=None):
+        self.dim = dim
+        self.index = index
+        self.candidate_factor = candidate_factor
+        self.consolidator = consolidator
+        self._lock = threading.Lock()
+        self._students = {}  # usn -> (n, dim) float32 array
+        self._student_ids = {}  # usn -> (n,) int64 embedding ids
+        self._summaries = {}  # usn -> consolidation Summary (None while rows are raw)
+        self._versions = {}  # usn -> value of _clock when the student's rows last changed (see adopt)
+        self._clock = 0  # Never reused, so a deleted and re-enrolled student gets a new version
+        self._next_id = 0
+        self._snapshot = self._build({}, {})
+        # Bumped whenever the enrolled rows change; callers caching identities compare it
+        self.generation = 0
+
+    def _build(self, students, student_ids, matrix=None):
+        # `matrix`, when given, already holds the students' rows in order (see adopt)
+        usns = list(students.keys())
+        counts = np.array([len(students[u]) for u in usns], dtype=np.int64)
+        starts = np.zeros(len(usns), dtype=np.int64)
+        if len(usns) > 1:
+            starts[1:] = np.cumsum(counts)[:-1]
+
+        if usns:
+            if matrix is None:
+                matrix = np.ascontiguousarray(np.concatenate([students[u] for u in usns], axis=0))
+            ids = np.concatenate([student_ids[u] for u in usns])
+        else:
+            matrix = np.zeros((0, self.dim), dtype=np.float32)
+            ids = np.zeros(0, dtype=np.int64)
+        labels = np.repeat(np.array(usns, dtype=object), counts)
+
+        id_to_student = {}
+        if self.index is not None:
+            id_to_student = dict(zip(ids.tolist(), np.repeat(np.arange(len(usns)), counts).tolist()))
+
+        return _Snapshot(matrix, labels, usns, starts, counts, ids, id_to_student)
+
+    def _as_matrix(self, embeddings):
+        embs = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        return np.ascontiguousarray(embs)
+
+    def _new_ids(self, n):
+        ids = np.arange(self._next_id, self._next_id + n, dtype=np.int64)
+        self._next_id += n
+        return ids
+
+    def replace(self, embeddings_by_usn):
+        """Replaces the whole gallery with {usn: [embedding, ...]}.
+
+        Students whose rows come out unchanged keep their ids and version, so
+        the index only sees the students that actually changed.
+        """
+        students = {}
+        summaries = {}
+        for usn, embs in embeddings_by_usn.items():
+            if len(embs) > 0:
+                students[usn] = self._as_matrix(embs)
+                if self.consolidator is not None:
+                    rows, summaries[usn] = self.consolidator.reduce(students[usn])
+                    students[usn] = self._as_matrix(rows)
+        with self._lock:
+            unchanged = {usn for usn, rows in students.items()
+                         if usn in self._students and np.array_equal(self._students[usn], rows)}
+            versions = {usn: self._versions.get(usn, 0) if usn in unchanged else self._tick() for usn in students}
+            self._apply_locked(students, summaries, unchanged, versions)
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def _apply_locked(self, students, summaries, unchanged, versions, matrix=None):
+        # Swaps in a new student set; ids (and index entries) of `unchanged` students are kept
+        student_ids = {}
+        added_ids, added_rows = [], []
+        for usn, rows in students.items():
+            if usn in unchanged:
+                student_ids[usn] = self._student_ids[usn]
+            else:
+                student_ids[usn] = self._new_ids(len(rows))
+                added_ids.append(student_ids[usn])
+                added_rows.append(rows)
+        removed_ids = [ids for usn, ids in self._student_ids.items() if usn not in unchanged]
+
+        self._students = students
+        self._student_ids = student_ids
+        self._summaries = summaries
+        self._versions = versions
+        snapshot = self._build(students, student_ids, matrix=matrix)
+        if self.index is not None:
+            if not unchanged:
+                self.index.build(snapshot.ids, snapshot.matrix)
+            else:
+                if removed_ids:
+                    self.index.remove(np.concatenate(removed_ids))
+                if added_ids:
+                    self.index.add(np.concatenate(added_ids), np.concatenate(added_rows, axis=0))
+        self._snapshot = snapshot
+        if added_ids or removed_ids:
+            self.generation += 1
+
+    def adopt(self, matrix, usns, counts, versions=None, clock=0, summaries=None):
+        """Replaces the gallery with an already grouped matrix, without copying it.
+
+        Student i owns the next counts[i] rows of `matrix`. Used for matrices
+        that live in shared memory or a memory-mapped file. With `versions`
+        (as returned by export), students whose version and row count match
+        the current ones keep their ids and index entries, so only the
+        students that changed are added to or removed from the index.
+        `clock` is the exporter's version clock; `summaries` restores
+        consolidation state ({usn: Summary}).
+        """
+        ends = np.cumsum(counts)
+        students = {usn: matrix[end - n:end] for usn, n, end in zip(usns, counts, ends) if n > 0}
+        versions = dict(versions) if versions is not None else {}
+        summaries = summaries or {}
+        with self._lock:
+            unchanged = set()
+            if versions:
+                unchanged = {usn for usn, rows in students.items()
+                             if usn in self._versions and self._versions[usn] == versions.get(usn)
+                             and len(self._students[usn]) == len(rows)}
+            self._clock = max(self._clock, clock, *versions.values()) if versions else max(self._clock, clock)
+            kept = {usn: self._summaries[usn] for usn in unchanged if usn in self._summaries}
+            kept.update({usn: s for usn, s in summaries.items() if usn in students and usn not in unchanged})
+            self._apply_locked(students, kept, unchanged, {usn: versions.get(usn, 0) for usn in students},
+                               matrix=matrix if len(students) == len(usns) else None)
+
+    def export(self):
+        """(matrix, usns, counts, state) of the current gallery; the inverse of adopt.
+
+        state: {"versions": {usn: int}, "clock": int, "summaries": {usn: Summary}},
+        the keyword arguments adopt takes.
+        """
+        with self._lock:
+            snap = self._snapshot
+            state = {
+                "versions": {usn: self._versions.get(usn, 0) for usn in snap.usns},
+                "clock": self._clock,
+                "summaries": {usn: s for usn, s in self._summaries.items() if s is not None},
+            }
+        return snap.matrix, list(snap.usns), snap.counts.tolist(), state
+
+    def add(self, usn, embeddings):
+        """Appends embeddings to a student (creating it if needed)."""
+        self.add_many({usn: embeddings})
+
+    def add_many(self, embeddings_by_usn):
+        """Appends embeddings to several students with a single snapshot rebuild."""
+        new = {usn: self._as_matrix(embs) for usn, embs in embeddings_by_usn.items() if len(embs) > 0}
+        if not new:
+            return
+        with self._lock:
+            students = dict(self._students)
+            student_ids = dict(self._student_ids)
+            summaries = dict(self._summaries)
+            versions = dict(self._versions)
+            added_ids, added_rows, removed_ids = [], [], []
+            for usn, new_embs in new.items():
+                versions[usn] = self._tick()
+                if self.consolidator is not None:
+                    # The student's rows are rebuilt, so all of them get new ids
+                    rows, summaries[usn] = self.consolidator.extend(students.get(usn), summaries.get(usn), new_embs)
+                    rows = self._as_matrix(rows)
+                    if usn in student_ids:
+                        removed_ids.append(student_ids[usn])
+                    ids = self._new_ids(len(rows))
+                    students[usn] = rows
+                    student_ids[usn] = ids
+                else:
+                    rows = new_embs
+                    ids = self._new_ids(len(rows))
+                    if usn in students:
+                        students[usn] = np.concatenate([students[usn], rows], axis=0)
+                        student_ids[usn] = np.concatenate([student_ids[usn], ids])
+                    else:
+                        students[usn] = rows
+                        student_ids[usn] = ids
+                added_ids.append(ids)
+                added_rows.append(rows)
+            self._students = students
+            self._student_ids = student_ids
+            self._summaries = summaries
+            self._versions = versions
+            snapshot = self._build(students, student_ids)
+            if self.index is not None:
+                if removed_ids:
+                    self.index.remove(np.concatenate(removed_ids))
+                self.index.add(np.concatenate(added_ids), np.concatenate(added_rows, axis=0))
+            self._snapshot = snapshot
+            self.generation += 1
+
+    def remove(self, usn):
+        """Drops a student. Returns False if it was not enrolled."""
+        with self._lock:
+            if usn not in self._students:
+                return False
+            students = dict(self._students)
+            student_ids = dict(self._student_ids)
+            del students[usn]
+            removed_ids = student_ids.pop(usn)
+            self._students = students
+            self._student_ids = student_ids
+            self._summaries = {u: s for u, s in self._summaries.items() if u != usn}
+            self._versions = {u: v for u, v in self._versions.items() if u != usn}
+            self._snapshot = self._build(students, student_ids)
+            if self.index is not None:
+                self.index.remove(removed_ids)
+            self.generation += 1
+            return True
+
+    def __contains__(self, usn):
+        return usn in self._students
+
+    def get(self, usn):
+        return self._students.get(usn)
+
+    @property
+    def num_students(self):
+        return len(self._snapshot.usns)
+
+    @property
+    def num_embeddings(self):
+        return self._snapshot.matrix.shape[0]
+
+    def _pool(self, scores, starts, counts, pooling):
+        if pooling == "max":
+            return np.maximum.reduceat(scores, starts, axis=-1)
+        elif pooling == "mean":
+            return np.add.reduceat(scores, starts, axis=-1) / counts
+        raise ValueError(f"Unknown pooling '{pooling}'")
+
+    def match(self, queries, k=5, pooling="max"):
+        """Scores all query embeddings against the gallery.
+
+        queries: (Q, dim) normalized embeddings.
+        pooling: "max" or "mean" over each student's embeddings.
+        Returns: one list per query of up to k (score, usn) tuples, best first.
+        """
+        snap = self._snapshot
+        queries = self._as_matrix(queries)
+        if len(queries) == 0:
+            return []
+        if len(snap.usns) == 0:
+            return [[] for _ in range(len(queries))]
+
+        if self.index is not None:
+            return self._match_candidates(snap, queries, k, pooling)
+
+        scores = queries @ snap.matrix.T  # (Q, M), vectors are normalized
+        pooled = self._pool(scores, snap.starts, snap.counts, pooling)
+
+        # Partial selection of the top-k students, then sort just those
+        k = min(k, pooled.shape[1])
+        top = np.argpartition(-pooled, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(pooled, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        usns = snap.usns
+        return [
+            [(float(s), usns[i]) for s, i in zip(row_scores, row_idx)]
+            for row_scores, row_idx in zip(top_scores, top)
+        ]
+
+    def _match_candidates(self, snap, queries, k, pooling):
+        # Candidate rows from the index -> their students -> exact pooled scores
+        _, cand_ids = self.index.search(queries, k * self.candidate_factor)
+
+        results = []
+        for query, ids in zip(queries, cand_ids):
+            students = {snap.id_to_student[i] for i in ids.tolist() if i in snap.id_to_student}
+            if not students:
+                results.append([])
+                continue
+            students = np.fromiter(students, dtype=np.int64)
+            starts, counts = snap.starts[students], snap.counts[students]
+            rows = np.concatenate([np.arange(s, s + c) for s, c in zip(starts, counts)])
+            local_starts = np.zeros(len(students), dtype=np.int64)
+            local_starts[1:] = np.cumsum(counts)[:-1]
+
+            pooled = self._pool(snap.matrix[rows] @ query, local_starts, counts, pooling)
+            order = np.argsort(-pooled)[:k]
+            results.append([(float(pooled[i]), snap.usns[students[i]]) for i in order])
+        return results
@@ -0,0 +1,72 @@
+import base64
+import struct
+
+import cv2
+import numpy as np
+
+# libjpeg can decode straight to 1/2, 1/4 or 1/8 size (DCT scaling), which is
+# much cheaper than a full decode followed by a resize
+REDUCED_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+# Start-of-frame markers that carry the image size (excludes DHT/JPG/DAC)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(buf):
+    """Returns (width, height) from a JPEG header without decoding, or None."""
+    if len(buf) < 4 or buf[0] != 0xFF or buf[1] != 0xD8:
+        return None
+    pos = 2
+    n = len(buf)
+    while pos + 4 <= n:
+        if buf[pos] != 0xFF:
+            return None
+        marker = buf[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        length = struct.unpack(">H", buf[pos + 2:pos + 4])[0]
+        if marker in _SOF_MARKERS:
+            if pos + 9 > n:
+                return None
+            height, width = struct.unpack(">HH", buf[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+
+def decode_image(buf, target_size=None):
+    """Decodes image bytes, optionally at reduced resolution.
+
+    With target_size set, JPEGs whose long side is at least 2x the target are
+    decoded at the largest 1/2, 1/4 or 1/8 reduction that keeps the long side
+    >= target_size (the detector input). Other formats decode at full size.
+
+    Returns (BGR image or None, factor), where original = decoded * factor.
+    """
+    data = np.frombuffer(buf, np.uint8)
+    if target_size:
+        size = jpeg_size(buf)
+        if size is not None:
+            long_side = max(size)
+            for factor, flag in REDUCED_FLAGS:
+                if long_side // factor >= target_size:
+                    img = cv2.imdecode(data, flag)
+                    if img is not None:
+                        return img, float(factor)
+                    break
+    return cv2.imdecode(data, cv2.IMREAD_COLOR), 1.0
+
+
+def decode_data_url(image_data):
+    """Base64 payload of a data URL (or bare base64) -> bytes."""
+    if "," in image_data:
+        image_data = image_data.split(",")[1]
+    return base64.b64decode(image_data)
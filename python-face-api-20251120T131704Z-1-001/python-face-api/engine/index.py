@@ -0,0 +1,230 @@
+import threading
+
+import numpy as np
+
+# Nearest-neighbour indexes over normalized embeddings (inner product = cosine).
+#
+# Every index stores (id, vector) pairs and implements:
+#   build(ids, vectors)   replace the contents
+#   add(ids, vectors)     incremental insert
+#   remove(ids)           incremental delete
+#   search(queries, k)    -> (scores (Q, k), ids (Q, k)), padded with -inf / -1
+
+
+def _top_k(scores, ids, k):
+    """Best k (score, id) pairs of a 1-D candidate set, best first."""
+    if len(scores) > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+        scores, ids = scores[part], ids[part]
+    order = np.argsort(-scores)
+    return scores[order], ids[order]
+
+
+def _pad(results, k):
+    out_scores = np.full((len(results), k), -np.inf, dtype=np.float32)
+    out_ids = np.full((len(results), k), -1, dtype=np.int64)
+    for q, (scores, ids) in enumerate(results):
+        out_scores[q, :len(scores)] = scores
+        out_ids[q, :len(ids)] = ids
+    return out_scores, out_ids
+
+
+class BruteForceIndex:
+    """Exact search: one matmul against every stored vector. Reference implementation."""
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def build(self, ids, vectors):
+        with self._lock:
+            self._ids = np.asarray(ids, dtype=np.int64).copy()
+            self._vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+
+    def add(self, ids, vectors):
+        with self._lock:
+            self._ids = np.concatenate([self._ids, np.asarray(ids, dtype=np.int64)])
+            self._vectors = np.concatenate([self._vectors, np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)])
+
+    def remove(self, ids):
+        with self._lock:
+            keep = ~np.isin(self._ids, np.asarray(ids, dtype=np.int64))
+            self._ids = self._ids[keep]
+            self._vectors = self._vectors[keep]
+
+    def search(self, queries, k):
+        vectors, ids = self._vectors, self._ids
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        if len(ids) == 0:
+            return _pad([(np.zeros(0), np.zeros(0))] * len(queries), k)
+        scores = queries @ vectors.T
+        return _pad([_top_k(row, ids, k) for row in scores], k)
+
+
+class IVFIndex:
+    """Inverted-file ANN index in pure NumPy.
+
+    Vectors are partitioned into `nlist` cells by spherical k-means; a query only
+    scans the `nprobe` cells whose centroids are closest. Adds go to the nearest
+    existing cell and removes drop ids from their cell, so enrollment never
+    needs a rebuild. The centroids are retrained once the index has grown by
+    `retrain_growth` since the last training.
+
+    Below `min_train_size` vectors the index keeps a single cell (exact search).
+    """
+
+    def __init__(self, dim=512, nlist=None, nprobe=8, min_train_size=2048,
+                 kmeans_iters=10, retrain_growth=4.0, seed=0):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.kmeans_iters = kmeans_iters
+        self.retrain_growth = retrain_growth
+        self.seed = seed
+
+        self._lock = threading.Lock()
+        self._centroids = np.zeros((1, dim), dtype=np.float32)
+        # Each cell is an immutable (vectors, ids) pair replaced on write, so
+        # searches never observe a cell in the middle of an update
+        self._cells = [self._empty_cell()]
+        self._cell_of = {}  # id -> cell number
+        self._trained_size = 0
+
+    def _empty_cell(self):
+        return (np.zeros((0, self.dim), dtype=np.float32), np.zeros(0, dtype=np.int64))
+
+    def __len__(self):
+        return len(self._cell_of)
+
+    def _kmeans(self, vectors, nlist):
+        rng = np.random.default_rng(self.seed)
+        # Train on a sample; ~64 points per cell is plenty for coarse centroids
+        if len(vectors) > 64 * nlist:
+            vectors = vectors[rng.choice(len(vectors), 64 * nlist, replace=False)]
+        centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iters):
+            assign = np.argmax(vectors @ centroids.T, axis=1)
+            order = np.argsort(assign, kind="stable")
+            counts = np.bincount(assign, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            nonempty = counts > 0
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums[nonempty] = np.add.reduceat(vectors[order], starts[nonempty], axis=0)
+            if not np.all(nonempty):
+                # Re-seed empty cells with random vectors
+                sums[~nonempty] = vectors[rng.choice(len(vectors), int((~nonempty).sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+        return centroids.astype(np.float32)
+
+    def _assign(self, vectors):
+        return np.argmax(vectors @ self._centroids.T, axis=1)
+
+    def _build_locked(self, ids, vectors):
+        n = len(ids)
+        if n >= self.min_train_size:
+            nlist = self.nlist or max(1, int(np.sqrt(n)))
+            self._centroids = self._kmeans(vectors, min(nlist, n))
+        else:
+            self._centroids = np.zeros((1, self.dim), dtype=np.float32)
+        self._trained_size = n
+
+        assign = self._assign(vectors) if n else np.zeros(0, dtype=np.int64)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(len(self._centroids) + 1))
+        cells = []
+        for c in range(len(self._centroids)):
+            sel = order[bounds[c]:bounds[c + 1]]
+            cells.append((np.ascontiguousarray(vectors[sel]), ids[sel].copy()))
+        self._cells = cells
+        self._cell_of = dict(zip(ids.tolist(), assign.tolist()))
+
+    def build(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            self._build_locked(ids, vectors)
+
+    def _all_locked(self):
+        vectors = np.concatenate([cell[0] for cell in self._cells])
+        ids = np.concatenate([cell[1] for cell in self._cells])
+        return ids, vectors
+
+    def add(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            total = len(self._cell_of) + len(ids)
+            untrained = self._trained_size < self.min_train_size and total >= self.min_train_size
+            grown = self._trained_size and total >= self._trained_size * self.retrain_growth
+            if untrained or grown:
+                all_ids, all_vectors = self._all_locked()
+                self._build_locked(np.concatenate([all_ids, ids]), np.concatenate([all_vectors, vectors]))
+                return
+
+            assign = self._assign(vectors)
+            for c in np.unique(assign):
+                sel = assign == c
+                cell_vectors, cell_ids = self._cells[c]
+                self._cells[c] = (np.concatenate([cell_vectors, vectors[sel]]),
+                                  np.concatenate([cell_ids, ids[sel]]))
+            self._cell_of.update(zip(ids.tolist(), assign.tolist()))
+
+    def remove(self, ids):
+        with self._lock:
+            by_cell = {}
+            for i in np.asarray(ids, dtype=np.int64).tolist():
+                c = self._cell_of.pop(i, None)
+                if c is not None:
+                    by_cell.setdefault(c, []).append(i)
+            for c, cell_removed in by_cell.items():
+                cell_vectors, cell_ids = self._cells[c]
+                keep = ~np.isin(cell_ids, cell_removed)
+                self._cells[c] = (cell_vectors[keep], cell_ids[keep])
+
+    def search(self, queries, k, nprobe=None):
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        centroids, cells = self._centroids, self._cells
+        nprobe = min(nprobe or self.nprobe, len(centroids))
+
+        coarse = queries @ centroids.T
+        if nprobe < len(centroids):
+            probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(len(centroids)), (len(queries), len(centroids)))
+
+        # Score each probed cell once against all the queries that probe it
+        cand_scores = [[] for _ in range(len(queries))]
+        cand_ids = [[] for _ in range(len(queries))]
+        for c in np.unique(probes):
+            cell_vectors, cell_ids = cells[c]
+            if len(cell_ids) == 0:
+                continue
+            qs = np.flatnonzero(np.any(probes == c, axis=1))
+            scores = queries[qs] @ cell_vectors.T
+            for row, q in zip(scores, qs):
+                cand_scores[q].append(row)
+                cand_ids[q].append(cell_ids)
+
+        results = []
+        for scores, ids in zip(cand_scores, cand_ids):
+            if not scores:
+                results.append((np.zeros(0), np.zeros(0)))
+            else:
+                results.append(_top_k(np.concatenate(scores), np.concatenate(ids), k))
+        return _pad(results, k)
+
+
+def make_index(kind, dim=512, **kwargs):
+    """Builds an index by name: "brute" or "ivf"."""
+    if kind == "brute":
+        return BruteForceIndex(dim)
+    if kind == "ivf":
+        return IVFIndex(dim, **kwargs)
+    raise ValueError(f"Unknown index '{kind}'")
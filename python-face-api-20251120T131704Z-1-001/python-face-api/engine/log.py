@@ -0,0 +1,114 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+# Logging for the API process. Request threads only put records on a queue;
+# one QueueListener thread formats them and writes the file and console.
+# A forked child (gunicorn --preload workers) has no copy of that thread, so
+# it starts its own listener on the same handlers right after the fork.
+#
+# Subsystems are plain logger names:
+#   face_api        API lifecycle, enrollment, errors, per-request summaries
+#   face_api.faces  one record per recognized face (rate limited)
+#   engine          engine.* modules (store, sessions, batcher, ...)
+
+FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket: passes at most `rate` records per second (bursts up to `burst`).
+
+    Dropped records are counted and the count is appended to the next record
+    that passes, so the log still says how much was left out.
+    """
+
+    def __init__(self, rate, burst=None):
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens < 1.0:
+                self._suppressed += 1
+                return False
+            self._tokens -= 1.0
+            suppressed, self._suppressed = self._suppressed, 0
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar records suppressed]"
+        return True
+
+
+def setup_logging(log_file=None, levels=None, console=True, max_bytes=10 * 1024 * 1024, backup_count=3):
+    """Routes all logging through a background QueueListener.
+
+    levels: {logger name: level}, e.g. {"": "WARNING", "face_api": "INFO"};
+    "" is the root logger. The file rotates at `max_bytes`.
+    Safe to call more than once; later calls only update the levels.
+    """
+    global _listener
+    with _setup_lock:
+        for name, level in (levels or {}).items():
+            logging.getLogger(name).setLevel(level)
+        if _listener is not None:
+            return _listener
+
+        formatter = logging.Formatter(FORMAT)
+        handlers = []
+        if log_file:
+            file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+        if console:
+            console_handler = logging.StreamHandler() # stderr, as before
+            console_handler.setFormatter(formatter)
+            handlers.append(console_handler)
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        # Flush what is still queued on interpreter exit
+        atexit.register(_stop)
+        if hasattr(os, "register_at_fork"): # Not on Windows, which never forks
+            os.register_at_fork(after_in_child=_restart_after_fork)
+        return _listener
+
+
+def _stop():
+    if _listener is not None:
+        _listener.stop()
+
+
+def _restart_after_fork():
+    # Only the forking thread survives a fork: replace the parent's listener,
+    # whose thread is gone, with one running in this process. A fresh queue
+    # keeps records the parent had not written yet from being written twice.
+    global _listener, _setup_lock
+    _setup_lock = threading.Lock()
+    if _listener is None:
+        return
+    log_queue = queue.SimpleQueue()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.handlers.QueueHandler) and handler.queue is _listener.queue:
+            handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
@@ -0,0 +1,248 @@
+import bisect
+import math
+import threading
+import time
+
+# Minimal Prometheus-style metrics: counters, gauges and histograms with labels,
+# rendered in the text exposition format by REGISTRY.render(). Recording is a
+# dict lookup, a bisect and a few additions under a per-series lock, so it is
+# cheap enough to leave on for every frame.
+
+# Seconds; fine-grained below 10 ms where most stages live
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05,
+                   0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 40, 80, 160)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[n] for n in self.labelnames)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+    def get(self):
+        return self.value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1.0):
+        self._default.inc(amount)
+
+    def get(self, *values):
+        """Current value of the series with label `values` (the unlabelled one by default); 0 if never recorded."""
+        child = self._children.get(values)
+        return child.get() if child is not None else 0.0
+
+    def render(self):
+        lines = self._header()
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}")
+        return lines
+
+
+class _GaugeChild:
+    __slots__ = ("value", "fn")
+
+    def __init__(self):
+        self.value = 0.0
+        self.fn = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, fn):
+        """Reads the value from fn() at scrape time instead."""
+        self.fn = fn
+
+    def get(self):
+        return self.fn() if self.fn is not None else self.value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def set_function(self, fn):
+        self._default.set_function(fn)
+
+    def render(self):
+        lines = self._header()
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # Last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def render(self):
+        lines = self._header()
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- Metrics recorded by the engine and the API ---
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "face_stage_seconds", "Time spent per pipeline stage.", ["stage"]))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "face_request_seconds", "End-to-end handler time per endpoint.", ["endpoint"]))
+ERRORS = REGISTRY.register(Counter(
+    "face_errors_total", "Requests that failed, per endpoint.", ["endpoint"]))
+FACES_PER_FRAME = REGISTRY.register(Histogram(
+    "face_faces_per_frame", "Faces tracked in a recognized frame.", buckets=COUNT_BUCKETS))
+EMBEDDINGS = REGISTRY.register(Counter(
+    "face_embeddings_total", "Faces sent through ArcFace."))
+EMBEDDINGS_SKIPPED = REGISTRY.register(Counter(
+    "face_embeddings_skipped_total", "Tracked faces that reused their identity instead of being embedded."))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    "face_batch_frames", "Frames recognized together by the micro-batcher.", buckets=COUNT_BUCKETS))
+GALLERY_STUDENTS = REGISTRY.register(Gauge(
+    "face_gallery_students", "Enrolled students in the gallery."))
+GALLERY_EMBEDDINGS = REGISTRY.register(Gauge(
+    "face_gallery_embeddings", "Embeddings in the gallery."))
+STREAMS = REGISTRY.register(Gauge(
+    "face_streams", "Camera streams with live tracker state."))
+FRAMES = REGISTRY.register(Counter(
+    "face_frames_total", "Frames received by /recognize, by whether they were recognized or answered from the frame gate.",
+    ["result"]))
+GATE_SAVED_SECONDS = REGISTRY.register(Counter(
+    "face_gate_saved_seconds_total", "Estimated recognition time saved by the frame gate."))
+DETECTIONS = REGISTRY.register(Counter(
+    "face_detections_total", "Full-frame detections, by detector input size (long side in pixels).", ["input_size"]))
+DETECT_SAVED_SECONDS = REGISTRY.register(Counter(
+    "face_detect_saved_seconds_total", "Estimated detection time saved by adaptive detector input sizes."))
+
+
+def stage(name):
+    """Context manager timing one pipeline stage: `with metrics.stage("scrfd_inference"):`."""
+    return STAGE_SECONDS.labels(name).time()
@@ -0,0 +1,208 @@
+import cv2
+import numpy as np
+
+from engine import metrics
+
+# RetinaFace/SCRFD Anchor Config for det_10g
+FEAT_STRIDES = [8, 16, 32]
+ANCHOR_SIZES = {
+    8:  [16, 32],
+    16: [64, 128],
+    32: [256, 512]
+}
+
+# Output mapping (based on debug_shapes_out.txt)
+# Stride 8:  0 (score), 3 (bbox), 6 (kps)
+# Stride 16: 1 (score), 4 (bbox), 7 (kps)
+# Stride 32: 2 (score), 5 (bbox), 8 (kps)
+OUTPUT_MAP = {
+    8:  {'score': 0, 'bbox': 3, 'kps': 6},
+    16: {'score': 1, 'bbox': 4, 'kps': 7},
+    32: {'score': 2, 'bbox': 5, 'kps': 8}
+}
+
+
+def _greedy_suppress(boxes, order, suppress):
+    """Greedy suppression in `order`; IoU/IoS are computed only against each kept box.
+
+    suppress(inter, kept_area, other_areas) -> bool mask of boxes to drop.
+    O(N) memory and O(N * kept) work. Used where cv2.dnn.NMSBoxes cannot
+    express the rule (merge_tiles' IoS test and clipped-last order).
+    """
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = boxes[:, 2]
+    y2 = boxes[:, 3]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        xx1 = np.maximum(x1[i], x1[rest])
+        yy1 = np.maximum(y1[i], y1[rest])
+        xx2 = np.minimum(x2[i], x2[rest])
+        yy2 = np.minimum(y2[i], y2[rest])
+
+        w = np.maximum(0.0, xx2 - xx1 + 1)
+        h = np.maximum(0.0, yy2 - yy1 + 1)
+        order = rest[~suppress(w * h, areas[i], areas[rest])]
+    return keep
+
+
+def nms(dets, thresh):
+    """Greedy NMS over [x1, y1, x2, y2, score, ...] rows (keep while IoU <= thresh).
+
+    Runs in cv2.dnn.NMSBoxes. Boxes go in as (x1, y1, x2 - x1 + 1, y2 - y1 + 1),
+    so its IoU keeps the +1 pixel area convention of the original loop. Rows
+    with score <= 0 are dropped and equal scores keep row order.
+    Returns indices of kept rows, highest score first.
+    """
+    if len(dets) == 0:
+        return []
+    rects = np.concatenate([dets[:, :2], dets[:, 2:4] - dets[:, :2] + 1], axis=1)
+    return np.asarray(cv2.dnn.NMSBoxes(rects, dets[:, 4], 0.0, thresh), dtype=np.intp).ravel().tolist()
+
+
+def merge_tiles(dets, clipped, thresh, ios_thresh=0.6):
+    """Cross-tile NMS for detections gathered from overlapping tiles.
+
+    A face cut by a tile border is also seen whole by the neighbouring tile,
+    and its partial box may overlap the whole one by little IoU while lying
+    mostly inside it. So a box is suppressed by a kept one when their IoU
+    exceeds `thresh` or their intersection covers more than `ios_thresh` of
+    the smaller box. Boxes flagged `clipped` (touching an inner tile border)
+    rank after all others, so they only survive where no whole view exists.
+    Returns indices of kept rows.
+    """
+    if len(dets) == 0:
+        return []
+
+    def suppress(inter, area, others):
+        return (inter / (area + others - inter) > thresh) | (inter / np.minimum(area, others) > ios_thresh)
+
+    return _greedy_suppress(dets, np.lexsort((-dets[:, 4], clipped)), suppress)
+
+
+class SCRFDPostprocessor:
+    """Decodes raw SCRFD outputs into [x1, y1, x2, y2, score, kps(10)] rows.
+
+    Anchor centers depend only on the padded input shape, so they are built once
+    per (height, width, stride) and reused. Boxes and keypoints of all strides
+    are decoded together, and at most `pre_nms_topk` candidates reach NMS.
+    """
+
+    def __init__(self, nms_threshold=0.4, pre_nms_topk=1000):
+        self.nms_threshold = nms_threshold
+        self.pre_nms_topk = pre_nms_topk
+        self._anchor_cache = {}
+
+    def anchors(self, final_h, final_w, stride):
+        """Returns (cx, cy, anchor_size) arrays, one entry per anchor."""
+        key = (final_h, final_w, stride)
+        cached = self._anchor_cache.get(key)
+        if cached is not None:
+            return cached
+
+        anchors_size = ANCHOR_SIZES[stride]
+        num_anchors = len(anchors_size)
+        fh = final_h // stride
+        fw = final_w // stride
+
+        grid_y, grid_x = np.meshgrid(np.arange(fh), np.arange(fw), indexing='ij')
+        cx = np.repeat(grid_x.flatten(), num_anchors) * stride + stride / 2
+        cy = np.repeat(grid_y.flatten(), num_anchors) * stride + stride / 2
+        sizes = np.tile(np.asarray(anchors_size, dtype=np.float64), fh * fw)
+
+        cached = (cx, cy, sizes)
+        self._anchor_cache[key] = cached
+        return cached
+
+    def decode(self, outs, final_h, final_w, scale, threshold):
+        """Returns all candidates above threshold (before NMS), in stride order."""
+        scores_all = []
+        bbox_all = []
+        kps_all = []
+        cx_all = []
+        cy_all = []
+        size_all = []
+        stride_all = []
+
+        for stride in FEAT_STRIDES:
+            # Handle (N, C) or (1, N, C)
+            score_blob = outs[OUTPUT_MAP[stride]['score']]
+            bbox_blob = outs[OUTPUT_MAP[stride]['bbox']]
+            kps_blob = outs[OUTPUT_MAP[stride]['kps']]
+
+            if len(score_blob.shape) == 3: score_blob = score_blob[0]
+            if len(bbox_blob.shape) == 3: bbox_blob = bbox_blob[0]
+            if len(kps_blob.shape) == 3: kps_blob = kps_blob[0]
+
+            cx, cy, sizes = self.anchors(final_h, final_w, stride)
+
+            # Sanity check
+            if score_blob.shape[0] != len(cx):
+                continue
+
+            idx = np.flatnonzero(score_blob[:, 0] > threshold)
+            if len(idx) == 0:
+                continue
+
+            scores_all.append(score_blob[idx, 0])
+            bbox_all.append(bbox_blob[idx])
+            kps_all.append(kps_blob[idx])
+            cx_all.append(cx[idx])
+            cy_all.append(cy[idx])
+            size_all.append(sizes[idx])
+            stride_all.append(np.full(len(idx), stride, dtype=np.float32))
+
+        if not scores_all:
+            return np.zeros((0, 15), dtype=np.float64)
+
+        scores = np.concatenate(scores_all)
+        bbox = np.concatenate(bbox_all)
+        kps = np.concatenate(kps_all)
+        cx = np.concatenate(cx_all)
+        cy = np.concatenate(cy_all)
+        anchor = np.concatenate(size_all)
+        strides = np.concatenate(stride_all)
+
+        # Pre-NMS cap: keep the top-K scores, preserving stride/anchor order
+        if self.pre_nms_topk and len(scores) > self.pre_nms_topk:
+            top = np.argpartition(-scores, self.pre_nms_topk - 1)[:self.pre_nms_topk]
+            top.sort()
+            scores, bbox, kps = scores[top], bbox[top], kps[top]
+            cx, cy, anchor, strides = cx[top], cy[top], anchor[top], strides[top]
+
+        dets = np.empty((len(scores), 15), dtype=np.float64)
+
+        # Decode bbox
+        pred_cx = bbox[:, 0] * 0.1 * anchor + cx
+        pred_cy = bbox[:, 1] * 0.1 * anchor + cy
+        pred_w = np.exp(bbox[:, 2] * 0.2) * anchor
+        pred_h = np.exp(bbox[:, 3] * 0.2) * anchor
+        dets[:, 0] = pred_cx - pred_w / 2
+        dets[:, 1] = pred_cy - pred_h / 2
+        dets[:, 2] = pred_cx + pred_w / 2
+        dets[:, 3] = pred_cy + pred_h / 2
+        dets[:, 4] = scores
+
+        # Decode KPS (5 points: x1,y1, x2,y2 ...), all points at once
+        kps = kps * strides[:, None]
+        kps[:, 0::2] = (kps[:, 0::2] + cx[:, None]).astype(np.float32)
+        kps[:, 1::2] = (kps[:, 1::2] + cy[:, None]).astype(np.float32)
+        dets[:, 5:15] = kps
+
+        # Rescale
+        dets[:, :15] /= scale
+        return dets
+
+    def __call__(self, outs, final_h, final_w, scale, threshold):
+        with metrics.stage("detect_decode"):
+            dets = self.decode(outs, final_h, final_w, scale, threshold)
+        if len(dets) == 0:
+            return []
+        with metrics.stage("detect_nms"):
+            keep = nms(dets, self.nms_threshold)
+        return dets[keep]
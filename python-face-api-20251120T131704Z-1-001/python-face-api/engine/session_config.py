@@ -0,0 +1,116 @@
+import hashlib
+import json
+import logging
+import os
+
+import onnxruntime
+
+log = logging.getLogger(__name__)
+
+# Per-model ONNX Runtime session settings.
+#
+# Sources, later ones win:
+#   1. DEFAULTS below
+#   2. JSON config file (FACE_ENGINE_CONFIG, default engine_config.json), e.g.
+#        {"det": {"intra_op_num_threads": 4}, "rec": {"intra_op_num_threads": 2}}
+#   3. Environment variables FACE_DET_<KEY> / FACE_REC_<KEY>, e.g.
+#        FACE_REC_INTRA_OP_NUM_THREADS=2 FACE_DET_EXECUTION_MODE=parallel
+
+DEFAULTS = {
+    "intra_op_num_threads": 0,        # 0 = let ORT decide
+    "inter_op_num_threads": 0,
+    "execution_mode": "sequential",   # sequential | parallel
+    "graph_optimization_level": "all",  # disable | basic | extended | all
+    "enable_cpu_mem_arena": True,
+    "enable_mem_pattern": True,
+    "cache_optimized_model": True,    # save the optimized graph and reuse it on startup
+    "cache_dir": "ort_cache",         # optimized graphs at level "all" are specific to this machine
+}
+
+ENV_PREFIXES = {"det": "FACE_DET_", "rec": "FACE_REC_"}
+
+EXECUTION_MODES = {
+    "sequential": onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+OPTIMIZATION_LEVELS = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def _parse_value(raw, default):
+    if isinstance(default, bool):
+        return str(raw).strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(raw)
+    return str(raw)
+
+
+def load_session_config(model_kind, config_file=None):
+    """Returns the session settings for "det" or "rec"."""
+    config = dict(DEFAULTS)
+
+    config_file = config_file or os.environ.get("FACE_ENGINE_CONFIG", "engine_config.json")
+    if os.path.exists(config_file):
+        with open(config_file, "r") as f:
+            file_config = json.load(f)
+        for key, value in file_config.get(model_kind, {}).items():
+            if key not in DEFAULTS:
+                raise ValueError(f"Unknown session option '{key}' in {config_file}")
+            config[key] = value
+
+    prefix = ENV_PREFIXES[model_kind]
+    for key, default in DEFAULTS.items():
+        raw = os.environ.get(prefix + key.upper())
+        if raw is not None:
+            config[key] = _parse_value(raw, default)
+
+    if config["execution_mode"] not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution_mode '{config['execution_mode']}'")
+    if config["graph_optimization_level"] not in OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown graph_optimization_level '{config['graph_optimization_level']}'")
+    return config
+
+
+def _cache_path(model_file, config):
+    # Any change to the source model, the ORT build or the optimization level
+    # produces a new cache file instead of reusing a stale one
+    st = os.stat(model_file)
+    key = f"{os.path.abspath(model_file)}:{st.st_size}:{st.st_mtime_ns}:{onnxruntime.__version__}:{config['graph_optimization_level']}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(model_file))[0]
+    return os.path.join(config["cache_dir"], f"{name}.{config['graph_optimization_level']}.{digest}.onnx")
+
+
+def create_session(model_file, config=None, providers=None):
+    """Builds an InferenceSession from a config returned by load_session_config."""
+    config = config or dict(DEFAULTS)
+    providers = providers or ['CPUExecutionProvider']
+
+    so = onnxruntime.SessionOptions()
+    so.intra_op_num_threads = config["intra_op_num_threads"]
+    so.inter_op_num_threads = config["inter_op_num_threads"]
+    so.execution_mode = EXECUTION_MODES[config["execution_mode"]]
+    so.graph_optimization_level = OPTIMIZATION_LEVELS[config["graph_optimization_level"]]
+    so.enable_cpu_mem_arena = config["enable_cpu_mem_arena"]
+    so.enable_mem_pattern = config["enable_mem_pattern"]
+
+    if config["cache_optimized_model"] and config["graph_optimization_level"] != "disable":
+        cache_path = _cache_path(model_file, config)
+        if os.path.exists(cache_path):
+            # Already optimized: skip graph optimization on this startup
+            so.graph_optimization_level = OPTIMIZATION_LEVELS["disable"]
+            try:
+                return onnxruntime.InferenceSession(cache_path, sess_options=so, providers=providers)
+            except Exception as e:
+                log.warning("Ignoring unusable optimized model cache %s: %s", cache_path, e)
+                so.graph_optimization_level = OPTIMIZATION_LEVELS[config["graph_optimization_level"]]
+        else:
+            os.makedirs(config["cache_dir"], exist_ok=True)
+            so.optimized_model_filepath = cache_path
+
+    return onnxruntime.InferenceSession(model_file, sess_options=so, providers=providers)
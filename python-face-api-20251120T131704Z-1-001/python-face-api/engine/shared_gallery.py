@@ -0,0 +1,161 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from engine.consolidation import Summary
+
+try:
+    import fcntl
+except ImportError: # Windows: no pre-fork workers, so no shared gallery
+    fcntl = None
+
+_GENERATION = struct.Struct("<Q")
+
+
+class SharedGallery:
+    """Keeps the Gallery of several pre-fork worker processes in sync.
+
+    Layout of `directory`:
+      generation            8-byte counter, memory-mapped by every worker
+      gallery-<gen>.npy     float32 matrix of that generation, memory-mapped on load
+      gallery-<gen>.json    {"usns": [...], "counts": [...], "versions": {...}, "clock": n,
+                             "summaries": {usn: count}} for the matrix rows
+      gallery-<gen>.means.npy  consolidation means, one row per "summaries" entry in order
+      lock                  flock()ed around every change
+
+    A worker calls refresh() before matching: it reads the counter from the
+    shared mapping (no syscall) and only reloads when another worker has
+    published a newer generation. The matrix pages are shared through the
+    page cache, so N workers do not hold N copies. Each student carries a
+    version, so adopting a generation only re-indexes the students whose
+    version changed (see Gallery.adopt).
+
+    Changes go through update(fn): under the file lock the worker catches up
+    with the latest generation, applies fn to its gallery, writes the new
+    snapshot and bumps the counter before returning. A delete acknowledged by
+    any worker is therefore seen by every worker at its next refresh().
+    Unix only (fcntl).
+    """
+
+    keep_generations = 3 # Older snapshot files are deleted; lagging workers re-read the counter
+
+    def __init__(self, gallery, directory):
+        if fcntl is None:
+            raise RuntimeError("SharedGallery needs fcntl (Unix)")
+        self.gallery = gallery
+        self.directory = directory
+        self.generation = None # Generation this process has adopted
+        self._refresh_lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, "lock")
+        with self.locked():
+            fd = os.open(os.path.join(directory, "generation"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < _GENERATION.size:
+                    os.ftruncate(fd, _GENERATION.size)
+                self._counter = mmap.mmap(fd, _GENERATION.size)
+            finally:
+                os.close(fd)
+
+    def _paths(self, generation):
+        base = os.path.join(self.directory, f"gallery-{generation}")
+        return base + ".npy", base + ".json", base + ".means.npy"
+
+    @property
+    def published_generation(self):
+        return _GENERATION.unpack_from(self._counter, 0)[0]
+
+    @contextmanager
+    def locked(self):
+        """Exclusive lock across processes (and threads, via separate open files)."""
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """Adopts the latest published snapshot. Returns True if the gallery changed."""
+        if self.published_generation == self.generation:
+            return False
+        with self._refresh_lock:
+            for _ in range(3):
+                generation = self.published_generation
+                if generation == self.generation or generation == 0:
+                    return False
+                try:
+                    self._adopt(generation)
+                    return True
+                except OSError:
+                    # Superseded and cleaned up while we were loading; try the newer one
+                    continue
+            raise RuntimeError("Shared gallery keeps changing; could not load a snapshot")
+
+    def _adopt(self, generation):
+        matrix_path, meta_path, means_path = self._paths(generation)
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        matrix = np.load(matrix_path, mmap_mode="r")
+        summaries = {}
+        if meta.get("summaries"):
+            means = np.load(means_path)
+            summaries = {usn: Summary(count, means[i]) for i, (usn, count) in enumerate(meta["summaries"].items())}
+        self.gallery.adopt(matrix, meta["usns"], meta["counts"], versions=meta.get("versions"),
+                           clock=meta.get("clock", 0), summaries=summaries)
+        self.generation = generation
+
+    def publish(self):
+        """Writes the local gallery as a new generation. Call with locked() held."""
+        matrix, usns, counts, state = self.gallery.export()
+        generation = self.published_generation + 1
+        matrix_path, meta_path, means_path = self._paths(generation)
+
+        # Data first, counter last: a worker that sees the new counter finds complete files
+        np.save(matrix_path + ".tmp.npy", np.ascontiguousarray(matrix, dtype=np.float32))
+        os.replace(matrix_path + ".tmp.npy", matrix_path)
+        summaries = state["summaries"]
+        if summaries:
+            np.save(means_path + ".tmp.npy", np.stack([s.mean for s in summaries.values()]).astype(np.float32))
+            os.replace(means_path + ".tmp.npy", means_path)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"usns": usns, "counts": counts, "versions": state["versions"], "clock": state["clock"],
+                       "summaries": {usn: int(s.count) for usn, s in summaries.items()}}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+        _GENERATION.pack_into(self._counter, 0, generation)
+        self._counter.flush()
+
+        # Serve from the shared mapping too, instead of a private copy
+        with self._refresh_lock:
+            self._adopt(generation)
+        self._cleanup(generation)
+        return generation
+
+    def _cleanup(self, generation):
+        for name in os.listdir(self.directory):
+            if not name.startswith("gallery-"):
+                continue
+            try:
+                gen = int(name.split("-", 1)[1].split(".", 1)[0])
+            except ValueError:
+                continue
+            if gen <= generation - self.keep_generations:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def update(self, fn):
+        """Applies fn(gallery) on top of the latest generation and publishes it for all workers."""
+        with self.locked():
+            self.refresh()
+            result = fn(self.gallery)
+            self.publish()
+            return result
@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class StreamState:
+    """Everything the API keeps for one camera stream.
+
+    `lock` serializes frames of this stream only; other streams never wait on it.
+    `gate` is the stream's FrameGate, or None when frame gating is off;
+    `scale` its DetectorScale, or None when the detector input is fixed.
+    """
+
+    def __init__(self, stream_id, tracker, gate=None, scale=None):
+        self.stream_id = stream_id
+        self.tracker = tracker
+        self.gate = gate
+        self.scale = scale
+        self.lock = threading.Lock()
+        self.last_seen = time.monotonic()
+        self.frames = 0
+
+
+class StreamRegistry:
+    """Per-stream state with LRU + idle eviction.
+
+    The registry lock is only held for the dictionary lookup, so concurrent
+    requests for different streams run in parallel.
+    """
+
+    def __init__(self, tracker_factory, max_streams=64, idle_timeout=300.0, gate_factory=None, scale_factory=None):
+        self.tracker_factory = tracker_factory
+        self.gate_factory = gate_factory
+        self.scale_factory = scale_factory
+        self.max_streams = max_streams
+        self.idle_timeout = idle_timeout
+        self._streams = OrderedDict()  # stream_id -> StreamState, least recently used first
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def get(self, stream_id):
+        now = time.monotonic()
+        with self._lock:
+            state = self._streams.get(stream_id)
+            if state is None:
+                gate = self.gate_factory() if self.gate_factory is not None else None
+                scale = self.scale_factory() if self.scale_factory is not None else None
+                state = StreamState(stream_id, self.tracker_factory(), gate, scale)
+                self._streams[stream_id] = state
+            else:
+                self._streams.move_to_end(stream_id)
+            state.last_seen = now
+            self._evict(now)
+        return state
+
+    def _evict(self, now):
+        # Idle streams sit at the front of the LRU order
+        while self._streams:
+            oldest_id, oldest = next(iter(self._streams.items()))
+            idle = now - oldest.last_seen > self.idle_timeout
+            if not idle and len(self._streams) <= self.max_streams:
+                break
+            del self._streams[oldest_id]
+            self.evicted += 1
+
+    def remove(self, stream_id):
+        with self._lock:
+            return self._streams.pop(stream_id, None) is not None
+
+    def __len__(self):
+        return len(self._streams)
+
+    def states(self):
+        with self._lock:
+            return list(self._streams.values())
+
+    def ids(self):
+        with self._lock:
+            return list(self._streams.keys())
@@ -1,13 +1,209 @@
+from collections import Counter, deque
 
 import numpy as np
 
+from engine import metrics
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """IoU of every box in boxes_a (N,4) against every box in boxes_b (M,4) -> (N, M).
+
+    Same +1 pixel convention as FaceTracker.compute_iou.
+    """
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+
+    xx1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    yy1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    xx2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    yy2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.maximum(0.0, xx2 - xx1 + 1) * np.maximum(0.0, yy2 - yy1 + 1)
+
+    area_a = (a[:, 2] - a[:, 0] + 1) * (a[:, 3] - a[:, 1] + 1)
+    area_b = (b[:, 2] - b[:, 0] + 1) * (b[:, 3] - b[:, 1] + 1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter)
+
+
+# Below this many track x detection pairs, a plain Python loop computes the
+# overlaps faster than building the IoU matrix (NumPy's fixed per-call cost dominates)
+SMALL_ASSOCIATION = 64
+
+
+def iou_pairs(boxes_a, boxes_b, threshold):
+    """(iou, a_idx, b_idx) for every pair with IoU > threshold, highest IoU first.
+
+    Ties keep (a_idx, b_idx) order. Uses iou_matrix for large inputs and a
+    Python loop (same +1 pixel convention) for small ones.
+    """
+    if len(boxes_a) * len(boxes_b) > SMALL_ASSOCIATION:
+        iou = iou_matrix(boxes_a, boxes_b)
+        a_idx, b_idx = np.nonzero(iou > threshold)
+        values = iou[a_idx, b_idx]
+        order = np.argsort(-values, kind="stable")
+        return list(zip(values[order].tolist(), a_idx[order].tolist(), b_idx[order].tolist()))
+
+    pairs = []
+    for a_idx, (ax1, ay1, ax2, ay2) in enumerate(boxes_a):
+        area_a = (ax2 - ax1 + 1) * (ay2 - ay1 + 1)
+        for b_idx, (bx1, by1, bx2, by2) in enumerate(boxes_b):
+            w = min(ax2, bx2) - max(ax1, bx1) + 1
+            h = min(ay2, by2) - max(ay1, by1) + 1
+            if w <= 0 or h <= 0:
+                continue
+            inter = w * h
+            iou = inter / (area_a + (bx2 - bx1 + 1) * (by2 - by1 + 1) - inter)
+            if iou > threshold:
+                pairs.append((iou, a_idx, b_idx))
+    pairs.sort(key=lambda p: (-p[0], p[1], p[2]))
+    return pairs
+
+
+def greedy_assignment(pairs):
+    """Matches (track, detection) pairs in the given order (decreasing IoU, see iou_pairs).
+
+    Each track and detection is used at most once. Returns a list of
+    (t_idx, d_idx, iou).
+    """
+    matches = []
+    used_t, used_d = set(), set()
+    for iou, t, d in pairs:
+        if t in used_t or d in used_d:
+            continue
+        used_t.add(t)
+        used_d.add(d)
+        matches.append((t, d, iou))
+    return matches
+
+
+class KalmanBoxFilter:
+    """Constant-velocity Kalman filter on a box (cx, cy, w, h), one step per frame.
+
+    Noise is proportional to the box height, as in DeepSORT, so small and
+    large faces are tracked with the same relative uncertainty. predict_all /
+    update_all step many filters in one batched NumPy pass.
+    """
+
+    std_position = 1.0 / 20
+    std_velocity = 1.0 / 160
+
+    _DIAG = np.arange(8)
+
+    def __init__(self, bbox):
+        z = self._to_xywh(np.asarray([bbox], dtype=np.float64))[0]
+        self.x = np.concatenate([z, np.zeros(4)])
+        h = z[3]
+        std = [2 * self.std_position * h] * 4 + [10 * self.std_velocity * h] * 4
+        self.P = np.diag(np.square(std))
+
+    @staticmethod
+    def _to_xywh(boxes):
+        return np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2,
+                         boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]], axis=1)
+
+    @staticmethod
+    def _to_boxes(x):
+        half = x[:, 2:4] / 2
+        return np.concatenate([x[:, :2] - half, x[:, :2] + half], axis=1)
+
+    def bbox(self):
+        return self._to_boxes(self.x[None])[0].tolist()
+
+    def predict(self):
+        """Advances one frame and returns the predicted [x1, y1, x2, y2]."""
+        return self.predict_all([self])[0]
+
+    def update(self, bbox):
+        """Corrects the state with a measured [x1, y1, x2, y2]."""
+        self.update_all([self], [bbox])
+
+    @classmethod
+    def predict_all(cls, filters):
+        """Advances every filter one frame. Returns their predicted boxes as lists."""
+        if not filters:
+            return []
+        x = np.array([f.x for f in filters])
+        P = np.array([f.P for f in filters])
+        h = x[:, 3:4].copy()
+        q = np.empty_like(x)
+        q[:, :4] = cls.std_position * h
+        q[:, 4:] = cls.std_velocity * h
+        # F = [[I, I], [0, I]]: F x and F P F^T are block additions
+        x[:, :4] += x[:, 4:]
+        P[:, :4] += P[:, 4:]
+        P[:, :, :4] += P[:, :, 4:]
+        P[:, cls._DIAG, cls._DIAG] += q * q
+        for f, fx, fP in zip(filters, x, P):
+            f.x, f.P = fx, fP
+        return cls._to_boxes(x).tolist()
+
+    @classmethod
+    def update_all(cls, filters, bboxes):
+        """Corrects each filter with its measured box."""
+        if not filters:
+            return
+        x = np.array([f.x for f in filters])
+        P = np.array([f.P for f in filters])
+        z = cls._to_xywh(np.asarray(bboxes, dtype=np.float64).reshape(-1, 4))
+        # H selects the first 4 state components, so H P H^T and P H^T are slices
+        S = P[:, :4, :4].copy()
+        S[:, cls._DIAG[:4], cls._DIAG[:4]] += np.square(cls.std_position * x[:, 3:4])
+        K = np.linalg.solve(S, P[:, :4, :]).transpose(0, 2, 1) # P H^T S^-1; S and P are symmetric
+        x += (K @ (z - x[:, :4])[:, :, None])[:, :, 0]
+        P -= K @ P[:, :4, :]
+        for f, fx, fP in zip(filters, x, P):
+            f.x, f.P = fx, fP
+
+
 class FaceTracker:
-    def __init__(self, max_misses=5, iou_threshold=0.3, history_len=7):
-        self.tracks = [] # List of {'id': int, 'bbox': [x1,y1,x2,y2], 'misses': 0, 'history': [], 'final_name': 'Unknown'}
+    """IoU tracker with majority-vote identities and recognition reuse.
+
+    Each track keeps an EMA of its embeddings and of its match score
+    ('confidence'). Callers that want to skip ArcFace for stable tracks use
+    assign() -> needs_embedding() -> observe(); update() does all three for
+    detections that are already recognized.
+
+    A tracked face is re-embedded when it has no identity yet or is Unknown,
+    every `reembed_interval` frames, when its box or landmarks jump between
+    frames, or when its confidence (decayed by `confidence_decay` on every
+    skipped frame) falls below `min_confidence`.
+
+    Every track carries a constant-velocity Kalman filter; association is done
+    against the predicted boxes. With `detect_interval` K > 1 the caller runs
+    the full detector only when should_detect() says so (every K frames) and
+    calls propagate() on the other frames, optionally confirming each track
+    with a local detection via correct() / lose(). New faces are therefore
+    picked up, and vanished ones dropped, within K frames.
+
+    When the gallery changes (see refresh_identities), every track is
+    re-embedded on its next frame and votes for students that are no
+    longer enrolled are dropped.
+    """
+
+    def __init__(self, max_misses=5, iou_threshold=0.3, history_len=7,
+                 reembed_interval=15, reembed_iou=0.5, reembed_kps=0.15,
+                 min_confidence=0.0, confidence_decay=0.98, ema_alpha=0.8,
+                 identity_reset=0.3, detect_interval=1):
+        # List of {'id', 'bbox', 'kps', 'kalman', 'misses', 'history', 'votes', 'final_name',
+        #          'embedding', 'confidence', 'last_embed', 'moved'}
+        self.tracks = []
         self.next_id = 0
         self.max_misses = max_misses
         self.iou_threshold = iou_threshold
         self.history_len = history_len
+        self.reembed_interval = reembed_interval
+        self.reembed_iou = reembed_iou # Matched with lower IoU than this = box jumped
+        self.reembed_kps = reembed_kps # Mean landmark shift, as a fraction of box width
+        self.min_confidence = min_confidence
+        self.confidence_decay = confidence_decay
+        self.ema_alpha = ema_alpha
+        self.identity_reset = identity_reset # New embedding this far from the track's EMA = different person
+        self.detect_interval = detect_interval # Run the full detector every K frames
+
+        self.frame = 0
+        self.last_detection = -detect_interval
+        self.embedded = 0 # Faces sent through ArcFace
+        self.skipped = 0 # Faces that reused their track's identity
+        self.gallery_generation = None # Gallery generation the cached identities were matched against
 
     def compute_iou(self, boxA, boxB):
         xA = max(boxA[0], boxB[0])
@@ -22,82 +218,231 @@ class FaceTracker:
         iou = interArea / float(boxAArea + boxBArea - interArea)
         return iou
 
-    def update(self, detections):
+    @property
+    def skip_rate(self):
+        total = self.embedded + self.skipped
+        return self.skipped / total if total else 0.0
+
+    def _new_track(self, det):
+        track = {
+            'id': self.next_id,
+            'bbox': det['bbox'],
+            'kps': det.get('kps'),
+            'kalman': KalmanBoxFilter(det['bbox']),
+            'misses': 0,
+            'history': deque(maxlen=self.history_len),
+            'votes': Counter(),
+            'final_name': 'Unknown',
+            'embedding': None,
+            'confidence': 0.0,
+            'last_embed': self.frame,
+            'moved': False
+        }
+        self.next_id += 1
+        return track
+
+    def _vote(self, track, name):
+        """Pushes a name into the ring buffer and updates the majority in O(1).
+
+        The current leader is kept on ties, so the stable name only changes
+        when another name strictly outvotes it.
         """
-        detections: list of dict {'bbox': [x1,y1,x2,y2], 'usn': str, 'score': float}
-        Returns: list of dicts with stabilized 'usn'
+        history, votes = track['history'], track['votes']
+        evicted = None
+        if len(history) == history.maxlen:
+            evicted = history[0]
+            votes[evicted] -= 1
+            if votes[evicted] == 0:
+                del votes[evicted]
+        history.append(name)
+        votes[name] += 1
+
+        leader = track['final_name']
+        if votes[name] > votes[leader]:
+            track['final_name'] = name
+        elif evicted == leader and votes[leader] < max(votes.values()):
+            # The leader lost a vote to eviction; at most history_len names to scan
+            track['final_name'] = max(votes, key=votes.get)
+
+    def _jumped(self, track, det, iou):
+        if iou < self.reembed_iou:
+            return True
+        old_kps, new_kps = track['kps'], det.get('kps')
+        if old_kps is None or new_kps is None:
+            return False
+        width = max(track['bbox'][2] - track['bbox'][0], 1.0)
+        shift = np.linalg.norm(np.asarray(new_kps) - np.asarray(old_kps), axis=1).mean()
+        return shift / width > self.reembed_kps
+
+    def assign(self, detections):
+        """Associates detections with tracks for a new frame.
+
+        detections: list of dict {'bbox': [x1,y1,x2,y2], 'kps': [[x,y]*5] (optional)}
+        Sets 'track_id' on every detection (new tracks are created for
+        unmatched ones) and returns the tracks, aligned with `detections`.
         """
-        
-        # 1. Prediction (skipped for simple IoU, could be Kalman)
-        
-        # 2. Association
-        matched_indices = [] # indices of detections matched to tracks
-        updated_tracks = []  # indices of tracks that found a match
-        
+        with metrics.stage("track_assign"):
+            return self._assign(detections)
+
+    def _assign(self, detections):
+        self.frame += 1
+        self.last_detection = self.frame
+
+        # 1. Prediction: associate against where each track should be now
+        self._predict()
+
+        # 2. Association: best-overlap pairs matched first
+        matches = greedy_assignment(iou_pairs([t['bbox'] for t in self.tracks], [d['bbox'] for d in detections],
+                                              self.iou_threshold))
+
+        assigned = [None] * len(detections)
+        matched_tracks = set()
+        for t_idx, d_idx, iou in matches:
+            track = self.tracks[t_idx]
+            det = detections[d_idx]
+            matched_tracks.add(t_idx)
+            assigned[d_idx] = track
+
+            self._correct(track, det, iou)
+        KalmanBoxFilter.update_all([self.tracks[t]['kalman'] for t, _, _ in matches],
+                                   [detections[d]['bbox'] for _, d, _ in matches])
+
         for t_idx, track in enumerate(self.tracks):
-            best_iou = 0
-            best_d_idx = -1
-            
-            for d_idx, det in enumerate(detections):
-                if d_idx in matched_indices:
-                    continue
-                
-                iou = self.compute_iou(track['bbox'], det['bbox'])
-                if iou > best_iou:
-                    best_iou = iou
-                    best_d_idx = d_idx
-            
-            if best_iou > self.iou_threshold:
-                # Match found
-                matched_indices.append(best_d_idx)
-                updated_tracks.append(t_idx)
-                
-                # Update track
-                det = detections[best_d_idx]
-                track['bbox'] = det['bbox']
-                track['misses'] = 0
-                
-                # Add to history
-                track['history'].append(det['usn'])
-                if len(track['history']) > self.history_len:
-                    track['history'].pop(0)
-                    
-                # Majority Vote
-                counts = {}
-                for name in track['history']:
-                    counts[name] = counts.get(name, 0) + 1
-                
-                # Sort by frequency
-                sorted_names = sorted(counts.items(), key=lambda x: x[1], reverse=True)
-                majority_name = sorted_names[0][0]
-                
-                track['final_name'] = majority_name
-                
-                # Update detection with stabilized name
-                # We return the detection object augmented with ID and stable name
-                det['track_id'] = track['id']
-                det['stable_usn'] = majority_name
-            else:
+            if t_idx not in matched_tracks:
                 # Track lost this frame
                 track['misses'] += 1
-        
+
         # 3. Create new tracks for unmatched detections
         for d_idx, det in enumerate(detections):
-            if d_idx not in matched_indices:
-                new_track = {
-                    'id': self.next_id,
-                    'bbox': det['bbox'],
-                    'misses': 0,
-                    'history': [det['usn']],
-                    'final_name': det['usn']
-                }
-                self.tracks.append(new_track)
-                self.next_id += 1
-                
-                det['track_id'] = new_track['id']
-                det['stable_usn'] = det['usn']
-        
+            if assigned[d_idx] is None:
+                assigned[d_idx] = self._new_track(det)
+                self.tracks.append(assigned[d_idx])
+
         # 4. cleanup dead tracks
         self.tracks = [t for t in self.tracks if t['misses'] < self.max_misses]
-        
+
+        for det, track in zip(detections, assigned):
+            det['track_id'] = track['id']
+        return assigned
+
+    def _predict(self):
+        boxes = KalmanBoxFilter.predict_all([t['kalman'] for t in self.tracks])
+        for track, bbox in zip(self.tracks, boxes):
+            track['bbox'] = bbox
+
+    def _correct(self, track, det, iou):
+        # The caller applies the Kalman update
+        track['moved'] = track['moved'] or self._jumped(track, det, iou)
+        track['bbox'] = det['bbox']
+        track['kps'] = det.get('kps')
+        track['misses'] = 0
+
+    def should_detect(self):
+        """True if the next frame needs the full detector (see detect_interval)."""
+        return self.frame + 1 - self.last_detection >= self.detect_interval
+
+    def propagate(self):
+        """Advances one frame without running the detector.
+
+        Every track moves to its Kalman prediction. Returns the tracks that
+        were present at the last detection; their 'bbox' is the prediction.
+        """
+        with metrics.stage("track_propagate"):
+            return self._propagate()
+
+    def _propagate(self):
+        self.frame += 1
+        self.tracks = [t for t in self.tracks if t['misses'] < self.max_misses]
+        self._predict()
+        return [t for t in self.tracks if t['misses'] == 0]
+
+    def correct(self, track, det):
+        """Confirms a propagated track with a local detection (e.g. inside its predicted ROI)."""
+        self._correct(track, det, self.compute_iou(track['bbox'], det['bbox']))
+        track['kalman'].update(det['bbox'])
+        det['track_id'] = track['id']
+
+    def lose(self, track):
+        """Marks a propagated track as not found this frame."""
+        track['misses'] += 1
+
+    def refresh_identities(self, generation, enrolled):
+        """Invalidates cached identities if the gallery changed since the last call.
+
+        generation: the gallery's current generation; enrolled(usn) -> bool.
+        Returns True if the identities were invalidated.
+        """
+        if generation == self.gallery_generation:
+            return False
+        self.gallery_generation = generation
+        for track in self.tracks:
+            track['moved'] = True # Re-embed on the next frame
+            if any(name != 'Unknown' and not enrolled(name) for name in track['votes']):
+                track['history'].clear()
+                track['votes'].clear()
+                track['final_name'] = 'Unknown'
+                track['confidence'] = 0.0
+        return True
+
+    def needs_embedding(self, track):
+        """True if the track's face should go through ArcFace this frame."""
+        return (
+            track['embedding'] is None
+            or track['final_name'] == 'Unknown'
+            or track['moved']
+            or self.frame - track['last_embed'] >= self.reembed_interval
+            or track['confidence'] < self.min_confidence
+        )
+
+    def observe(self, track, det):
+        """Records the outcome of a frame for one assigned detection.
+
+        A detection carrying 'usn' (and optionally 'score' / 'embedding') was
+        recognized this frame and votes; one without reuses the track's
+        identity. Sets 'usn', 'score' and 'stable_usn' on the detection.
+        """
+        if 'usn' in det:
+            embedding = det.get('embedding')
+            if embedding is not None:
+                if track['embedding'] is None:
+                    track['embedding'] = np.asarray(embedding, dtype=np.float32)
+                else:
+                    if float(np.dot(track['embedding'], embedding)) < self.identity_reset:
+                        # Someone else took over this box; forget the old identity
+                        track['history'].clear()
+                        track['votes'].clear()
+                        track['final_name'] = 'Unknown'
+                        track['confidence'] = 0.0
+                        track['embedding'] = np.asarray(embedding, dtype=np.float32)
+                    ema = self.ema_alpha * track['embedding'] + (1 - self.ema_alpha) * embedding
+                    track['embedding'] = (ema / max(np.linalg.norm(ema), 1e-12)).astype(np.float32)
+
+            score = float(det.get('score', 0.0))
+            if track['votes']:
+                track['confidence'] = self.ema_alpha * track['confidence'] + (1 - self.ema_alpha) * score
+            else:
+                track['confidence'] = score
+            self._vote(track, det['usn'])
+            track['last_embed'] = self.frame
+            track['moved'] = False
+            self.embedded += 1
+            metrics.EMBEDDINGS.inc()
+        else:
+            track['confidence'] *= self.confidence_decay
+            det['usn'] = track['final_name']
+            det['score'] = track['confidence']
+            self.skipped += 1
+            metrics.EMBEDDINGS_SKIPPED.inc()
+
+        det['stable_usn'] = track['final_name']
+        return det
+
+    def update(self, detections):
+        """
+        detections: list of dict {'bbox': [x1,y1,x2,y2], 'usn': str, 'score': float}
+        Returns: list of dicts with stabilized 'usn'
+        """
+        tracks = self.assign(detections)
+        for track, det in zip(tracks, detections):
+            self.observe(track, det)
         return detections
@@ -1,11 +1,52 @@
+"""INT8 quantization for the detector and recognizer.
 
-import onnx
-from onnxruntime.quantization import quantize_dynamic, QuantType
+Static mode (default) produces QDQ models calibrated on real data:
+  - det_10g.onnx   on frames from faces/, preprocessed exactly like detect_scrfd
+  - w600k_r50.onnx on the aligned 112x112 crops the FP32 engine produces from them
+and prints a report comparing the INT8 models against FP32 (latency, embedding
+cosine drift, top-1 identity agreement, peak memory).
+
+Calibration blobs are preprocessed one at a time as the calibrator asks for
+them (the calibrator itself only keeps per-tensor min/max values). Holding
+all 200 detector blobs up front (640x640 float32, ~4.9 MB each) took ~1 GB;
+peak memory no longer grows with --max-images beyond the decoded images.
+
+Dynamic mode is the old weight-only quantize_dynamic path.
+
+Usage (from python-face-api/):
+    python models/quantize.py [--mode static|dynamic] [--faces faces] [--max-images 200]
+"""
+import argparse
+import glob
 import os
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+import cv2
+import numpy as np
+import onnx
+from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat,
+                                      QuantType, quantize_dynamic, quantize_static)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.alignment import align_batch, similarity_transforms
+from engine.face_engine import FaceEngine
+
+DET_FP32 = "det_10g.onnx"
+REC_FP32 = "w600k_r50.onnx"
+DET_INT8 = "det_10g_int8.onnx"
+REC_INT8 = "w600k_r50_int8.onnx"
+
 
 def quantize_model(input_path, output_path):
     print(f"Quantizing {input_path} -> {output_path}...")
-    
+
     if not os.path.exists(input_path):
         print(f"Error: {input_path} not found.")
         return
@@ -20,9 +61,215 @@ def quantize_model(input_path, output_path):
     except Exception as e:
         print(f"Quantization failed: {e}")
 
+
+class BlobReader(CalibrationDataReader):
+    """Feeds preprocessed NCHW blobs to the calibrator, one at a time.
+
+    make_blobs() returns a fresh iterator of `count` blobs, so only the blob
+    being calibrated on is held in memory.
+    """
+
+    def __init__(self, input_name, make_blobs, count):
+        self.input_name = input_name
+        self.make_blobs = make_blobs
+        self.count = count
+        self.rewind()
+
+    def get_next(self):
+        blob = next(self._iter, None)
+        return None if blob is None else {self.input_name: blob}
+
+    def rewind(self):
+        self._iter = iter(self.make_blobs())
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def load_images(faces_dir, max_images):
+    """(usn, image) pairs from faces/<usn>/*.jpg."""
+    samples = []
+    for img_path in sorted(glob.glob(os.path.join(faces_dir, "*", "*.jpg"))):
+        img = cv2.imread(img_path)
+        if img is not None:
+            samples.append((os.path.basename(os.path.dirname(img_path)), img))
+        if len(samples) >= max_images:
+            break
+    return samples
+
+
+def aligned_crops(engine, samples):
+    """Largest-face 112x112 crops from the FP32 engine (the recognizer's real inputs)."""
+    images = []
+    landmarks = []
+    usns = []
+    for usn, img in samples:
+        faces = engine.detector.detect_scrfd(img, threshold=0.5)
+        if len(faces) == 0:
+            continue
+        areas = (faces[:, 2] - faces[:, 0]) * (faces[:, 3] - faces[:, 1])
+        images.append(img)
+        landmarks.append(faces[np.argmax(areas)][5:15].reshape(5, 2))
+        usns.append(usn)
+    if not landmarks:
+        return [], []
+
+    # One vectorized solve for every transform; degenerate landmark sets are dropped
+    transforms = similarity_transforms(landmarks)
+    valid = transforms[1]
+    crops = align_batch(images, landmarks, transforms=transforms)
+    return list(crops[valid]), [usn for usn, ok in zip(usns, valid) if ok]
+
+
+def preprocess_model(model_path):
+    """Runs ORT's quantization pre-processing (shape inference + folding) if available."""
+    try:
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+    except ImportError:
+        return model_path
+    out_path = os.path.join(tempfile.mkdtemp(), os.path.basename(model_path))
+    try:
+        quant_pre_process(model_path, out_path, skip_symbolic_shape=True)
+        return out_path
+    except Exception as e:
+        print(f"Pre-processing {model_path} failed ({e}), quantizing the original graph")
+        return model_path
+
+
+def quantize_static_model(input_path, output_path, reader, per_channel=True):
+    print(f"Static QDQ quantization {input_path} -> {output_path} ({reader.count} calibration samples)...")
+    quantize_static(
+        model_input=preprocess_model(input_path),
+        model_output=output_path,
+        calibration_data_reader=reader,
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=per_channel,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+    onnx.checker.check_model(output_path)
+    print("Quantization successful.")
+
+
+def time_call(fn, repeats):
+    fn()  # warmup
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def leave_one_out_top1(embeddings, usns):
+    """Nearest other image's USN for every embedding."""
+    sims = embeddings @ embeddings.T
+    np.fill_diagonal(sims, -np.inf)
+    return [usns[i] for i in np.argmax(sims, axis=1)]
+
+
+def report(fp32, int8, samples, crops, usns, repeats, calib_peak_mb=None):
+    print("\n=== INT8 vs FP32 report ===")
+
+    if calib_peak_mb is not None:
+        print(f"Peak memory: {calib_peak_mb:.0f} MB RSS during calibration "
+              f"({len(samples)} frames, {len(crops)} crops)")
+
+    # Latency
+    frame = samples[0][1]
+    det_fp32 = time_call(lambda: fp32.detector.detect_scrfd(frame), repeats)
+    det_int8 = time_call(lambda: int8.detector.detect_scrfd(frame), repeats)
+    print(f"Detector   : {det_fp32 * 1000:8.2f} ms -> {det_int8 * 1000:8.2f} ms per frame ({det_fp32 / det_int8:.2f}x)")
+
+    if not crops:
+        print("No aligned faces found, skipping recognizer comparison.")
+        return
+    rec_fp32 = time_call(lambda: fp32.recognizer.get_embeddings(crops), repeats) / len(crops)
+    rec_int8 = time_call(lambda: int8.recognizer.get_embeddings(crops), repeats) / len(crops)
+    print(f"Recognizer : {rec_fp32 * 1000:8.2f} ms -> {rec_int8 * 1000:8.2f} ms per face ({rec_fp32 / rec_int8:.2f}x)")
+
+    # Embedding drift on identical crops
+    emb_fp32 = fp32.recognizer.get_embeddings(crops)
+    emb_int8 = int8.recognizer.get_embeddings(crops)
+    cos = np.sum(emb_fp32 * emb_int8, axis=1)
+    print(f"Cosine(FP32, INT8) on {len(crops)} crops: mean {cos.mean():.4f}  min {cos.min():.4f}  p5 {np.percentile(cos, 5):.4f}")
+
+    # Top-1 identity agreement (leave-one-out nearest neighbour over the enrolled images)
+    if len(set(usns)) > 1:
+        top1_fp32 = leave_one_out_top1(emb_fp32, usns)
+        top1_int8 = leave_one_out_top1(emb_int8, usns)
+        agree = np.mean([a == b for a, b in zip(top1_fp32, top1_int8)])
+        acc_fp32 = np.mean([a == b for a, b in zip(top1_fp32, usns)])
+        acc_int8 = np.mean([a == b for a, b in zip(top1_int8, usns)])
+        print(f"Top-1 agreement (recognizer only): {agree * 100:.1f}%  "
+              f"(accuracy FP32 {acc_fp32 * 100:.1f}% / INT8 {acc_int8 * 100:.1f}%)")
+
+        # End to end: INT8 detector + INT8 recognizer on the raw images
+        images = [img for _, img in samples]
+        e2e_int8 = int8.get_enrollment_embeddings(images)
+        e2e_fp32 = fp32.get_enrollment_embeddings(images)
+        pairs = [(a, b, usn) for a, b, (usn, _) in zip(e2e_fp32, e2e_int8, samples) if a is not None and b is not None]
+        if len(pairs) > 1:
+            e_fp32 = np.stack([p[0] for p in pairs])
+            e_int8 = np.stack([p[1] for p in pairs])
+            e_usns = [p[2] for p in pairs]
+            agree = np.mean([a == b for a, b in zip(leave_one_out_top1(e_fp32, e_usns), leave_one_out_top1(e_int8, e_usns))])
+            print(f"Top-1 agreement (end to end)     : {agree * 100:.1f}% over {len(pairs)} images")
+    else:
+        print("Need at least two enrolled students for top-1 agreement.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["static", "dynamic"], default="static")
+    parser.add_argument("--faces", default="faces", help="calibration images (faces/<usn>/*.jpg)")
+    parser.add_argument("--max-images", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=10, help="timing repeats for the report")
+    parser.add_argument("--no-per-channel", action="store_true", help="per-tensor weight scales")
+    args = parser.parse_args()
+
+    if args.mode == "dynamic":
+        # RetinaFace
+        quantize_model(DET_FP32, DET_INT8)
+        # ArcFace
+        quantize_model(REC_FP32, REC_INT8)
+        return
+
+    for path in (DET_FP32, REC_FP32):
+        if not os.path.exists(path):
+            print(f"Error: {path} not found. Run models/download_models.py first.")
+            sys.exit(1)
+
+    samples = load_images(args.faces, args.max_images)
+    if not samples:
+        print(f"Error: no calibration images under {args.faces}/")
+        sys.exit(1)
+
+    # Calibration data comes from the FP32 engine's own preprocessing
+    fp32 = FaceEngine(DET_FP32, REC_FP32)
+    crops, usns = aligned_crops(fp32, samples)
+    print(f"Calibration set: {len(samples)} frames, {len(crops)} aligned crops")
+
+    per_channel = not args.no_per_channel
+    det_input = fp32.detector.session.get_inputs()[0].name
+    det_reader = BlobReader(det_input, lambda: (fp32.detector.preprocess(img)[0] for _, img in samples), len(samples))
+    quantize_static_model(DET_FP32, DET_INT8, det_reader, per_channel)
+    if crops:
+        rec_reader = BlobReader(fp32.recognizer.input_name,
+                                lambda: (fp32.recognizer.preprocess([crop]) for crop in crops), len(crops))
+        quantize_static_model(REC_FP32, REC_INT8, rec_reader, per_channel)
+    else:
+        print("No faces detected in the calibration images; skipping the recognizer.")
+        return
+    calib_peak_mb = peak_rss_mb()
+
+    int8 = FaceEngine(DET_INT8, REC_INT8)
+    report(fp32, int8, samples, crops, usns, args.repeats, calib_peak_mb)
+
+
 if __name__ == "__main__":
-    # RetinaFace
-    quantize_model("det_10g.onnx", "det_10g_int8.onnx")
-    
-    # ArcFace
-    quantize_model("w600k_r50.onnx", "w600k_r50_int8.onnx")
+    main()
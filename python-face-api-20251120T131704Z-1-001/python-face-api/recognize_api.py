@@ -1,114 +1,257 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response, stream_with_context
 from flask_cors import CORS
 import cv2
 import numpy as np
 import os
-import base64
+import json
 import time
 import shutil
-import glob
+import tempfile
+import zipfile
+import threading
+import functools
+import contextlib
 from engine.face_engine import FaceEngine
 from engine.tracker import FaceTracker
+from engine.streams import StreamRegistry
+from engine.gallery import Gallery
+from engine.index import make_index
+from engine.consolidation import Consolidator
+from engine.embedding_store import EmbeddingStore, model_fingerprint
+from engine.image_io import decode_image, decode_data_url
+from engine.bulk_enroll import BulkEnroller, students_from_zip, students_from_files, next_image_index
+from engine.faces_watcher import FacesWatcher
+from engine.frame_gate import FrameGate
+from engine.detector_scale import DetectorScale
+from engine.batcher import MicroBatcher
+from engine.shared_gallery import SharedGallery
+from engine import metrics
 
 app = Flask(__name__)
 CORS(app)
 
-# Logging Setup
 import logging
-logging.basicConfig(filename='api_debug.log', level=logging.DEBUG, 
-                    format='%(asctime)s %(levelname)s: %(message)s')
-
-# Also log to console
-console = logging.StreamHandler()
-console.setLevel(logging.DEBUG)
-logging.getLogger('').addHandler(console)
+from engine.log import setup_logging, RateLimitFilter
 
 
 # --- Configuration ---
+LOG_FILE = "api_debug.log" # Rotated at 10 MB; None = console only
+# Level per subsystem: "face_api" = API, "face_api.faces" = one record per face (DEBUG adds each Top-5), "engine" = engine modules
+LOG_LEVELS = {"": "WARNING", "face_api": "INFO", "face_api.faces": "INFO", "engine": "INFO"}
+FACE_LOG_RATE = 20 # Per-face records per second at most; the rest are counted and dropped
 FACES_DIR = "faces"
+EMBEDDINGS_DIR = "embeddings_store" # Persistent embedding cache, kept next to faces/
+FACES_SYNC_INTERVAL = 10 # Seconds between checks of faces/ for images added, changed or removed by other services (Node server, enroll.py); None = only at startup and on /reload
 # Use quantized models if available, otherwise original
 DET_MODEL = "det_10g_int8.onnx" if os.path.exists("det_10g_int8.onnx") else "det_10g.onnx"
 REC_MODEL = "w600k_r50_int8.onnx" if os.path.exists("w600k_r50_int8.onnx") else "w600k_r50.onnx"
 SIMILARITY_THRESHOLD = 0.45 # Tuned to 0.45 as requested
+MATCH_POOLING = "max" # How a student's embeddings are pooled: "max" or "mean"
+GALLERY_INDEX = "exact" # "exact" scores every stored embedding; "ivf" = approximate index for very large galleries
+IVF_NPROBE = 8 # IVF cells scanned per query (higher = better recall, slower)
+CONSOLIDATE_EMBEDDINGS = False # Keep each student as a centroid plus a few diverse medoids instead of every embedding (bounds gallery size)
+CONSOLIDATE_MEDOIDS = 4 # Medoids kept per student when consolidating
+REDUCED_DECODE_TARGET = 640 # Large JPEG frames are decoded at 1/2, 1/4 or 1/8 size down to this long side; None = always full size
+MIN_FACE_SIZE = 40 # Faces narrower or shorter than this many original-image pixels are ignored, whatever the decode size
+ALIGN_MIN_FACE = 112 # Faces to embed that measure less than this in a reduced decode are aligned from a full-resolution decode (ArcFace crops are 112 px)
+MAX_STREAMS = 64 # Camera streams tracked at once; least recently used are evicted beyond this
+STREAM_IDLE_TIMEOUT = 300 # Seconds without frames before a stream's tracker is dropped
+DETECT_INTERVAL = 1 # Run the full detector every K frames per stream (e.g. 3-5 for fixed classroom cameras); 1 = every frame
+ROI_REFINE = True # Between full detections, confirm each track with a detection in a small ROI around its predicted box
+FRAME_GATE = True # Answer frames that barely differ from the stream's last recognized frame with its result
+FRAME_GATE_CHANGE = 0.01 # Fraction of a 64x48 grayscale thumbnail that must change (by > FRAME_GATE_PIXEL_DELTA levels) to recognize again
+FRAME_GATE_PIXEL_DELTA = 12 # Grey levels a thumbnail pixel must move to count as changed; above sensor noise
+CLIENT_POLL_INTERVAL = 2.0 # Seconds between a client's /recognize frames; the frontend (facefrontend/src/frontpage.jsx) polls every 2000 ms
+# A cached result may answer the next poll of an unchanged scene but never the one after: at 1.5 intervals
+# poll jitter can't flip that (at exactly one interval, every other reuse would be a coin toss), and a polling
+# client is recognized afresh at least every second poll. Video clients sending faster reuse it for the same time.
+FRAME_GATE_MAX_AGE = 1.5 * CLIENT_POLL_INTERVAL # Seconds a cached result is reused at most before a forced refresh
+REEMBED_INTERVAL = 15 # Frames a recognized track reuses its identity before ArcFace re-checks it; 1 = embed every face every frame
+RECOGNIZE_BATCHING = True # Queue concurrent /recognize frames and embed them together (needs a threaded server)
+BATCH_WINDOW_MS = 5 # How long the dispatcher waits for more frames after the first one
+BATCH_MAX_SIZE = 8 # Frames recognized together at most
+BATCH_TIMEOUT = 30 # Seconds a request waits for its batch before giving up
+SHARED_GALLERY_DIR = None # e.g. "shared_gallery" to share the gallery between pre-fork worker processes (Unix); None = in-process only
+DET_INPUT_SIZE = None # e.g. 640 for a fixed 640x640 letterbox with preallocated I/O buffers; None = dynamic shape
+ADAPTIVE_DET_SIZE = True # Per stream, detect at the smallest of DET_SIZES that still resolves its smallest faces (kiosk cameras); off with DET_INPUT_SIZE or DET_TILE_SIZE
+DET_SIZES = (320, 480, 640) # Detector input long sides to choose from; the largest is also used while a stream has no history
+DET_MIN_FACE = 32 # Detector pixels the smallest recent face must keep at the chosen size
+DET_TILE_SIZE = None # e.g. 640 to also detect on overlapping full-resolution tiles of large frames (4K hall cameras, distant faces); None = single downscaled pass
+DET_TILE_OVERLAP = 0.25 # Fraction of a tile shared with its neighbour; should exceed the largest face a tile must see whole
+DET_TILE_WORKERS = 2 # Threads running tiles in parallel; 1 = one after another
+BULK_ENROLL_WORKERS = 2 # Threads decoding, saving and detecting during /enroll_bulk; keep cores free for /recognize
+BULK_EMBED_BATCH = 32 # Faces embedded per ArcFace call during /enroll_bulk, and images per chunk when syncing faces/
+REC_BATCH_SIZE = 32 # Crops per ArcFace run at most; larger batches are split
+
+# Logging Setup: file and console are written by a background thread, never by request threads
+setup_logging(LOG_FILE, LOG_LEVELS)
+log = logging.getLogger("face_api")
+face_log = logging.getLogger("face_api.faces")
+if not face_log.filters:
+    face_log.addFilter(RateLimitFilter(FACE_LOG_RATE))
+
+log.info("Loading FaceEngine with %s and %s...", DET_MODEL, REC_MODEL)
+engine = FaceEngine(DET_MODEL, REC_MODEL, rec_batch_size=REC_BATCH_SIZE, det_input_size=DET_INPUT_SIZE,
+                    det_tile_size=DET_TILE_SIZE, det_tile_overlap=DET_TILE_OVERLAP, det_tile_workers=DET_TILE_WORKERS)
+# One independent FaceTracker per camera stream
+# Tracks whose decayed match score drops below the threshold get re-embedded early
+tracker_factory = functools.partial(FaceTracker, reembed_interval=REEMBED_INTERVAL, min_confidence=SIMILARITY_THRESHOLD,
+                                    detect_interval=DETECT_INTERVAL)
+# Each stream also gets a change gate that skips inference on static frames
+gate_factory = functools.partial(FrameGate, min_changed=FRAME_GATE_CHANGE, pixel_delta=FRAME_GATE_PIXEL_DELTA,
+                                 max_age=FRAME_GATE_MAX_AGE) if FRAME_GATE else None
+# and, with a dynamic-shape detector, its own detector input size
+scale_factory = functools.partial(DetectorScale, sizes=DET_SIZES, min_face=DET_MIN_FACE) \
+    if ADAPTIVE_DET_SIZE and not DET_INPUT_SIZE and not DET_TILE_SIZE else None
+streams = StreamRegistry(tracker_factory, max_streams=MAX_STREAMS, idle_timeout=STREAM_IDLE_TIMEOUT,
+                         gate_factory=gate_factory, scale_factory=scale_factory)
+log.info("FaceEngine loaded.")
+
+# Global gallery: one contiguous embedding matrix + parallel USN labels
+# The store on disk always keeps every embedding; consolidation only shrinks the in-memory gallery
+gallery = Gallery(index=None if GALLERY_INDEX == "exact" else make_index(GALLERY_INDEX, nprobe=IVF_NPROBE),
+                  consolidator=Consolidator(CONSOLIDATE_MEDOIDS) if CONSOLIDATE_EMBEDDINGS else None)
+
+# Pre-fork workers share one memory-mapped gallery and see each other's enrollments
+shared_gallery = SharedGallery(gallery, SHARED_GALLERY_DIR) if SHARED_GALLERY_DIR else None
+
+# Sizes are read when /metrics is scraped
+metrics.GALLERY_STUDENTS.set_function(lambda: gallery.num_students)
+metrics.GALLERY_EMBEDDINGS.set_function(lambda: gallery.num_embeddings)
+metrics.STREAMS.set_function(lambda: len(streams))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or "unknown"
+    if endpoint != "metrics_endpoint":
+        metrics.REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - g.request_start)
+    if response.status_code >= 500:
+        metrics.ERRORS.labels(endpoint).inc()
+    return response
+
+# Persistent embeddings for faces/, so restarts only embed new or changed images
+store = EmbeddingStore(FACES_DIR, EMBEDDINGS_DIR, model_fingerprint(DET_MODEL, REC_MODEL), embed_batch=BULK_EMBED_BATCH)
+
+def read_image_files(img_paths):
+    for img_path in img_paths:
+        img = cv2.imread(img_path)
+        if img is None:
+            log.warning("Error loading %s: unreadable image", img_path)
+        yield img
+
+def embed_image_files(img_paths):
+    """Embeds the largest face of each enrolled image (None where unusable).
+
+    Images are read one at a time and only their aligned crops are kept; the
+    store passes at most BULK_EMBED_BATCH paths per call.
+    """
+    return engine.get_enrollment_embeddings(read_image_files(img_paths))
 
-print(f"Loading FaceEngine with {DET_MODEL} and {REC_MODEL}...")
-engine = FaceEngine(DET_MODEL, REC_MODEL)
-tracker = FaceTracker()
-print("FaceEngine loaded.")
+# Orders faces/ syncs against enrollments and deletions in this process
+sync_lock = threading.RLock()
 
-# Global cache for embeddings: {usn: [embedding_vector, ...]}
-known_embeddings = {}
+def sync_gallery(initial=False):
+    """Brings the gallery up to date with faces/, embedding only new or changed images.
+
+    The new gallery is swapped in as one snapshot, so in-flight /recognize
+    calls finish on the old one. Returns the store's image counts
+    {added, changed, removed}.
+    """
+    os.makedirs(FACES_DIR, exist_ok=True)
+    # With a shared gallery, one worker at a time syncs the store and publishes the result to all workers
+    shared_lock = shared_gallery.locked() if shared_gallery is not None else contextlib.nullcontext()
+    with sync_lock, shared_lock:
+        if shared_gallery is not None:
+            # Start from the latest published gallery, so replace() re-indexes only what this sync changed
+            shared_gallery.refresh()
+        known_embeddings = store.sync(embed_image_files)
+        changes = dict(store.last_changes)
+        if initial or any(changes.values()):
+            gallery.replace(known_embeddings)
+            if shared_gallery is not None:
+                shared_gallery.publish()
+        elif shared_gallery is not None:
+            # Another worker may have synced these changes already
+            shared_gallery.refresh()
+    if not initial and any(changes.values()):
+        log.info("faces/ changed (%d added, %d changed, %d removed); gallery now has %d students.",
+                 changes["added"], changes["changed"], changes["removed"], gallery.num_students)
+    return changes
 
 def load_known_faces():
-    """Loads all faces from disk and computes embeddings."""
-    global known_embeddings
-    known_embeddings = {}
-    
-    print("Loading known faces...")
-    if not os.path.exists(FACES_DIR):
-        os.makedirs(FACES_DIR)
-        
-    student_folders = os.listdir(FACES_DIR)
-    total_faces = 0
-    
-    for usn in student_folders:
-        student_path = os.path.join(FACES_DIR, usn)
-        if not os.path.isdir(student_path):
-            continue
-            
-        imgs = glob.glob(os.path.join(student_path, "*.jpg"))
-        student_embs = []
-        
-        for img_path in imgs:
-            try:
-                img = cv2.imread(img_path)
-                if img is None:
-                    continue
-                
-                faces = engine.detector.detect_scrfd(img, threshold=0.5)
-                
-                if len(faces) > 0:
-                    # Take largest face
-                    areas = (faces[:, 2] - faces[:, 0]) * (faces[:, 3] - faces[:, 1])
-                    best_idx = np.argmax(areas)
-                    face = faces[best_idx]
-                    
-                    # Unpack (15 elements: bbox(4)+score(1)+kps(10))
-                    # x1, y1, x2, y2 = face[:4]
-                    kps = face[5:15].reshape(5, 2)
-                    
-                    # Align
-                    M = engine.estimate_norm(kps)
-                    if M is not None:
-                        align_face = cv2.warpAffine(img, M, (112, 112), borderValue=0.0)
-                        emb = engine.recognizer.get_embedding(align_face)
-                        student_embs.append(emb)
-                    else:
-                        # Fallback crop
-                        x1, y1, x2, y2 = face[:4].astype(int)
-                        crop = img[y1:y2, x1:x2]
-                        if crop.size > 0:
-                            emb = engine.recognizer.get_embedding(crop)
-                            student_embs.append(emb)
-                else:
-                    # Fallback: assume image IS the face
-                    emb = engine.recognizer.get_embedding(img)
-                    student_embs.append(emb)
-                    
-            except Exception as e:
-                print(f"Error loading {img_path}: {e}")
-                
-        if student_embs:
-            known_embeddings[usn] = student_embs
-            total_faces += len(student_embs)
-            
-    print(f"Loaded {len(known_embeddings)} students with {total_faces} faces.")
+    """Loads embeddings from the store, embedding only new or changed images."""
+    log.info("Loading known faces...")
+    start_time = time.time()
+    sync_gallery(initial=True)
+    log.info("Loaded %d students with %d gallery embeddings in %.3fs.", gallery.num_students, gallery.num_embeddings,
+             time.time() - start_time)
+
+def update_gallery(fn):
+    """Applies fn(gallery); with a shared gallery, for every worker before this returns."""
+    if shared_gallery is not None:
+        return shared_gallery.update(fn)
+    return fn(gallery)
+
+def add_enrolled(enrolled):
+    """Adds newly saved images to the gallery: {usn: [(image path, embedding), ...]}.
+
+    The embeddings are also handed to the store, so the next faces/ sync does
+    not embed these images again; images a sync has already picked up are
+    skipped here rather than added twice.
+    """
+    def apply(g):
+        stored = store.remember({path: emb for items in enrolled.values() for path, emb in items})
+        if shared_gallery is not None:
+            # Other workers sync faces/ too and must find these embeddings on disk
+            store.persist_pending()
+        g.add_many({usn: [emb for path, emb in items if path not in stored] for usn, items in enrolled.items()})
+    with sync_lock:
+        update_gallery(apply)
 
 # Initial load
 load_known_faces()
 
-@app.route("/enroll", methods=["POST"])
-def enroll():
+# Picks up images written to faces/ by other services without a restart
+faces_watcher = FacesWatcher(FACES_DIR, sync_gallery, interval=FACES_SYNC_INTERVAL) if FACES_SYNC_INTERVAL else None
+
+@app.before_request
+def start_faces_watcher():
+    # Started lazily so each pre-fork worker runs its own
+    if faces_watcher is not None:
+        faces_watcher.ensure_started()
+
+def is_binary_upload():
+    return request.mimetype.startswith("image/") or request.mimetype == "application/octet-stream"
+
+def read_frame_bytes():
+    """Frame bytes from a raw image body, a multipart 'image' file or JSON {"image": data URL}."""
+    if is_binary_upload():
+        return request.get_data()
+    if "image" in request.files:
+        return request.files["image"].read()
+    data = request.get_json()
+    return decode_data_url(data["image"])
+
+def read_stream_id():
+    """Camera/stream id from the X-Stream-Id header, ?stream_id=, form or JSON field."""
+    stream_id = request.headers.get("X-Stream-Id") or request.args.get("stream_id") or request.form.get("stream_id")
+    if not stream_id and request.is_json:
+        stream_id = (request.get_json(silent=True) or {}).get("stream_id")
+    return str(stream_id) if stream_id else "default"
+
+def read_enroll_request():
+    """(usn, [image bytes]) from JSON (base64), multipart files or a raw image body (?usn=)."""
+    if is_binary_upload():
+        return request.args["usn"], [request.get_data()]
+    if request.files:
+        usn = request.form.get("usn") or request.args["usn"]
+        files = request.files.getlist("images") + request.files.getlist("image")
+        return usn, [f.read() for f in files]
+
     data = request.get_json()
     usn = data["usn"]
     
@@ -117,75 +260,98 @@ def enroll():
         images = data["images"]
     elif "image" in data:
         images = [data["image"]]
+    return usn, [decode_data_url(image_data) for image_data in images]
+
+@app.route("/enroll", methods=["POST"])
+def enroll():
+    usn, images = read_enroll_request()
 
     student_folder = os.path.join(FACES_DIR, usn)
     os.makedirs(student_folder, exist_ok=True)
 
     saved_count = 0
-    new_embeddings = []
+    decoded_images = []
+    saved_paths = []
+    enrolled = []
+    next_index = next_image_index(student_folder)
 
-    for i, image_data in enumerate(images):
-        if "," in image_data:
-            image_data = image_data.split(",")[1]
-            
-        image_bytes = base64.b64decode(image_data)
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        face_img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR) # Ensure COLOR
+    for i, image_bytes in enumerate(images):
+        # Enrollment images are kept at full resolution
+        face_img, _ = decode_image(image_bytes)
 
         # Save image
-        img_count = len(os.listdir(student_folder))
-        img_name = f"{img_count + 1 + i}.jpg" # avoid overwrite collision in loop
+        img_name = f"{next_index + i}.jpg"
         img_path = os.path.join(student_folder, img_name)
         cv2.imwrite(img_path, face_img)
         saved_count += 1
-        
-        # Compute embedding and update cache immediately
-        try:
-             # Detection logic same as load
-            faces = engine.detector.detect_scrfd(face_img, threshold=0.5)
-            if len(faces) > 0:
-                # Largest face
-                logging.debug(f"Enrollment: Found {len(faces)} faces for image {i}")
-                
-                areas = (faces[:, 2] - faces[:, 0]) * (faces[:, 3] - faces[:, 1])
-                best_idx = np.argmax(areas)
-                face = faces[best_idx]
-                
-                kps = face[5:15].reshape(5, 2)
-                M = engine.estimate_norm(kps)
-                
-                if M is not None:
-                     crop = cv2.warpAffine(face_img, M, (112, 112), borderValue=0.0)
-                else:
-                     x1, y1, x2, y2 = face[:4].astype(int)
-                     crop = face_img[y1:y2, x1:x2]
-                
-                emb = engine.recognizer.get_embedding(crop)
-                new_embeddings.append(emb)
-            else:
-                 logging.warning(f"Enrollment: No face detected in image {i}, using full image fallback")
-                 emb = engine.recognizer.get_embedding(face_img)
-                 new_embeddings.append(emb)
-        except Exception as e:
-            logging.error(f"Error generating embedding for enrollment: {e}")
-            print(f"Error generating embedding for enrollment: {e}")
+        decoded_images.append(face_img)
+        saved_paths.append(img_path)
+
+    # Compute embeddings for all uploaded images in one batched pass
+    try:
+        embeddings = engine.get_enrollment_embeddings(decoded_images)
+        enrolled = [(path, emb) for path, emb in zip(saved_paths, embeddings) if emb is not None]
+        if len(enrolled) < len(decoded_images):
+            log.warning("Enrollment: %d images could not be embedded", len(decoded_images) - len(enrolled))
+    except Exception as e:
+        metrics.ERRORS.labels("enroll").inc()
+        log.error("Error generating embedding for enrollment: %s", e)
 
-    # Update global cache
-    if usn not in known_embeddings:
-        known_embeddings[usn] = []
-    known_embeddings[usn].extend(new_embeddings)
+    # Update global gallery
+    add_enrolled({usn: enrolled})
 
     return jsonify({"message": f"Student {usn} enrolled successfully with {saved_count} images!"})
 
+# Bulk enrollment adds each batch of students to the gallery in one update
+bulk_enroller = BulkEnroller(engine, FACES_DIR, commit=add_enrolled, workers=BULK_ENROLL_WORKERS,
+                             batch_size=BULK_EMBED_BATCH)
+
+@app.route("/enroll_bulk", methods=["POST"])
+def enroll_bulk():
+    """Enrolls many students from one upload; streams progress as NDJSON.
+
+    Accepts a zip of <usn>/<image> entries (raw application/zip body or a
+    multipart "archive" file) or multipart "images" files named <usn>/<image>.
+    Writes one JSON line per student as it is enrolled, then a summary line.
+    Runs on the request's own thread; /recognize keeps serving meanwhile.
+    """
+    # Uploads are read before streaming starts; the request's files are closed after that
+    if "archive" in request.files:
+        upload = request.files["archive"].stream
+    elif request.files:
+        upload = None
+        students = students_from_files([(f.filename, f.read()) for f in request.files.getlist("images")])
+    elif request.mimetype in ("application/zip", "application/x-zip-compressed", "application/octet-stream"):
+        upload = request.stream
+    else:
+        return jsonify({"error": "Expected a zip archive or multipart images named <usn>/<file>"}), 400
+
+    if upload is not None:
+        # Spooled to disk: zip needs random access and an upload can be large
+        archive = tempfile.TemporaryFile()
+        shutil.copyfileobj(upload, archive)
+        archive.seek(0)
+        try:
+            students = students_from_zip(archive)
+        except zipfile.BadZipFile:
+            archive.close()
+            return jsonify({"error": "Upload is not a valid zip archive"}), 400
+
+    def progress():
+        for update in bulk_enroller.run(students):
+            yield json.dumps(update) + "\n"
+
+    return Response(stream_with_context(progress()), mimetype="application/x-ndjson")
+
 @app.route("/delete_student/<usn>", methods=["DELETE"])
 def delete_student(usn):
     student_folder = os.path.join(FACES_DIR, usn)
     if os.path.exists(student_folder):
         try:
-            shutil.rmtree(student_folder)
-            # Remove from cache
-            if usn in known_embeddings:
-                del known_embeddings[usn]
+            with sync_lock:
+                shutil.rmtree(student_folder)
+                # Remove from gallery
+                update_gallery(lambda g: g.remove(usn))
             return jsonify({"message": f"Student {usn} deleted."})
         except Exception as e:
             return jsonify({"error": str(e)}), 500
@@ -195,62 +361,203 @@ def delete_student(usn):
 def cosine_similarity(emb1, emb2):
     return np.dot(emb1, emb2) / (np.linalg.norm(emb1) * np.linalg.norm(emb2))
 
+def to_tracker_detection(res, factor):
+    """Detection in decoded-frame coordinates -> tracker detection in original-image coordinates."""
+    return {
+        'bbox': [float(v) * factor for v in res['bbox']],
+        'kps': [[x * factor, y * factor] for x, y in res['kps']]
+    }
+
+def detect_frame(stream, frame, factor):
+    """Full-frame detection at the stream's detector input size, which it then adapts."""
+    min_face = MIN_FACE_SIZE / factor
+    scale = stream.scale
+    if scale is None:
+        return engine.detect(frame, min_face=min_face)
+
+    size = scale.next_size()
+    start = time.perf_counter()
+    results = engine.detect(frame, input_size=size, min_face=min_face)
+    seconds = time.perf_counter() - start
+    face_sizes = [min(res["bbox"][2] - res["bbox"][0], res["bbox"][3] - res["bbox"][1]) for res in results]
+    saved = scale.observe(size, max(frame.shape[:2]), face_sizes, seconds)
+    metrics.DETECTIONS.labels(str(size)).inc()
+    metrics.DETECT_SAVED_SECONDS.inc(saved)
+    return results
+
+def track_frame(stream, frame, factor):
+    """Detects faces and associates them with the stream's tracks.
+
+    With DETECT_INTERVAL > 1 the full detector only runs every K frames; in
+    between tracks move by their Kalman prediction and, with ROI_REFINE, are
+    confirmed by a small detection around the predicted box.
+    Returns (tracks, results, detections_for_tracker), aligned; `results`
+    holds None for faces with a predicted box only.
+    """
+    tracker = stream.tracker
+    if tracker.should_detect():
+        # FaceEngine filters small faces; embeddings are computed later only where needed
+        results = detect_frame(stream, frame, factor) # returns list of {bbox, confidence, kps}
+        detections_for_tracker = [to_tracker_detection(res, factor) for res in results]
+        return tracker.assign(detections_for_tracker), results, detections_for_tracker
+
+    tracks = tracker.propagate()
+    if not ROI_REFINE:
+        # Prediction only: no landmarks, so no embedding this frame
+        detections_for_tracker = [{'bbox': track['bbox'], 'track_id': track['id']} for track in tracks]
+        return tracks, [None] * len(tracks), detections_for_tracker
+
+    rois = [[v / factor for v in track['bbox']] for track in tracks]
+    # When the ROIs are too spread out to pack, the fallback full-frame pass
+    # runs at the stream's current detector size, like a full detection would
+    target_size = stream.scale.size if stream.scale is not None else 640
+    confirmed, results, detections_for_tracker = [], [], []
+    for track, res in zip(tracks, engine.detect_in_rois(frame, rois, target_size=target_size,
+                                                        min_face=MIN_FACE_SIZE / factor)):
+        if res is None:
+            tracker.lose(track)
+            continue
+        det = to_tracker_detection(res, factor)
+        tracker.correct(track, det)
+        confirmed.append(track)
+        results.append(res)
+        detections_for_tracker.append(det)
+    return confirmed, results, detections_for_tracker
+
+def alignment_source(frame, factor, data, results):
+    """(image, results) to align faces from: the decoded frame, or a full-resolution
+    decode when a face is too small in a reduced one to fill an ArcFace crop."""
+    if factor == 1.0 or data is None or not any(
+            min(res['bbox'][2] - res['bbox'][0], res['bbox'][3] - res['bbox'][1]) < ALIGN_MIN_FACE for res in results):
+        return frame, results
+    with metrics.stage("decode_full"):
+        full, _ = decode_image(data)
+    if full is None:
+        return frame, results
+    return full, [to_tracker_detection(res, factor) for res in results]
+
+def recognize_frames(jobs):
+    """Recognizes several frames with one ArcFace pass and one gallery match.
+
+    jobs: list of (stream, frame, factor, frame bytes), at most one per stream.
+    Returns one list of stabilized tracker detections per job, or the exception
+    that job's detection raised; the other frames of the batch still complete.
+    """
+    with contextlib.ExitStack() as held:
+        # Each stream's tracks stay locked from association to the vote
+        for stream, _, _, _ in jobs:
+            held.enter_context(stream.lock)
+
+        # 1. Detect and track every frame
+        frames = []
+        face_images, face_results = [], []
+        for stream, frame, factor, data in jobs:
+            tracker = stream.tracker
+            try:
+                tracks, results, detections_for_tracker = track_frame(stream, frame, factor)
+
+                # 2. Only faces whose identity is new, Unknown, stale or disturbed need an embedding
+                # A gallery change (enroll, delete, reload) invalidates the identities tracks reuse
+                tracker.refresh_identities(gallery.generation, gallery.__contains__)
+                to_embed = [i for i, track in enumerate(tracks) if results[i] is not None and tracker.needs_embedding(track)]
+                source, embed_results = alignment_source(frame, factor, data, [results[i] for i in to_embed])
+            except Exception as e:
+                # Only this frame's request fails
+                frames.append(e)
+                continue
+            face_images += [source] * len(to_embed)
+            face_results += embed_results
+            frames.append((stream, tracks, detections_for_tracker, to_embed))
+            metrics.FACES_PER_FRAME.observe(len(tracks))
+        metrics.BATCH_SIZE.observe(len(jobs))
+
+        # 3. Align all faces of all frames into one crop batch, embed it in one
+        # pass, then score it against the gallery in one matmul
+        query_embs = engine.recognizer.get_embeddings(engine.align_faces(face_images, face_results))
+        if shared_gallery is not None:
+            # Cheap counter check right before matching, so a delete published
+            # while this batch was detecting is already honoured
+            shared_gallery.refresh()
+        with metrics.stage("gallery_match"):
+            matches = gallery.match(query_embs, k=5, pooling=MATCH_POOLING)
+
+        stabilized = []
+        pos = 0
+        for frame_state in frames:
+            if isinstance(frame_state, Exception):
+                stabilized.append(frame_state)
+                continue
+            stream, tracks, detections_for_tracker, to_embed = frame_state
+            for i in to_embed:
+                top_5 = matches[pos]
+                # Log Top-5
+                face_log.debug("Face Top-5: %s", top_5)
+                
+                # Best Match Strategy
+                best_score, best_match_usn = top_5[0] if top_5 else (-1.0, "Unknown")
+                
+                if best_score < SIMILARITY_THRESHOLD:
+                    best_match_usn = "Unknown"
+
+                detections_for_tracker[i].update({
+                    'usn': best_match_usn,
+                    'score': float(best_score),
+                    'embedding': query_embs[pos]
+                })
+                pos += 1
+
+            # 4. Update Tracker (Temporal Smoothing)
+            # Tracker updates 'stable_usn' from history; skipped faces reuse their track's identity
+            tracker = stream.tracker
+            stabilized.append([tracker.observe(track, det) for track, det in zip(tracks, detections_for_tracker)])
+            stream.frames += 1
+            log.debug("Stream %s: embedded %d/%d faces (skip rate %.2f)",
+                      stream.stream_id, len(to_embed), len(tracks), tracker.skip_rate)
+        return stabilized
+
+# Concurrent /recognize requests are queued and recognized together by one dispatcher thread
+batcher = MicroBatcher(recognize_frames, max_batch_size=BATCH_MAX_SIZE, batch_window=BATCH_WINDOW_MS / 1000.0,
+                       key=lambda job: job[0].stream_id) if RECOGNIZE_BATCHING else None
+
 @app.route("/recognize", methods=["POST"])
 def recognize():
     try:
-        data = request.get_json()
-        image_data = data["image"].split(",")[1]
-        image_bytes = base64.b64decode(image_data)
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        # Large frames decode at reduced size; `factor` maps boxes back to the original.
+        # Tiled detection needs the full resolution.
+        with metrics.stage("decode"):
+            data = read_frame_bytes()
+            frame, factor = decode_image(data, None if DET_TILE_SIZE else REDUCED_DECODE_TARGET)
+        if frame is None:
+            metrics.ERRORS.labels("recognize").inc()
+            log.warning("Recognition: could not decode a %d byte frame", len(data))
+            return jsonify([])
+        stream = streams.get(read_stream_id())
 
         start_time = time.time()
-        
-        # 1. Detect and Get Embeddings
-        # FaceEngine now returns aligned faces and filters small faces
-        results = engine.analyze(frame) # returns list of {bbox, embedding, confidence}
-        
-        logging.debug(f"Recognition: Detected {len(results)} faces")
 
-        detections_for_tracker = []
-        
-        # 2. Match against database (Preliminary)
-        for res in results:
-            query_emb = res["embedding"]
-            
-            # Compute scores against ALL known faces
-            all_scores = [] # (score, usn)
-            
-            for usn, stored_embs in known_embeddings.items():
-                for stored_emb in stored_embs:
-                    score = np.dot(query_emb, stored_emb) # vectors are normalized
-                    all_scores.append((float(score), usn))
-            
-            # Sort Top-5
-            all_scores.sort(key=lambda x: x[0], reverse=True)
-            top_5 = all_scores[:5]
-            
-            # Log Top-5
-            logging.debug(f"Face Top-5: {top_5}")
-            
-            # Best Match Strategy
-            best_score, best_match_usn = top_5[0] if top_5 else (-1.0, "Unknown")
-            
-            if best_score < SIMILARITY_THRESHOLD:
-                best_match_usn = "Unknown"
-                
-            # Prepare for tracker
-            # Tracker expects: {'bbox': [x1,y1,x2,y2], 'usn': str, 'score': float}
-            detections_for_tracker.append({
-                'bbox': res['bbox'],
-                'usn': best_match_usn,
-                'score': float(best_score),
-                'embedding': query_emb # Pass through (optional, used if we wanted tracker to re-id)
-            })
-
-        # 3. Update Tracker (Temporal Smoothing)
-        # Tracker will update 'stable_usn' based on history
-        stabilized_detections = tracker.update(detections_for_tracker)
+        # Static scene: reuse the stream's last result instead of running the models,
+        # unless the gallery changed since it was recognized
+        gate = stream.gate
+        if gate is not None and shared_gallery is not None:
+            shared_gallery.refresh()
+        generation = gallery.generation
+        thumb = gate.thumbnail(frame) if gate is not None else None
+        stabilized_detections = gate.lookup(thumb, generation) if gate is not None else None
+        cached = stabilized_detections is not None
+        if cached:
+            metrics.FRAMES.labels("cached").inc()
+            metrics.GATE_SAVED_SECONDS.inc(gate.cost)
+        else:
+            job = (stream, frame, factor, data)
+            if batcher is not None:
+                stabilized_detections = batcher.submit(job).result(timeout=BATCH_TIMEOUT)
+            else:
+                stabilized_detections = recognize_frames([job])[0]
+            if isinstance(stabilized_detections, Exception):
+                raise stabilized_detections
+            metrics.FRAMES.labels("recognized").inc()
+            if gate is not None:
+                gate.update(thumb, stabilized_detections, time.time() - start_time, generation)
         
         recognized_students = []
         for det in stabilized_detections:
@@ -258,7 +565,7 @@ def recognize():
             
             # If tracker says "Unknown" (majority vote was unknown)
             if final_usn == "Unknown":
-                print(f"Unknown face detected ({det['score']:.4f})")
+                face_log.info("Unknown face detected (%.4f)", det['score'])
             else:
                  recognized_students.append({
                     "usn": final_usn,
@@ -266,24 +573,52 @@ def recognize():
                     "bbox": det["bbox"],
                     "track_id": det.get('track_id', -1)
                 })
-                 print(f"Recognized {final_usn} ({det['score']:.4f}) [Track {det.get('track_id')}]")
+                 face_log.info("Recognized %s (%.4f) [Track %s]", final_usn, det['score'], det.get('track_id'))
 
         total_time = time.time() - start_time
-        logging.info(f"Inference took {total_time:.4f}s")
-        print(f"Inference took {total_time:.4f}s")
+        log.debug("Inference took %.4fs%s", total_time, " (cached)" if cached else "")
         
-        return jsonify(recognized_students)
+        response = jsonify(recognized_students)
+        response.headers["X-Result-Cached"] = "1" if cached else "0"
+        if not cached and stream.scale is not None and stream.scale.last_size is not None:
+            response.headers["X-Detector-Size"] = str(stream.scale.last_size)
+        return response
 
     except Exception as e:
-        logging.error(f"Recognition Error: {e}")
-        print(f"Recognition Error: {e}")
-        import traceback
-        traceback.print_exc()
+        metrics.ERRORS.labels("recognize").inc()
+        log.exception("Recognition Error: %s", e)
         return jsonify([])
 
+@app.route("/reload", methods=["POST"])
+def reload_faces():
+    """Syncs the gallery with faces/ now, as the background watcher does periodically."""
+    start_time = time.perf_counter()
+    changes = sync_gallery()
+    return jsonify(dict(changes, students=gallery.num_students, embeddings=gallery.num_embeddings,
+                        seconds=round(time.perf_counter() - start_time, 3)))
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus text format; counters and histograms are per worker process."""
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok", "message": "Optimized Face Engine Running"})
+    states = streams.states()
+    embedded = sum(state.tracker.embedded for state in states)
+    skipped = sum(state.tracker.skipped for state in states)
+    gates = [state.gate for state in states if state.gate is not None]
+    gated = sum(gate.skipped for gate in gates)
+    gate_total = gated + sum(gate.recognized for gate in gates)
+    return jsonify({
+        "status": "ok",
+        "message": "Optimized Face Engine Running",
+        "embedding_skip_rate": skipped / (embedded + skipped) if embedded + skipped else 0.0,
+        "frame_skip_rate": gated / gate_total if gate_total else 0.0,
+        "frame_gate_saved_seconds": metrics.GATE_SAVED_SECONDS.get(),
+        "detector_sizes": {state.stream_id: state.scale.size for state in states if state.scale is not None},
+        "detect_saved_seconds": metrics.DETECT_SAVED_SECONDS.get()
+    })
 
 if __name__ == "__main__":
     app.run(port=5006)
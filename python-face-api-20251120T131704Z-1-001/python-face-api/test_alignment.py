@@ -0,0 +1,99 @@
+"""Regression test: batch Umeyama alignment must agree with the per-face cv2 LMEDS transforms it replaced.
+
+Run with `python -m pytest test_alignment.py` or `python test_alignment.py`.
+"""
+import cv2
+import numpy as np
+
+from engine.alignment import ARCFACE_DST, align_batch, similarity_transforms
+
+
+def legacy_estimate_norm(lmk):
+    """The transform FaceEngine.estimate_norm computed before the batch solver."""
+    M, _ = cv2.estimateAffinePartial2D(lmk, ARCFACE_DST, method=cv2.LMEDS)
+    return M
+
+
+def random_landmarks(rng, n, noise):
+    """Template landmarks under random rotation, scale and shift, plus pixel noise."""
+    sets = []
+    for _ in range(n):
+        angle = rng.uniform(-0.6, 0.6)
+        scale = rng.uniform(0.5, 3.0)
+        R = scale * np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        shift = rng.uniform(60, 400, size=2)
+        sets.append((ARCFACE_DST - 56.0) @ R.T + shift + rng.normal(0, noise, size=(5, 2)))
+    return np.array(sets, dtype=np.float32)
+
+
+def apply(M, points):
+    return points @ M[:2, :2].T + M[:, 2]
+
+
+def test_exact_landmarks_match_legacy_transforms():
+    rng = np.random.default_rng(0)
+    landmarks = random_landmarks(rng, 100, noise=0.0)
+    M, valid = similarity_transforms(landmarks)
+    assert valid.all()
+    for m, lmk in zip(M, landmarks):
+        np.testing.assert_allclose(m, legacy_estimate_norm(lmk), atol=1e-3)
+
+
+def test_noisy_landmarks_close_to_legacy():
+    rng = np.random.default_rng(1)
+    landmarks = random_landmarks(rng, 300, noise=1.0)
+    M, _ = similarity_transforms(landmarks)
+    shifts, ours, legacy = [], [], []
+    for m, lmk in zip(M, landmarks):
+        ref = legacy_estimate_norm(lmk)
+        shifts.append(np.linalg.norm(apply(m, lmk) - apply(ref, lmk), axis=1).mean())
+        ours.append(np.sqrt(((apply(m, lmk) - ARCFACE_DST) ** 2).sum(axis=1).mean()))
+        legacy.append(np.sqrt(((apply(ref, lmk) - ARCFACE_DST) ** 2).sum(axis=1).mean()))
+    # Landmarks land within a pixel of where LMEDS puts them in the crop, and
+    # least squares never fits the template worse
+    assert np.median(shifts) < 0.1
+    assert np.percentile(shifts, 95) < 1.0
+    assert np.all(np.array(ours) <= np.array(legacy) + 1e-6)
+
+
+def test_align_batch_matches_legacy_warp():
+    rng = np.random.default_rng(2)
+    frame = rng.integers(0, 256, size=(480, 640, 3), dtype=np.uint8)
+    landmarks = random_landmarks(rng, 20, noise=0.0)
+    out = np.empty((20, 112, 112, 3), dtype=np.uint8)
+    crops = align_batch(frame, landmarks, out=out)
+    assert crops is out
+    for crop, lmk in zip(crops, landmarks):
+        legacy = cv2.warpAffine(frame, legacy_estimate_norm(lmk), (112, 112), borderValue=0.0)
+        assert np.abs(crop.astype(int) - legacy).mean() < 1.0
+
+
+def test_precomputed_transforms_give_same_crops():
+    rng = np.random.default_rng(3)
+    frame = rng.integers(0, 256, size=(480, 640, 3), dtype=np.uint8)
+    landmarks = random_landmarks(rng, 5, noise=1.0)
+    np.testing.assert_array_equal(align_batch(frame, landmarks, transforms=similarity_transforms(landmarks)),
+                                  align_batch(frame, landmarks))
+
+
+def test_degenerate_landmarks_fall_back_to_box():
+    frame = np.zeros((200, 200, 3), dtype=np.uint8)
+    frame[50:100, 50:100] = 200
+    landmarks = np.full((2, 5, 2), 75.0, dtype=np.float32)
+    _, valid = similarity_transforms(landmarks)
+    assert not valid.any()
+    crops = align_batch([frame, frame], landmarks, boxes=np.array([[50, 50, 100, 100], [0, 0, 0, 0]]))
+    assert (crops[0] == 200).all()
+    assert (crops[1] == 0).all()
+
+
+def test_empty_batch():
+    crops = align_batch(np.zeros((10, 10, 3), dtype=np.uint8), np.zeros((0, 5, 2), dtype=np.float32))
+    assert crops.shape == (0, 112, 112, 3)
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            fn()
+            print(f"{name}: ok")
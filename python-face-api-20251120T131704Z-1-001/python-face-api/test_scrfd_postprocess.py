@@ -0,0 +1,236 @@
+"""Regression test: SCRFDPostprocessor must reproduce the original per-stride decode + NMS loop.
+
+Run with `python -m pytest test_scrfd_postprocess.py` or `python test_scrfd_postprocess.py`.
+"""
+import numpy as np
+
+from engine.postprocess import SCRFDPostprocessor, merge_tiles, nms
+
+
+def legacy_nms(dets, thresh):
+    x1 = dets[:, 0]
+    y1 = dets[:, 1]
+    x2 = dets[:, 2]
+    y2 = dets[:, 3]
+    scores = dets[:, 4]
+
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+
+        w = np.maximum(0.0, xx2 - xx1 + 1)
+        h = np.maximum(0.0, yy2 - yy1 + 1)
+        inter = w * h
+        ovr = inter / (areas[i] + areas[order[1:]] - inter)
+
+        inds = np.where(ovr <= thresh)[0]
+        order = order[inds + 1]
+
+    return keep
+
+
+def legacy_decode(outs, final_h, final_w, scale, threshold, nms_threshold=0.4):
+    """The decode loop RetinaFace.detect_scrfd used before SCRFDPostprocessor."""
+    proposals = []
+    _feat_stride_fpn = [8, 16, 32]
+    _anchors_fpn = {8: [16, 32], 16: [64, 128], 32: [256, 512]}
+    output_map = {
+        8:  {'score': 0, 'bbox': 3, 'kps': 6},
+        16: {'score': 1, 'bbox': 4, 'kps': 7},
+        32: {'score': 2, 'bbox': 5, 'kps': 8}
+    }
+
+    for stride in _feat_stride_fpn:
+        anchors_size = _anchors_fpn[stride]
+        score_blob = outs[output_map[stride]['score']]
+        bbox_blob = outs[output_map[stride]['bbox']]
+        kps_blob = outs[output_map[stride]['kps']]
+
+        if len(score_blob.shape) == 3: score_blob = score_blob[0]
+        if len(bbox_blob.shape) == 3: bbox_blob = bbox_blob[0]
+        if len(kps_blob.shape) == 3: kps_blob = kps_blob[0]
+
+        fh = final_h // stride
+        fw = final_w // stride
+        num_anchors = len(anchors_size)
+        if score_blob.shape[0] != fh * fw * num_anchors:
+            continue
+
+        scores = score_blob[:, 0]
+        mask = scores > threshold
+        if not np.any(mask):
+            continue
+
+        scores = scores[mask]
+        bbox_blob = bbox_blob[mask]
+        kps_blob = kps_blob[mask]
+
+        grid_y, grid_x = np.meshgrid(np.arange(fh), np.arange(fw), indexing='ij')
+        grid_x_masked = np.repeat(grid_x.flatten(), num_anchors)[mask]
+        grid_y_masked = np.repeat(grid_y.flatten(), num_anchors)[mask]
+        proposals_anchor_sizes = np.tile(anchors_size, fh * fw)[mask]
+
+        cx = grid_x_masked * stride + stride / 2
+        cy = grid_y_masked * stride + stride / 2
+
+        tx = bbox_blob[:, 0]
+        ty = bbox_blob[:, 1]
+        tw = bbox_blob[:, 2]
+        th = bbox_blob[:, 3]
+        anchor_w = proposals_anchor_sizes
+        anchor_h = proposals_anchor_sizes
+
+        pred_cx = tx * 0.1 * anchor_w + cx
+        pred_cy = ty * 0.1 * anchor_h + cy
+        pred_w = np.exp(tw * 0.2) * anchor_w
+        pred_h = np.exp(th * 0.2) * anchor_h
+
+        x1 = pred_cx - pred_w / 2
+        y1 = pred_cy - pred_h / 2
+        x2 = pred_cx + pred_w / 2
+        y2 = pred_cy + pred_h / 2
+
+        kps = np.zeros_like(kps_blob)
+        for i in range(5):
+            kps[:, i*2] = kps_blob[:, i*2] * stride + cx
+            kps[:, i*2+1] = kps_blob[:, i*2+1] * stride + cy
+
+        dets = np.stack([x1, y1, x2, y2, scores], axis=1)
+        dets = np.concatenate([dets, kps], axis=1)
+        dets[:, :15] /= scale
+        proposals.append(dets)
+
+    if not proposals:
+        return []
+    proposals = np.concatenate(proposals, axis=0)
+    keep = legacy_nms(proposals, nms_threshold)
+    return proposals[keep]
+
+
+def fake_outputs(final_h, final_w, seed, num_faces=6, batch_dim=False):
+    """det_10g-shaped outputs with clusters of overlapping high-score anchors."""
+    rng = np.random.default_rng(seed)
+    scores, bboxes, kpss = [], [], []
+    for stride in (8, 16, 32):
+        fh, fw = final_h // stride, final_w // stride
+        n = fh * fw * 2
+        score = rng.uniform(0.0, 0.3, size=(n, 1)).astype(np.float32)
+        for _ in range(num_faces):
+            gy, gx = rng.integers(1, fh - 1), rng.integers(1, fw - 1)
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    a = ((gy + dy) * fw + (gx + dx)) * 2 + rng.integers(0, 2)
+                    score[a, 0] = rng.uniform(0.45, 0.99)
+        scores.append(score)
+        bboxes.append(rng.normal(0.0, 1.0, size=(n, 4)).astype(np.float32))
+        kpss.append(rng.normal(0.0, 1.5, size=(n, 10)).astype(np.float32))
+    outs = scores + bboxes + kpss
+    if batch_dim:
+        outs = [o[None] for o in outs]
+    return outs
+
+
+def assert_same(expected, actual):
+    if len(expected) == 0:
+        assert len(actual) == 0
+        return
+    assert actual.shape == expected.shape
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_matches_legacy_square_input():
+    post = SCRFDPostprocessor(nms_threshold=0.4)
+    for seed in range(5):
+        outs = fake_outputs(640, 640, seed)
+        for threshold in (0.4, 0.5):
+            expected = legacy_decode(outs, 640, 640, 0.5, threshold)
+            assert_same(expected, post(outs, 640, 640, 0.5, threshold))
+
+
+def test_matches_legacy_padded_input_with_batch_dim():
+    # 1280x720 frame -> 640x360 -> padded to 640x384
+    post = SCRFDPostprocessor(nms_threshold=0.4)
+    for seed in range(5):
+        outs = fake_outputs(384, 640, seed, batch_dim=True)
+        expected = legacy_decode(outs, 384, 640, 0.5, 0.4)
+        assert_same(expected, post(outs, 384, 640, 0.5, 0.4))
+
+
+def test_no_candidates():
+    post = SCRFDPostprocessor()
+    outs = fake_outputs(640, 640, 0, num_faces=0)
+    assert len(post(outs, 640, 640, 1.0, 0.5)) == 0
+    assert len(legacy_decode(outs, 640, 640, 1.0, 0.5)) == 0
+
+
+def test_mismatched_stride_is_skipped():
+    post = SCRFDPostprocessor()
+    outs = fake_outputs(640, 640, 1)
+    outs[1] = outs[1][:-2]  # stride 16 scores no longer match the grid
+    expected = legacy_decode(outs, 640, 640, 1.0, 0.4)
+    assert_same(expected, post(outs, 640, 640, 1.0, 0.4))
+
+
+def test_pre_nms_topk_caps_candidates():
+    post = SCRFDPostprocessor(pre_nms_topk=20)
+    outs = fake_outputs(640, 640, 2, num_faces=20)
+    dets = post.decode(outs, 640, 640, 1.0, 0.4)
+    assert len(dets) == 20
+    all_scores = np.concatenate([o[:, 0] for o in outs[:3]])
+    np.testing.assert_allclose(np.sort(dets[:, 4])[::-1], np.sort(all_scores)[::-1][:20])
+
+
+def test_anchor_cache_reused():
+    post = SCRFDPostprocessor()
+    first = post.anchors(640, 640, 8)
+    assert post.anchors(640, 640, 8) is first
+    assert post.anchors(384, 640, 8) is not first
+
+
+def test_nms_matches_legacy():
+    rng = np.random.default_rng(7)
+    xy = rng.uniform(0, 200, size=(300, 2))
+    wh = rng.uniform(10, 60, size=(300, 2))
+    dets = np.concatenate([xy, xy + wh, rng.uniform(0, 1, size=(300, 1))], axis=1)
+    for thresh in (0.3, 0.4, 0.6):
+        assert list(nms(dets, thresh)) == list(legacy_nms(dets, thresh))
+
+
+def test_nms_keeps_plus_one_area_convention():
+    # IoU is 50/150 = 0.33 with +1 pixel areas and 36/126 = 0.29 without
+    dets = np.array([
+        [0, 0, 9, 9, 0.9],
+        [5, 0, 14, 9, 0.8],
+    ], dtype=np.float64)
+    assert nms(dets, 0.3) == [0]
+    assert nms(dets, 0.34) == [0, 1]
+    assert list(legacy_nms(dets, 0.3)) == [0]
+
+
+def test_merge_tiles_prefers_whole_face_over_clipped():
+    # A face cut by a tile border (higher score, small IoU) next to its whole view
+    dets = np.array([
+        [100, 100, 125, 180, 0.9],   # clipped third
+        [100, 100, 180, 180, 0.8],   # whole face from the neighbouring tile
+        [400, 400, 480, 480, 0.7],   # unrelated face
+    ], dtype=np.float64)
+    clipped = np.array([True, False, False])
+    assert nms(dets, 0.4) == [0, 1, 2]
+    assert sorted(merge_tiles(dets, clipped, 0.4)) == [1, 2]
+    # A clipped box with no whole view survives
+    assert merge_tiles(dets[[0, 2]], clipped[[0, 2]], 0.4) == [1, 0]
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            fn()
+            print(f"{name}: ok")
@@ -0,0 +1,21 @@
+"""WSGI entry point for production servers.
+
+Batching (RECOGNIZE_BATCHING) gathers concurrent requests inside one
+process, so run a threaded worker, e.g.:
+
+    gunicorn -w 1 --threads 16 -b 0.0.0.0:5006 wsgi:app
+    waitress-serve --port=5006 --threads=16 wsgi:app
+
+Each worker process loads its own models, trackers and dispatcher thread, so
+more than one worker only makes sense behind a proxy that pins a camera's
+stream to one worker. Set SHARED_GALLERY_DIR in recognize_api.py so that the
+workers share one memory-mapped gallery and see each other's enrollments:
+
+    gunicorn -w 4 --threads 4 -b 0.0.0.0:5006 wsgi:app
+
+With --preload the models are loaded once and the workers fork from it;
+engine.log starts each worker's log writer thread after the fork.
+"""
+from recognize_api import app
+
+application = app